@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+from scoring import CRITERIA, SEVERITY_LEVELS, get_scale, severity_from_score
+
+
+# Сводные показатели по реестру визитов, обновляемые по мере расчёта:
+# число визитов по тяжести, гистограмма суммы баллов, число выборов каждого
+# варианта каждого критерия (из них — суммы и средние вклады критериев)
+# и таблица совпадения тяжести FUSS/AUSS для визитов, оценённых по обеим шкалам.
+# Каждый визит добавляется (sign=+1) или вычитается (sign=-1) за O(число критериев);
+# показ сводки не зависит от числа визитов.
+#
+# Постоянное хранение — таблица aggregates в timeline.Timeline (строки kind/key/n,
+# см. rows()/from_rows()).
+
+N_LEVELS = len(SEVERITY_LEVELS)
+
+
+class ScaleAggregates:
+    def __init__(self, scale: str):
+        compiled = get_scale(scale)
+        self.scale = compiled.name
+        self.visits = 0
+        self.critical = 0
+        self.severity = [0] * N_LEVELS
+        self.scores: Dict[int, int] = {}
+        # options[i][code] — сколько раз выбран вариант code критерия i
+        self.options = [[0] * len(CRITERIA[key].options) for key in compiled.keys]
+
+    def add(self, codes: Sequence[int], score: int, critical: bool, sign: int = 1) -> None:
+        self.visits += sign
+        self.critical += sign if critical else 0
+        self.severity[SEVERITY_LEVELS.index(severity_from_score(score, self.scale, critical=critical))] += sign
+        n = self.scores.get(score, 0) + sign
+        if n:
+            self.scores[score] = n
+        else:
+            self.scores.pop(score, None)
+        for counts, code in zip(self.options, codes):
+            counts[code] += sign
+
+    def add_batch(self, codes: Any, score: Any, critical: Any, severity: Any) -> None:
+        # Пачка из batch/records: коды n × k (uint8), суммы, критичность, индексы тяжести
+        import numpy as np
+
+        codes = np.asarray(codes)
+        score = np.asarray(score, dtype=np.int64)
+        self.visits += len(score)
+        self.critical += int(np.count_nonzero(critical))
+        for level, n in enumerate(np.bincount(np.asarray(severity, dtype=np.int64), minlength=N_LEVELS)):
+            self.severity[level] += int(n)
+        if len(score):
+            low = int(score.min())
+            for value, n in enumerate(np.bincount(score - low), start=low):
+                if n:
+                    self.scores[value] = self.scores.get(value, 0) + int(n)
+        for i, counts in enumerate(self.options):
+            for code, n in enumerate(np.bincount(codes[:, i], minlength=len(counts))):
+                counts[code] += int(n)
+
+    def merge(self, other: "ScaleAggregates") -> None:
+        if other.scale != self.scale:
+            raise ValueError(f"Нельзя объединить сводки {self.scale} и {other.scale}")
+        self.visits += other.visits
+        self.critical += other.critical
+        self.severity = [a + b for a, b in zip(self.severity, other.severity)]
+        for score, n in other.scores.items():
+            self.scores[score] = self.scores.get(score, 0) + n
+        for mine, theirs in zip(self.options, other.options):
+            for code, n in enumerate(theirs):
+                mine[code] += n
+
+    # --- показатели -------------------------------------------------------------
+
+    @property
+    def severity_counts(self) -> Dict[str, int]:
+        return dict(zip(SEVERITY_LEVELS, self.severity))
+
+    @property
+    def score_histogram(self) -> Dict[int, int]:
+        return dict(sorted(self.scores.items()))
+
+    @property
+    def mean_score(self) -> float:
+        return sum(s * n for s, n in self.scores.items()) / self.visits if self.visits else 0.0
+
+    def score_quantile(self, q: float) -> int:
+        target = q * self.visits
+        seen = 0
+        for score, n in sorted(self.scores.items()):
+            seen += n
+            if seen >= target:
+                return score
+        return 0
+
+    def criterion_sums(self) -> Dict[str, int]:
+        compiled = get_scale(self.scale)
+        return {
+            label: sum(p * n for p, n in zip(points, counts))
+            for label, points, counts in zip(compiled.labels, compiled.points, self.options)
+        }
+
+    def criterion_means(self) -> Dict[str, float]:
+        return {label: (s / self.visits if self.visits else 0.0) for label, s in self.criterion_sums().items()}
+
+    def option_counts(self) -> Dict[str, Dict[Any, int]]:
+        compiled = get_scale(self.scale)
+        return {
+            label: dict(zip(CRITERIA[key].options, counts))
+            for key, label, counts in zip(compiled.keys, compiled.labels, self.options)
+        }
+
+
+class Aggregates:
+    def __init__(self, scales: Iterable[str] = ("FUSS", "AUSS")):
+        self.scales: Dict[str, ScaleAggregates] = {name: ScaleAggregates(name) for name in scales}
+        # agreement[FUSS][AUSS] — число визитов с такой парой тяжестей
+        self.agreement = [[0] * N_LEVELS for _ in range(N_LEVELS)]
+
+    def __getitem__(self, scale: str) -> ScaleAggregates:
+        return self.scales[scale]
+
+    def _scale(self, scale: str) -> ScaleAggregates:
+        agg = self.scales.get(scale)
+        if agg is None:
+            agg = self.scales[scale] = ScaleAggregates(scale)
+        return agg
+
+    def add(self, scale: str, codes: Sequence[int], score: int, critical: bool, sign: int = 1) -> None:
+        self._scale(scale).add(codes, score, critical, sign)
+
+    def add_pair(self, fuss_level: int, auss_level: int, sign: int = 1) -> None:
+        self.agreement[fuss_level][auss_level] += sign
+
+    def add_store(self, store: Any) -> None:
+        # records.ResultStore целиком (без создания объектов на визит)
+        self._scale(store.scale).add_batch(*store.as_numpy())
+
+    def merge(self, other: "Aggregates") -> None:
+        for name, agg in other.scales.items():
+            self._scale(name).merge(agg)
+        for mine, theirs in zip(self.agreement, other.agreement):
+            for j, n in enumerate(theirs):
+                mine[j] += n
+
+    @property
+    def visits(self) -> int:
+        return sum(agg.visits for agg in self.scales.values())
+
+    # --- совпадение FUSS/AUSS -----------------------------------------------------
+
+    @property
+    def pairs(self) -> int:
+        return sum(map(sum, self.agreement))
+
+    def agreement_rate(self) -> float:
+        total = self.pairs
+        return sum(self.agreement[i][i] for i in range(N_LEVELS)) / total if total else 0.0
+
+    def kappa(self, weighted: bool = False) -> float:
+        # Каппа Коэна; weighted=True — квадратичные веса (тяжесть — порядковая шкала)
+        total = self.pairs
+        if not total:
+            return 0.0
+        rows = [sum(r) / total for r in self.agreement]
+        cols = [sum(self.agreement[i][j] for i in range(N_LEVELS)) / total for j in range(N_LEVELS)]
+        span = (N_LEVELS - 1) ** 2
+        observed = expected = 0.0
+        for i in range(N_LEVELS):
+            for j in range(N_LEVELS):
+                w = ((i - j) ** 2 / span) if weighted else float(i != j)
+                observed += w * self.agreement[i][j] / total
+                expected += w * rows[i] * cols[j]
+        return 1.0 - observed / expected if expected else 1.0
+
+    # --- хранение ------------------------------------------------------------------
+
+    def rows(self) -> List[Tuple[str, str, int, int]]:
+        # (шкала, вид, ключ, n) — формат таблицы aggregates в timeline
+        out: List[Tuple[str, str, int, int]] = []
+        for name, agg in self.scales.items():
+            out.append((name, "visits", 0, agg.visits))
+            out.append((name, "critical", 0, agg.critical))
+            out += [(name, "severity", level, n) for level, n in enumerate(agg.severity)]
+            out += [(name, "score", score, n) for score, n in agg.scores.items()]
+            out += [
+                (name, "option", (i << 8) | code, n)
+                for i, counts in enumerate(agg.options) for code, n in enumerate(counts)
+            ]
+        out += [
+            ("", "agreement", i * N_LEVELS + j, n)
+            for i, row in enumerate(self.agreement) for j, n in enumerate(row)
+        ]
+        return [row for row in out if row[3]]
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str, int, int]]) -> "Aggregates":
+        out = cls()
+        for scale, kind, key, n in rows:
+            if kind == "agreement":
+                out.agreement[key // N_LEVELS][key % N_LEVELS] += n
+                continue
+            agg = out._scale(scale)
+            if kind == "visits":
+                agg.visits += n
+            elif kind == "critical":
+                agg.critical += n
+            elif kind == "severity":
+                agg.severity[key] += n
+            elif kind == "score":
+                if agg.scores.get(key, 0) + n:
+                    agg.scores[key] = agg.scores.get(key, 0) + n
+                else:
+                    agg.scores.pop(key, None)
+            elif kind == "option":
+                agg.options[key >> 8][key & 0xFF] += n
+        return out
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "visits": self.visits,
+            "scales": {
+                name: {
+                    "visits": agg.visits,
+                    "critical": agg.critical,
+                    "mean_score": agg.mean_score,
+                    "severity": agg.severity_counts,
+                    "scores": {str(s): n for s, n in agg.score_histogram.items()},
+                    "criterion_means": agg.criterion_means(),
+                }
+                for name, agg in self.scales.items()
+            },
+            "agreement": {
+                "pairs": self.pairs,
+                "matrix": self.agreement,
+                "rate": self.agreement_rate(),
+                "kappa": self.kappa(),
+                "kappa_quadratic": self.kappa(weighted=True),
+            },
+        }
+
+    def dumps(self) -> str:
+        return json.dumps(self.to_json(), ensure_ascii=False, indent=2)
+
+
+def aggregate_timeline(path: str) -> Aggregates:
+    # Сводка реестра (timeline.Timeline) без чтения визитов
+    from timeline import Timeline
+
+    with Timeline(path) as tl:
+        return tl.aggregates()
+
@@ -1,107 +1,110 @@
+import os
+import uuid
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
+
 import streamlit as st
-from scoring import (
-    compute_fuss, compute_auss,
-    severity_from_score, recommend_treatment,
-    format_report_docx_web
-)
+from cache import ScoringCache
+from explain import explain, option_text
+from scoring import format_report_docx_local, format_report_docx_web, report_filename_local, report_filename_web, scale_context
+
+ASSETS = Path(__file__).parent / "assets"
+# Локальная редакция: файл зашифрованной картотеки (local_store). Без него —
+# веб-версия, которая не принимает и не хранит персональные данные
+LOCAL_STORE = os.environ.get("AUSSFUSS_LOCAL_STORE")
+# Журнал аудита: каждое нажатие «Рассчитать» (audit.AuditLog)
+AUDIT_LOG = os.environ.get("AUSSFUSS_AUDIT_LOG")
+# Реестр визитов для аналитики (timeline.Timeline, страница «Аналитика реестра»)
+REGISTRY = os.environ.get("AUSSFUSS_REGISTRY")
 
 st.set_page_config(page_title="AUSS/FUSS", layout="centered")
 
-st.markdown("""<style>
-/* Brand palette */
-:root{
-  --aussfuss-purple:#7A4BAE;
-  --aussfuss-green:#4BAF8B;
-  --aussfuss-green-bg:#E9F7EF;
-  --aussfuss-text:#0F172A;
-}
-
-/* App background */
-div[data-testid="stAppViewContainer"]{
-  background: var(--aussfuss-green-bg) !important;
-}
-header[data-testid="stHeader"]{
-  background: rgba(233,247,239,0.85) !important;
-}
-
-/* Layout */
-.block-container{
-  padding-top: 1.2rem !important;
-  padding-bottom: 2rem !important;
-  max-width: 980px !important;
-}
-
-/* Criteria labels (bigger than options) */
-div[data-testid="stWidgetLabel"] > label p,
-div[data-testid="stWidgetLabel"] p{
-  font-size: 20px !important;
-  font-weight: 800 !important;
-  color: var(--aussfuss-text) !important;
-  margin-bottom: 0.15rem !important;
-}
-
-/* Options text */
-div[role="radiogroup"] label p,
-div[role="listbox"] li,
-div[data-baseweb="select"] span,
-div[data-testid="stSelectbox"] p,
-div[data-testid="stMultiSelect"] p{
-  font-size: 16px !important;
-  font-weight: 400 !important;
-  color: var(--aussfuss-text) !important;
-}
-
-/* Checkbox label (breakdown) — smaller and not bold */
-div[data-testid="stCheckbox"] label p{
-  font-size: 14px !important;
-  font-weight: 400 !important;
-}
-
-/* Buttons */
-div.stButton > button{
-  background: var(--aussfuss-purple) !important;
-  color: white !important;
-  border-radius: 12px !important;
-  border: 0 !important;
-  padding: 0.65rem 1.1rem !important;
-}
-div.stButton > button:hover{ filter: brightness(0.95); }
-
-/* Result box */
-.result-box{
-  border-left: 6px solid var(--aussfuss-purple) !important;
-  background: #f5f3ff !important;
-  padding: 14px 14px !important;
-  border-radius: 14px !important;
-}
-
-/* Tabs */
-button[data-baseweb="tab"] p{
-  font-size: 16px !important;
-  font-weight: 700 !important;
-  color: var(--aussfuss-text) !important;
-}
-button[data-baseweb="tab"][aria-selected="true"] p{ color: var(--aussfuss-purple) !important; }
-div[data-baseweb="tab-highlight"]{ background-color: var(--aussfuss-purple) !important; }
-div[data-baseweb="tab-list"]{ border-bottom: 1px solid rgba(15,23,42,0.12) !important; }
-
-/* Remove red error accents if any */
-.stAlert, .stException{
-  border-left-color: var(--aussfuss-purple) !important;
-}
-
-/* Title branding */
-.aussfuss-title{font-size:54px;font-weight:900;letter-spacing:0.4px;line-height:1;margin:0 0 6px 0;}
-.aussfuss-title .purple{color:var(--aussfuss-purple);}
-.aussfuss-title .green{color:var(--aussfuss-green);}
-.aussfuss-title .divider{color:rgba(15,23,42,0.55);font-weight:800;padding:0 10px;}
-.aussfuss-subtitle{font-size:20px;font-weight:700;opacity:0.9;margin:0 0 16px 0;}
-/* Breakdown title (smaller, not bold) */
-.breakdown-title{font-size:14px;font-weight:500;opacity:0.85;margin:6px 0 6px 0;}
-
-</style>""",
-    unsafe_allow_html=True
-)
+
+# Статические ресурсы и кэш расчётов — один раз на процесс сервера
+@st.cache_resource
+def _asset_text(name: str) -> str:
+    return (ASSETS / name).read_text(encoding="utf-8")
+
+
+@st.cache_resource
+def _scoring_cache() -> ScoringCache:
+    return ScoringCache(maxsize=4096)
+
+
+@st.cache_resource
+def _audit_log():
+    from audit import AuditLog
+
+    return AuditLog(AUDIT_LOG, flush_interval=0.5)
+
+
+# Протокол формируется только при нажатии «Скачать» и кэшируется по содержимому
+@st.cache_data(max_entries=256, show_spinner=False)
+def _report_docx(scale: str, score: int, severity: str, recommendation: str, breakdown: tuple | None) -> bytes:
+    data, _ = format_report_docx_web(scale, score, severity, recommendation, dict(breakdown) if breakdown else None)
+    return data
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _report_docx_local(patient_name: str, patient_id: str, scale: str, score: int, severity: str, recommendation: str,
+                       breakdown: tuple | None) -> bytes:
+    data, _ = format_report_docx_local(patient_name, patient_id, scale, score, severity, recommendation,
+                                       dict(breakdown) if breakdown else None)
+    return data
+
+
+def _save_visit(patient_name: str, patient_id: str, scale: str, ctx: dict, breakdown: bool) -> None:
+    # Соединение SQLite привязано к потоку сценария, поэтому картотека открывается на одно сохранение
+    from local_store import LocalStore
+
+    try:
+        with LocalStore(LOCAL_STORE, st.session_state.get("store_key", "")) as store:
+            visit = store.add_visit(patient_id, patient_name, scale, ctx, breakdown=breakdown)
+    except (ValueError, RuntimeError) as e:
+        st.session_state[f"saved_{scale}"] = ("error", str(e))
+    else:
+        st.session_state[f"saved_{scale}"] = ("success", f"Визит сохранён в картотеку (№{visit.id})")
+
+
+def _register_visit(patient_id: str, scales: list, ctx: dict) -> None:
+    # Как и картотека, реестр открывается на одну запись (SQLite привязан к потоку).
+    # Без ID каждый расчёт — отдельный пациент: FUSS и AUSS одного расчёта остаются парой
+    from timeline import Timeline
+
+    patient = patient_id.strip() or f"web-{uuid.uuid4().hex}"
+    visited_at = datetime.now(timezone.utc)
+    with Timeline(REGISTRY) as tl:
+        tl.add_visits((patient, scale, scale_context(ctx, scale), visited_at) for scale in scales)
+
+
+def _show_explanation(ex) -> None:
+    # Какие одиночные правки анкеты меняют степень тяжести или рекомендацию
+    margins = []
+    if ex.to_upgrade is not None:
+        margins.append(f"до следующей степени: +{ex.to_upgrade}")
+    if ex.to_downgrade is not None:
+        margins.append(f"до предыдущей: −{ex.to_downgrade}")
+    st.markdown("<div class='breakdown-title'>Что изменит результат</div>", unsafe_allow_html=True)
+    if margins:
+        st.caption("Баллы " + ", ".join(margins))
+    rows = [
+        {
+            "Критерий": e.label,
+            "Ответ": f"{option_text(e.key, e.current)} → {option_text(e.key, e.value)}",
+            "Баллы": f"{e.delta:+d} (= {e.score})",
+            "Степень тяжести": e.severity,
+            "Рекомендация": "изменится" if e.recommendation_changed else "",
+        }
+        for e in ex.changing()
+    ]
+    if rows:
+        st.dataframe(rows, hide_index=True)
+    else:
+        st.caption("Ни одна замена одного ответа не меняет степень тяжести и рекомендацию.")
+
+
+st.markdown(f"<style>{_asset_text('app.css')}</style>", unsafe_allow_html=True)
 
 col_title = st.container()
 
@@ -118,7 +121,10 @@ with col_title:
 
 left, right = st.columns([3,1], vertical_alignment="center")
 with left:
-    st.markdown('<span class="pill">Веб-версия (без персональных данных)</span>', unsafe_allow_html=True)
+    if LOCAL_STORE:
+        st.markdown('<span class="pill">Локальная версия (картотека пациентов)</span>', unsafe_allow_html=True)
+    else:
+        st.markdown('<span class="pill">Веб-версия (без персональных данных)</span>', unsafe_allow_html=True)
 with right:
     show_breakdown = st.checkbox("Разложение по баллам", value=False)
 
@@ -136,6 +142,11 @@ with tabs[0]:
         ["AUSS (акантамебная этиология)", "FUSS (грибковая этиология)", "Неизвестно (посчитать обе шкалы)"],
         index=0
     )
+    patient_name = patient_id = ""
+    if LOCAL_STORE:
+        patient_name = st.text_input("ФИО пациента")
+        patient_id = st.text_input("ID/№карты")
+        st.text_input("Пароль картотеки", type="password", key="store_key")
 
 def crit(txt: str):
     st.markdown(f'<div class="crit">{txt}</div>', unsafe_allow_html=True)
@@ -353,61 +364,82 @@ base = dict(
     pachy_uneven=pachy_uneven
 )
 
-if calc:
-    results = []
+# Одна анкета на все выбранные шкалы: скорость прогрессирования у шкал своя
+# (progress_speed_f/_a), остальные общие поля разбираются один раз
+scales = []
+ctx = dict(base)
+if etiology in ["FUSS (грибковая этиология)", "Неизвестно (посчитать обе шкалы)"]:
+    ctx.update(dict(
+        fungal_form=fungal_form,
+        progress_speed_f=progress_speed_f,
+        hyphae=hyphae,
+        hyphae_depth=hyphae_depth,
+    ))
+    scales.append("FUSS")
+
+if etiology in ["AUSS (акантамебная этиология)", "Неизвестно (посчитать обе шкалы)"]:
+    ctx.update(dict(
+        amoeba_form=amoeba_form,
+        pseudo_dendrite=pseudo_dendrite,
+        ring=ring,
+        rk_clin=rk_clin,
+        delay_therapy=delay_therapy,
+        progress_speed_a=progress_speed_a,
+        cysts=cysts, troph=troph, rk_conf=rk_conf
+    ))
+    scales.append("AUSS")
+
+# Снимок анкеты: результаты показываются, пока форма совпадает с рассчитанной,
+# поэтому перерисовка (например, переключение разложения) не пересчитывает шкалы
+snapshot = (etiology, tuple(scales), tuple(ctx.items()))
 
-    if etiology in ["FUSS (грибковая этиология)", "Неизвестно (посчитать обе шкалы)"]:
-        ctx_f = dict(base)
-        ctx_f.update(dict(
-            fungal_form=fungal_form,
-            progress_speed=progress_speed_f,
-            hyphae=hyphae,
-            hyphae_depth=hyphae_depth,
-        ))
-        res = compute_fuss(ctx_f)
-        sev = severity_from_score(res.score, "FUSS", critical=res.critical)
-        rec = recommend_treatment("FUSS", sev, res.score, ctx_f, critical=res.critical)
-        results.append(("FUSS", res, sev, rec))
-
-    if etiology in ["AUSS (акантамебная этиология)", "Неизвестно (посчитать обе шкалы)"]:
-        ctx_a = dict(base)
-        ctx_a.update(dict(
-            amoeba_form=amoeba_form,
-            pseudo_dendrite=pseudo_dendrite,
-            ring=ring,
-            rk_clin=rk_clin,
-            delay_therapy=delay_therapy,
-            progress_speed=progress_speed_a,
-            cysts=cysts, troph=troph, rk_conf=rk_conf
-        ))
-        res = compute_auss(ctx_a)
-        sev = severity_from_score(res.score, "AUSS", critical=res.critical)
-        rec = recommend_treatment("AUSS", sev, res.score, ctx_a, critical=res.critical)
-        results.append(("AUSS", res, sev, rec))
-
-    for scale, res, sev, rec in results:
-        st.markdown(f"## Результат — {scale}")
-        c1, c2 = st.columns(2)
-        c1.metric("Сумма баллов", res.score)
-        c2.metric("Степень тяжести", sev)
-
-        st.markdown("## Рекомендации")
-        st.markdown('<div class="result-box">', unsafe_allow_html=True)
-        st.write(rec)
-        st.markdown('</div>', unsafe_allow_html=True)
-
-        if show_breakdown:
-            st.markdown("<div class='breakdown-title'>Разложение баллов</div>", unsafe_allow_html=True)
-            st.json(res.breakdown, expanded=False)
-
-        docx_bytes, filename = format_report_docx_web(
-    scale=scale,
-    score=res.score,
-    severity=sev,
-    recommendation=rec,
-    breakdown=res.breakdown if show_breakdown else None
-)
-
-        st.download_button("Скачать протокол (DOCX)", data=docx_bytes, file_name=filename,
-                           mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
-        st.divider()
+if calc:
+    computed = []
+    for scale, outcome in zip(scales, _scoring_cache().evaluate_scales(scales, ctx)):
+        if isinstance(outcome, Exception):
+            raise outcome
+        if AUDIT_LOG:
+            _audit_log().record_context(scale, ctx, outcome, source="app")
+        computed.append((scale,) + outcome)
+    if REGISTRY:
+        _register_visit(patient_id, scales, ctx)
+    st.session_state["aussfuss_results"] = (snapshot, computed)
+
+stored = st.session_state.get("aussfuss_results")
+results = stored[1] if stored and stored[0] == snapshot else []
+
+for scale, res, sev, rec in results:
+    st.markdown(f"## Результат — {scale}")
+    c1, c2 = st.columns(2)
+    c1.metric("Сумма баллов", res.score)
+    c2.metric("Степень тяжести", sev)
+
+    st.markdown("## Рекомендации")
+    st.markdown('<div class="result-box">', unsafe_allow_html=True)
+    st.write(rec)
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    if show_breakdown:
+        st.markdown("<div class='breakdown-title'>Разложение баллов</div>", unsafe_allow_html=True)
+        st.json(res.breakdown, expanded=False)
+        _show_explanation(explain(scale, scale_context(ctx, scale)))
+
+    breakdown = tuple(res.breakdown.items()) if show_breakdown else None
+    if LOCAL_STORE:
+        report = partial(_report_docx_local, patient_name, patient_id, scale, res.score, sev, rec, breakdown)
+        filename = report_filename_local(patient_name, patient_id, scale)
+    else:
+        report = partial(_report_docx, scale, res.score, sev, rec, breakdown)
+        filename = report_filename_web(scale)
+    st.download_button("Скачать протокол (DOCX)",
+                       data=report,
+                       file_name=filename,
+                       mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                       key=f"download_{scale}", on_click="ignore")
+    if LOCAL_STORE:
+        st.button("Сохранить в картотеку", key=f"save_{scale}",
+                  on_click=_save_visit, args=(patient_name, patient_id, scale, ctx, show_breakdown))
+        saved = st.session_state.pop(f"saved_{scale}", None)
+        if saved is not None:
+            getattr(st, saved[0])(saved[1])
+    st.divider()
@@ -0,0 +1,460 @@
+from __future__ import annotations
+
+import atexit
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from scoring import (
+    CRITERIA,
+    SCALE_VERSIONS,
+    SCALES,
+    SEVERITY_LEVELS,
+    canonical_codes,
+    debridement_inputs,
+    get_scale,
+    scale_context,
+    scale_fingerprint,
+    score_encoded,
+    severity_from_score,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: один пишущий процесс на журнал
+    fcntl = None
+
+
+# Журнал аудита расчётов (только дозапись): каждое нажатие «Рассчитать» и каждый
+# расчёт пакетной обработки — одна запись фиксированной длины (64 байта) вместо JSON.
+#
+# Заголовок (64 байта): сигнатура, формат, длина записи, ширина поля кодов и список
+# шкал журнала (номер шкалы в записи — позиция в этом списке).
+# Запись:
+#   время (unix, double), ссылка (номер строки выгрузки, визита; 0 — нет),
+#   версия шкалы (первые 32 бита scale_fingerprint), сумма баллов,
+#   источник (SOURCES), номер шкалы, флаги (бит 0 — критичность, биты 1-2 — тяжесть),
+#   входы выбора кросслинкинга (encode_inputs), коды анкеты (до 32 критериев, хвост 0xFF),
+#   CRC32 текста рекомендации, CRC32 самой записи.
+# Текст рекомендации не хранится: он однозначно восстанавливается по тяжести,
+# критичности и входам выбора кросслинкинга, а CRC позволяет заметить его изменение.
+#
+# Запись буферизуется и сбрасывается на диск пачкой с одним fsync — по заполнению
+# буфера, раз в flush_interval секунд (фоновый поток) и при закрытии.
+# Запись, оборванная сбоем, не удаляется: перед следующей пачкой хвост дополняется
+# нулями до границы записи (читатель отметит её как повреждённую по CRC).
+#
+# AuditReader читает журнал через mmap; replay пересчитывает каждую запись
+# по действующему scoring.py (по той версии правил, по которой она была
+# посчитана, если эта версия описана) и сообщает о расхождениях.
+
+AUDIT_FORMAT = 1
+MAGIC = b"AUSSAUD\x00"
+CODES_WIDTH = 32
+HEADER = struct.Struct("<8sHHH50s")
+RECORD = struct.Struct("<dIIhBBBB32sI2xI")
+# Запись без CRC (CRC считается по этим байтам и дописывается следом)
+_BODY = struct.Struct(RECORD.format[:-1])
+SOURCES: Tuple[str, ...] = ("app", "batch", "store", "service")
+# Биты входов выбора кросслинкинга: толщина в норме (1), локализация (2),
+# тотальное бельмо (1), отёк (2)
+_LOCALIZATIONS = CRITERIA["localization"].options
+_CHECKED = _BODY.size
+_SOURCE_IDS = {name: i for i, name in enumerate(SOURCES)}
+_SEVERITY_IDS = {level: i for i, level in enumerate(SEVERITY_LEVELS)}
+_PADDING = tuple(b"\xff" * (CODES_WIDTH - n) for n in range(CODES_WIDTH + 1))
+
+assert HEADER.size == 64 and RECORD.size == 64
+assert max(len(get_scale(name).keys) for name in SCALES) <= CODES_WIDTH
+
+
+def scale_version(scale: str, version: Optional[str] = None) -> int:
+    return int(scale_fingerprint(scale, version)[:8], 16)
+
+
+def known_versions() -> Dict[Tuple[str, int], str]:
+    # (шкала, версия в журнале) -> имя описанной версии правил (scoring.SCALE_VERSIONS)
+    return {(scale, scale_version(scale, version)): version for scale in SCALES for version in SCALE_VERSIONS[scale]}
+
+
+def encode_inputs(inputs: Tuple[Any, ...]) -> int:
+    thickness_ok, localization, total_leucoma, edema = inputs
+    if localization not in _LOCALIZATIONS or total_leucoma not in (0, 1) or edema not in (0, 1, 2):
+        raise ValueError(f"Входы выбора кросслинкинга вне допустимых значений: {inputs!r}")
+    return int(bool(thickness_ok)) | _LOCALIZATIONS.index(localization) << 1 | int(total_leucoma) << 3 | int(edema) << 4
+
+
+def decode_inputs(value: int) -> Tuple[bool, str, int, int]:
+    return bool(value & 1), _LOCALIZATIONS[value >> 1 & 3], value >> 3 & 1, value >> 4 & 3
+
+
+def recommendation_crc(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def _read_header(data: bytes, path: str) -> Tuple[str, ...]:
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path}: не журнал аудита AUSS/FUSS")
+    magic, fmt, size, width, names = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path}: не журнал аудита AUSS/FUSS")
+    if (fmt, size, width) != (AUDIT_FORMAT, RECORD.size, CODES_WIDTH):
+        raise ValueError(f"{path}: неподдерживаемый формат журнала аудита ({fmt})")
+    return tuple(names.rstrip(b"\x00").decode("ascii").split(","))
+
+
+@contextmanager
+def _locked(fd: int) -> Iterator[None]:
+    # Несколько процессов (приложение и пакетный расчёт) дописывают журнал по очереди
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+class AuditLog:
+    def __init__(self, path: str, flush_records: int = 1024, flush_interval: float = 1.0):
+        if flush_records <= 0:
+            raise ValueError("flush_records должен быть положительным")
+        self.path = path
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        # Записано на диск (с fsync) событий и пачек
+        self.written = 0
+        self.syncs = 0
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0), 0o600)
+        try:
+            self.scales = self._open_header()
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self._ids = {name: i for i, name in enumerate(self.scales)}
+        self._versions = {name: scale_version(name) for name in SCALES}
+        # Вариантов входов кросслинкинга и текстов рекомендаций немного — их коды запоминаются
+        self._inputs: Dict[Tuple[Any, ...], int] = {}
+        self._crcs: Dict[str, int] = {}
+        self._buffer = bytearray()
+        self._pending = 0
+        # _lock — буфер, _io — запись и fsync: пока идёт fsync, события копятся в следующую пачку
+        self._lock = threading.Lock()
+        self._io = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[OSError] = None
+        self._closed = False
+        atexit.register(self.close)
+
+    def _open_header(self) -> Tuple[str, ...]:
+        with _locked(self._fd):
+            if os.fstat(self._fd).st_size == 0:
+                scales = tuple(SCALES)
+                names = ",".join(scales).encode("ascii")
+                _write_all(self._fd, HEADER.pack(MAGIC, AUDIT_FORMAT, RECORD.size, CODES_WIDTH, names))
+                os.fsync(self._fd)
+                return scales
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            return _read_header(os.read(self._fd, HEADER.size), self.path)
+
+    def record(self, scale: str, codes: Sequence[int], inputs: Tuple[Any, ...], outcome: Tuple[Any, str, str],
+               source: str = "app", ref: int = 0, at: Optional[float] = None) -> None:
+        # outcome — (ScoreResult, тяжесть, рекомендация), как у ScoringCache.evaluate;
+        # codes — canonical_codes шкалы, inputs — debridement_inputs анкеты
+        if self._closed:
+            raise ValueError("Журнал аудита закрыт")
+        if self._error is not None:
+            # Сбой фоновой записи: события остались в буфере, расчёт без журнала не продолжается
+            error, self._error = self._error, None
+            raise error
+        res, severity, recommendation = outcome
+        scale_id = self._ids.get(scale)
+        if scale_id is None:
+            raise ValueError(f"Шкала {scale} не описана в журнале {self.path}; начните новый журнал")
+        packed_inputs = self._inputs.get(inputs)
+        if packed_inputs is None:
+            packed_inputs = self._inputs[inputs] = encode_inputs(inputs)
+        rec_crc = self._crcs.get(recommendation)
+        if rec_crc is None:
+            rec_crc = recommendation_crc(recommendation)
+            if len(self._crcs) < 4096:
+                self._crcs[recommendation] = rec_crc
+        codes = bytes(codes)
+        body = _BODY.pack(
+            time.time() if at is None else at, ref, self._versions[scale], res.score,
+            _SOURCE_IDS[source], scale_id, int(bool(res.critical)) | _SEVERITY_IDS[severity] << 1,
+            packed_inputs, codes + _PADDING[len(codes)], rec_crc,
+        )
+        with self._lock:
+            self._buffer += body
+            self._buffer += zlib.crc32(body).to_bytes(4, "little")
+            self._pending += 1
+            full = self._pending >= self.flush_records
+            if self._thread is None and self.flush_interval > 0:
+                self._thread = threading.Thread(target=self._run, name="audit-flush", daemon=True)
+                self._thread.start()
+        if full:
+            self.flush()
+
+    def record_context(self, scale: str, ctx: Dict[str, Any], outcome: Tuple[Any, str, str],
+                       source: str = "app", ref: int = 0) -> None:
+        # ctx — общая анкета (поля вида progress_speed_f — см. scale_context)
+        codes = canonical_codes(scale, scale_context(ctx, scale))
+        self.record(scale, codes, debridement_inputs(ctx), outcome, source=source, ref=ref)
+
+    def flush(self) -> int:
+        # -> число событий, сброшенных на диск
+        with self._io:
+            with self._lock:
+                data, count = bytes(self._buffer), self._pending
+                self._buffer.clear()
+                self._pending = 0
+            if not count:
+                return 0
+            try:
+                with _locked(self._fd):
+                    tail = (os.fstat(self._fd).st_size - HEADER.size) % RECORD.size
+                    if tail:
+                        _write_all(self._fd, b"\x00" * (RECORD.size - tail))
+                    _write_all(self._fd, data)
+                os.fsync(self._fd)
+            except OSError:
+                with self._lock:
+                    self._buffer[:0] = data
+                    self._pending += count
+                raise
+            self.written += count
+            self.syncs += 1
+            return count
+
+    def _run(self) -> None:
+        while not self._wake.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                self._error = e
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.flush()
+        finally:
+            os.close(self._fd)
+            atexit.unregister(self.close)
+
+    def __enter__(self) -> "AuditLog":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+@dataclass(frozen=True)
+class AuditEvent:
+    index: int
+    at: float
+    source: str
+    scale: str
+    version: int
+    score: int
+    critical: bool
+    severity: str
+    inputs: Tuple[bool, str, int, int]
+    codes: Tuple[int, ...]
+    recommendation_crc: int
+    ref: int
+    # CRC записи совпал (False — запись оборвана сбоем или повреждена)
+    valid: bool
+
+
+class AuditReader:
+    _CHUNK = 4096
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f"{path}: не журнал аудита AUSS/FUSS")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.scales = _read_header(self._mm[:HEADER.size], path)
+        # Оборванная последняя запись (сбой во время сброса) не читается
+        self._count = (size - HEADER.size) // RECORD.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def chunks(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+        # (номер первой записи, байты записей) блоками по _CHUNK записей
+        stop = self._count if stop is None else min(stop, self._count)
+        for first in range(start, stop, self._CHUNK):
+            last = min(first + self._CHUNK, stop)
+            yield first, self._mm[HEADER.size + first * RECORD.size:HEADER.size + last * RECORD.size]
+
+    def _event(self, index: int, data: bytes) -> AuditEvent:
+        at, ref, version, score, source, scale_id, flags, inputs, codes, rec_crc, crc = RECORD.unpack(data)
+        scale = self.scales[scale_id] if scale_id < len(self.scales) else f"#{scale_id}"
+        return AuditEvent(
+            index=index, at=at,
+            source=SOURCES[source] if source < len(SOURCES) else f"#{source}",
+            scale=scale, version=version, score=score, critical=bool(flags & 1),
+            severity=SEVERITY_LEVELS[flags >> 1 & 3], inputs=decode_inputs(inputs),
+            codes=tuple(codes.rstrip(b"\xff")), recommendation_crc=rec_crc, ref=ref,
+            valid=zlib.crc32(data[:_CHECKED]) == crc,
+        )
+
+    def __getitem__(self, index: int) -> AuditEvent:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        offset = HEADER.size + index * RECORD.size
+        return self._event(index, self._mm[offset:offset + RECORD.size])
+
+    def __iter__(self) -> Iterator[AuditEvent]:
+        return self.events()
+
+    def events(self, start: int = 0, stop: Optional[int] = None) -> Iterator[AuditEvent]:
+        size = RECORD.size
+        for first, data in self.chunks(start, stop):
+            for i in range(0, len(data), size):
+                yield self._event(first + i // size, data[i:i + size])
+
+    def as_numpy(self) -> Any:
+        # Структурированный массив поверх mmap без копирования; пока он используется,
+        # читатель нельзя закрыть (BufferError)
+        import numpy as np
+
+        dtype = np.dtype([
+            ("at", "<f8"), ("ref", "<u4"), ("version", "<u4"), ("score", "<i2"), ("source", "u1"), ("scale", "u1"),
+            ("flags", "u1"), ("inputs", "u1"), ("codes", "u1", (CODES_WIDTH,)), ("rec_crc", "<u4"), ("pad", "V2"),
+            ("crc", "<u4"),
+        ])
+        return np.frombuffer(self._mm, dtype=dtype, count=self._count, offset=HEADER.size)
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def __enter__(self) -> "AuditReader":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+# Поля исхода, которые сверяет replay
+REPLAY_FIELDS = ("score", "critical", "severity", "recommendation")
+
+
+@dataclass
+class ReplayReport:
+    events: int = 0
+    # Записи с неверным CRC и записи шкал, которых нет в действующих правилах
+    corrupt: int = 0
+    unknown: int = 0
+    # Исход не совпал при той же версии шкалы (ошибка расчёта или правка без смены версии)
+    drift: int = 0
+    # Исход не совпал, потому что правила шкалы изменились после записи, а прежняя
+    # версия не описана (сравнение с действующей)
+    changed: int = 0
+    fields: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(REPLAY_FIELDS, 0))
+    # (шкала, версия) -> число записей
+    versions: Dict[Tuple[str, int], int] = field(default_factory=dict)
+    # (номер записи, шкала, поле, записано, пересчитано)
+    examples: List[Tuple[int, str, str, Any, Any]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not (self.drift or self.corrupt)
+
+
+def replay(path: str, cache: Optional[Any] = None, examples: int = 20) -> ReplayReport:
+    # Пересчёт журнала по действующему scoring.py. Исход зависит только от шкалы,
+    # кодов анкеты и входов выбора кросслинкинга, поэтому каждый вариант
+    # пересчитывается один раз
+    from cache import ScoringCache, _debridement_context
+
+    if cache is None:
+        cache = ScoringCache()
+    report = ReplayReport()
+    known = known_versions()
+    derived: Dict[bytes, Optional[Tuple[int, bool, int, int]]] = {}
+    size = RECORD.size
+    with AuditReader(path) as reader:
+        names = reader.scales
+        for first, data in reader.chunks():
+            for i in range(0, len(data), size):
+                record = data[i:i + size]
+                report.events += 1
+                at, ref, version, score, source, scale_id, flags, inputs, codes, rec_crc, crc = RECORD.unpack(record)
+                if zlib.crc32(record[:_CHECKED]) != crc:
+                    report.corrupt += 1
+                    continue
+                name = names[scale_id] if scale_id < len(names) else None
+                if name not in SCALES:
+                    report.unknown += 1
+                    continue
+                versions = report.versions
+                versions[name, version] = versions.get((name, version), 0) + 1
+                # Прежняя описанная версия — пересчёт по ней, иначе — по действующей
+                rules = known.get((name, version))
+                key = record[12:16] + record[19:20] + record[21:54]
+                outcome = derived.get(key, False)
+                if outcome is False:
+                    outcome = derived[key] = _derive(cache, name, rules, codes, decode_inputs(inputs),
+                                                     _debridement_context)
+                recorded = (score, bool(flags & 1), flags >> 1 & 3, rec_crc)
+                if outcome == recorded:
+                    continue
+                if rules is not None:
+                    report.drift += 1
+                else:
+                    report.changed += 1
+                for j, fname in enumerate(REPLAY_FIELDS):
+                    got = outcome[j] if outcome is not None else None
+                    if got == recorded[j]:
+                        continue
+                    report.fields[fname] += 1
+                    if len(report.examples) < examples:
+                        report.examples.append((first + i // size, name, fname, _shown(fname, recorded[j]), _shown(fname, got)))
+    return report
+
+
+def _derive(cache: Any, name: str, version: Optional[str], codes: bytes, inputs: Tuple[Any, ...],
+            context: Any) -> Optional[Tuple[int, bool, int, int]]:
+    compiled = get_scale(name, version)
+    try:
+        res = score_encoded(compiled, codes[:len(compiled.keys)])
+    except IndexError:
+        # Вариант ответа, которого в действующей шкале больше нет
+        return None
+    sev = severity_from_score(res.score, name, critical=res.critical, version=version)
+    rec = cache.recommend_treatment(name, sev, res.score, context(inputs), critical=res.critical, inputs=inputs)
+    return res.score, res.critical, SEVERITY_LEVELS.index(sev), recommendation_crc(rec)
+
+
+def _shown(fname: str, value: Any) -> Any:
+    if fname == "severity" and value is not None:
+        return SEVERITY_LEVELS[value]
+    if fname == "recommendation" and value is not None:
+        return f"crc {value:08x}"
+    return value
@@ -0,0 +1,561 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import List, Optional
+
+
+# Командная строка: python -m aussfuss <команда> ...
+
+
+def _print_errors(errors, limit: int = 50) -> None:
+    for e in errors[:limit]:
+        where = f" [{e.scale}]" if e.scale else ""
+        print(f"строка {e.row}{where}, {e.field} = {e.value!r}: {e.message}", file=sys.stderr)
+    if len(errors) > limit:
+        print(f"… ещё ошибок: {len(errors) - limit}", file=sys.stderr)
+
+
+def _cmd_validate(args: argparse.Namespace) -> int:
+    import json
+
+    from pipeline import read_rows
+    from schema import validate
+
+    rows, errors = validate(read_rows(args.input, args.format, args.delimiter), args.scale, args.max_errors or None)
+    if args.json:
+        json.dump(
+            [{"row": e.row, "field": e.field, "value": e.value, "scale": e.scale, "message": e.message} for e in errors],
+            sys.stdout, ensure_ascii=False, indent=1, default=str,
+        )
+        print()
+    else:
+        _print_errors(errors, args.limit)
+    print(f"Строк: {rows}, ошибок: {len(errors)}, строк с ошибками: {len({e.row for e in errors})}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+def _cmd_batch(args: argparse.Namespace) -> int:
+    import os
+
+    from cache import ScoringCache
+    from pipeline import run_batch
+    from schema import SchemaError
+
+    cache = ScoringCache(path=args.cache) if args.cache else ScoringCache()
+    table = None
+    if args.table:
+        from score_table import ScoreTable
+
+        table = ScoreTable.load(args.table)
+    progress = None
+    if args.progress:
+        def progress(exported) -> None:
+            print(
+                f"\rПротоколов: {exported.written}, ошибок: {exported.failed}, "
+                f"{exported.bytes / 2**20:,.1f} МиБ за {exported.seconds:.1f} с, "
+                f"пик памяти: {exported.peak_rss_kib / 1024:,.1f} МиБ",
+                end="", file=sys.stderr, flush=True,
+            )
+    audit_path = args.audit or os.environ.get("AUSSFUSS_AUDIT_LOG")
+    audit = None
+    if audit_path:
+        from audit import AuditLog
+
+        audit = AuditLog(audit_path, flush_records=8192)
+    registry_path = args.registry or os.environ.get("AUSSFUSS_REGISTRY")
+    registry = None
+    if registry_path:
+        from timeline import Timeline
+
+        registry = Timeline(registry_path)
+    try:
+        summary = run_batch(
+            args.input,
+            args.output,
+            scale=args.scale,
+            reports_path=args.reports,
+            cohort_path=args.cohort,
+            breakdown=args.breakdown,
+            input_format=args.format,
+            delimiter=args.delimiter,
+            cache=cache,
+            workers=args.workers,
+            ordered=not args.unordered,
+            table=table,
+            progress=progress,
+            strict=args.strict,
+            audit=audit,
+            registry=registry,
+        )
+    except SchemaError as e:
+        _print_errors(e.errors)
+        print(f"Строк: {e.rows}, ошибок: {len(e.errors)} — расчёт не выполнялся", file=sys.stderr)
+        return 1
+    finally:
+        if audit is not None:
+            audit.close()
+        if registry is not None:
+            registry.close()
+    if progress is not None and args.reports:
+        print(file=sys.stderr)
+    if args.cache:
+        cache.save()
+    stats = cache.stats()
+    source = "по таблице исходов" if table is not None else f"попаданий в кэш: {stats['hit_rate']:.0%}"
+    print(
+        f"Строк: {summary.rows}, расчётов: {summary.results}, ошибок: {summary.errors}, "
+        f"протоколов: {summary.reports}, {source}",
+        file=sys.stderr,
+    )
+    if audit is not None:
+        print(f"Журнал аудита: {audit_path} (+{audit.written} записей)", file=sys.stderr)
+    if registry is not None:
+        skipped = f", строк с неверным visited_at: {summary.registry_errors}" if summary.registry_errors else ""
+        print(f"Реестр визитов: {registry_path} (+{summary.registry_visits} визитов{skipped})", file=sys.stderr)
+    if args.cohort:
+        print(f"Сводный протокол: {args.cohort} ({summary.cohort_bytes / 2**20:,.1f} МиБ)", file=sys.stderr)
+    if summary.report_errors:
+        print(f"Не удалось сформировать протоколов: {summary.report_errors}", file=sys.stderr)
+    if summary.error_rows:
+        shown = ", ".join(str(i) for i in summary.error_rows[:20])
+        print(f"Строки с ошибками: {shown}{' …' if len(summary.error_rows) > 20 else ''}", file=sys.stderr)
+    if summary.errors or summary.report_errors:
+        return 1
+    return 0
+
+
+def _cmd_analytics(args: argparse.Namespace) -> int:
+    import os
+
+    from scoring import SEVERITY_LEVELS
+    from timeline import Timeline
+
+    if not os.path.exists(args.path):
+        print(f"Реестр не найден: {args.path}", file=sys.stderr)
+        return 1
+    with Timeline(args.path) as tl:
+        agg = tl.rebuild_aggregates() if args.rebuild else tl.aggregates()
+    if args.json:
+        print(agg.dumps())
+        return 0
+    print(f"Визитов: {agg.visits}, оценено по обеим шкалам: {agg.pairs}")
+    for name, s in agg.scales.items():
+        if not s.visits:
+            continue
+        print(f"{name}: визитов {s.visits}, средняя сумма {s.mean_score:.1f}, медиана {s.score_quantile(0.5)}, "
+              f"критических {s.critical}")
+        print("  " + ", ".join(f"{level}: {n}" for level, n in s.severity_counts.items()))
+    if agg.pairs:
+        print(f"Совпадение тяжести FUSS/AUSS: {agg.agreement_rate():.1%}, каппа {agg.kappa():.3f}, "
+              f"с квадратичными весами {agg.kappa(weighted=True):.3f}")
+        width = max(map(len, SEVERITY_LEVELS))
+        for level, row in zip(SEVERITY_LEVELS, agg.agreement):
+            print(f"  {level:<{width}} " + " ".join(f"{n:>8}" for n in row))
+    return 0
+
+
+def _cmd_whatif(args: argparse.Namespace) -> int:
+    import json
+    import time
+
+    from scoring import load_versions
+    from whatif import Scenario, format_results, load_scenarios, read_cohorts, run_scenarios, threshold_grid
+
+    scenarios = []
+    try:
+        for path in args.scenarios:
+            scenarios.extend(load_scenarios(path))
+        for path in args.versions:
+            scenarios.extend(Scenario.from_version(c.name, c.version) for c in load_versions(path))
+        for spec in args.version:
+            scale, _, version = spec.partition(":")
+            scenarios.append(Scenario.from_version(scale, version))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for spec in args.grid:
+        scale, _, spread = spec.partition(":")
+        scenarios.extend(threshold_grid(scale, int(spread or 2)))
+    if not scenarios:
+        print("Не заданы сценарии (файлы или --grid)", file=sys.stderr)
+        return 1
+    t0 = time.perf_counter()
+    cohorts, skipped = read_cohorts(args.input, args.scale, args.format, args.delimiter)
+    t1 = time.perf_counter()
+    results = run_scenarios(cohorts, scenarios, workers=args.workers or None)
+    t2 = time.perf_counter()
+    visits = ", ".join(f"{c.scale}: {len(c)}" for c in cohorts)
+    print(
+        f"Визитов {visits} (пропущено строк: {skipped}), сценариев: {len(scenarios)}; "
+        f"чтение {t1 - t0:.1f} с, расчёт {t2 - t1:.1f} с",
+        file=sys.stderr,
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump([r.to_json() for r in results], f, ensure_ascii=False, indent=1)
+    print(format_results(results, top=args.top))
+    return 0
+
+
+def _cmd_table(args: argparse.Namespace) -> int:
+    import time
+
+    from score_table import ScoreTable, verify_table
+
+    if args.action == "build":
+        t0 = time.perf_counter()
+        table = ScoreTable.build()
+        size = table.save(args.path)
+        print(f"Таблица исходов: {args.path}, {size / 1024:.0f} КиБ, {time.perf_counter() - t0:.2f} с", file=sys.stderr)
+        if not args.verify:
+            return 0
+    with ScoreTable.load(args.path) as table:
+        report = verify_table(table, samples=args.samples, seed=args.seed)
+    for line in report["mismatches"]:
+        print(f"РАСХОЖДЕНИЕ {line}", file=sys.stderr)
+    print(f"Проверено вариантов: {report['checked']}, расхождений: {len(report['mismatches'])}", file=sys.stderr)
+    return 1 if report["mismatches"] else 0
+
+
+def _store_passphrase() -> str:
+    import getpass
+    import os
+
+    return os.environ.get("AUSSFUSS_STORE_KEY") or getpass.getpass("Пароль картотеки: ")
+
+
+def _cmd_store(args: argparse.Namespace) -> int:
+    import json
+    import os
+
+    from local_store import LocalStore
+
+    if args.action != "import" and not os.path.exists(args.path):
+        print(f"Картотека не найдена: {args.path}", file=sys.stderr)
+        return 1
+    try:
+        store = LocalStore(args.path, _store_passphrase())
+    except (ValueError, RuntimeError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    with store:
+        if args.action == "import":
+            from pipeline import read_rows
+
+            if not args.input:
+                print("Не указана выгрузка (--input)", file=sys.stderr)
+                return 1
+            added, errors = store.import_rows(read_rows(args.input, args.format, args.delimiter),
+                                              scale=args.scale, breakdown=args.breakdown)
+            for index, text in errors[:args.limit]:
+                print(f"строка {index}: {text}", file=sys.stderr)
+            print(f"Добавлено визитов: {added}, строк с ошибками: {len(errors)}", file=sys.stderr)
+            return 1 if errors else 0
+        if args.action == "protocol":
+            if args.visit is None:
+                print("Не указан визит (--visit)", file=sys.stderr)
+                return 1
+            try:
+                data, filename = store.protocol(args.visit)
+            except KeyError:
+                print(f"Визит не найден: {args.visit}", file=sys.stderr)
+                return 1
+            out = args.output or filename
+            with open(out, "wb") as f:
+                f.write(data)
+            print(out, file=sys.stderr)
+            return 0
+        if args.action == "stats":
+            print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+            return 0
+        visits = store.visits(patient_id=args.id, name=args.name, since=args.since, until=args.until,
+                              scale=args.scale if args.scale in ("FUSS", "AUSS") else None, limit=args.limit)
+    rows = [
+        {"visit": v.id, "visited_at": v.visited.isoformat(timespec="minutes"), "patient_id": v.patient.patient_id,
+         "patient_name": v.patient.name, "scale": v.scale, "score": v.score, "severity": v.severity}
+        for v in visits
+    ]
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        for r in rows:
+            print(f"{r['visit']:>8}  {r['visited_at']}  {r['patient_id']:<12} {r['patient_name']:<30} "
+                  f"{r['scale']}  {r['score']:>3}  {r['severity']}")
+    print(f"Визитов: {len(rows)}", file=sys.stderr)
+    return 0
+
+
+def _cmd_audit(args: argparse.Namespace) -> int:
+    import json
+    from datetime import datetime
+
+    import audit
+    from scoring import load_versions
+
+    try:
+        for path in args.versions:
+            load_versions(path)
+        if args.action == "replay":
+            report = audit.replay(args.path, examples=args.limit)
+        else:
+            reader = audit.AuditReader(args.path)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.action == "tail":
+        with reader:
+            events = list(reader.events(max(len(reader) - args.limit, 0)))
+            total = len(reader)
+        for e in events:
+            at = datetime.fromtimestamp(e.at).isoformat(sep=" ", timespec="seconds")
+            mark = "" if e.valid else "  ПОВРЕЖДЕНА"
+            print(f"{e.index:>9}  {at}  {e.source:<7} {e.scale}  {e.score:>3}  {e.severity:<15} "
+                  f"{e.ref or '':>7}  v{e.version:08x}{mark}")
+        print(f"Записей в журнале: {total}", file=sys.stderr)
+        return 0
+    if args.json:
+        data = dict(vars(report), versions=[
+            {"scale": scale, "version": f"{version:08x}", "events": n} for (scale, version), n in report.versions.items()
+        ])
+        print(json.dumps(data, ensure_ascii=False, indent=2, default=str))
+    for index, scale, name, recorded, derived in report.examples:
+        print(f"запись {index} [{scale}] {name}: записано {recorded!r}, сейчас {derived!r}", file=sys.stderr)
+    current = {name: audit.scale_version(name) for name in audit.SCALES}
+    known = audit.known_versions()
+    for (scale, version), n in sorted(report.versions.items()):
+        note = "действующая" if current.get(scale) == version else (
+            f"версия {known[scale, version]}" if (scale, version) in known else "не описана")
+        print(f"{scale} v{version:08x} ({note}): {n}", file=sys.stderr)
+    print(
+        f"Записей: {report.events}, повреждённых: {report.corrupt}, неизвестных шкал: {report.unknown}, "
+        f"расхождений: {report.drift}, из-за изменённых правил: {report.changed}",
+        file=sys.stderr,
+    )
+    return 0 if report.ok else 1
+
+
+def _cmd_conformance(args: argparse.Namespace) -> int:
+    import json
+
+    import conformance
+
+    gates = {} if args.no_gates else (conformance.load_gates(args.gates) if args.gates else None)
+    try:
+        report = conformance.run_conformance(n=args.n, seed=args.seed, engines=args.engine or None,
+                                             gates=gates, repeat=args.repeat, load=args.load)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(conformance.format_report(report), file=sys.stderr)
+    if report["mismatches"] or report["gate_failures"]:
+        return 1
+    print("Расхождений нет, пороги скорости выполнены", file=sys.stderr)
+    return 0
+
+
+def _cmd_serve(args: argparse.Namespace) -> int:
+    from cache import ScoringCache
+    from service import serve
+
+    print(f"Сервис расчёта: http://{args.host}:{args.port}", file=sys.stderr)
+    serve(args.host, args.port, max_batch=args.max_batch, max_delay=args.max_delay_ms / 1000,
+          cache=ScoringCache(path=args.cache) if args.cache else None)
+    return 0
+
+
+def _cmd_loadtest(args: argparse.Namespace) -> int:
+    import loadtest
+
+    proc = loadtest.spawn_server(args.port) if args.spawn else None
+    try:
+        report = loadtest.run_load(args.host, args.port, args.connections, args.duration, args.seed)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    print(loadtest.format_report(report), file=sys.stderr)
+    if args.p99_ms is not None and report["p99_ms"] > args.p99_ms:
+        print(f"p99 выше порога {args.p99_ms} мс", file=sys.stderr)
+        return 1
+    return 1 if report["errors"] else 0
+
+
+def _cmd_bench(args: argparse.Namespace) -> int:
+    import bench
+
+    if args.startup:
+        report = bench.run_startup(repeat=args.repeat)
+    elif args.quick:
+        report = bench.run_benchmarks(n=1000, batch_rows=20_000, docs=60, seed=args.seed)
+    else:
+        report = bench.run_benchmarks(n=args.n, batch_rows=args.batch_rows, docs=args.docs, seed=args.seed)
+    print(bench.format_summary(report), file=sys.stderr)
+    if args.output:
+        bench.save(report, args.output)
+    if args.compare:
+        regressions = bench.compare(report, bench.load(args.compare), tolerance=args.tolerance,
+                                    calibrate_speed=not args.raw)
+        for r in regressions:
+            print(f"РЕГРЕССИЯ {r['benchmark']}.{r['metric']}: {r['baseline']:.4g} -> {r['current']:.4g} "
+                  f"({r['change']:+.0%})", file=sys.stderr)
+        if regressions:
+            return 1
+        print("Регрессий нет", file=sys.stderr)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="aussfuss", description="Калькулятор AUSS/FUSS")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("batch", help="пакетный расчёт по выгрузке CSV/JSONL/Parquet")
+    p.add_argument("input", help="входной файл (CSV, JSONL или Parquet; '-' — stdin)")
+    p.add_argument("-o", "--output", default="-", help="файл результатов (.csv или .jsonl; по умолчанию stdout)")
+    p.add_argument("--scale", default="row",
+                   help="FUSS, AUSS, both или row — шкала из столбца scale (по умолчанию)")
+    p.add_argument("--reports",
+                   help="zip-архив (или каталог — путь с / в конце) с DOCX-протоколами по каждому расчёту")
+    p.add_argument("--cohort", help="сводный DOCX-протокол: таблица по всем расчётам и раздел на каждый")
+    p.add_argument("--progress", action="store_true", help="показывать ход выгрузки протоколов и пик памяти")
+    p.add_argument("--breakdown", action="store_true", help="добавить разложение баллов в результаты и протоколы")
+    p.add_argument("--format", choices=("csv", "jsonl", "parquet"), help="формат входного файла (по расширению)")
+    p.add_argument("--delimiter", help="разделитель CSV (по умолчанию определяется автоматически)")
+    p.add_argument("--cache", help="файл кэша расчётов между запусками")
+    p.add_argument("-j", "--workers", type=int, default=1,
+                   help="число процессов для сборки протоколов (0 — по числу ядер)")
+    p.add_argument("--unordered", action="store_true",
+                   help="записывать протоколы в архив по мере готовности, а не по порядку строк")
+    p.add_argument("--table", help="предрасчитанная таблица исходов (см. команду table) вместо кэша")
+    p.add_argument("--strict", action="store_true",
+                   help="сначала проверить всю выгрузку и не считать, если есть ошибки")
+    p.add_argument("--audit", help="журнал аудита расчётов (по умолчанию AUSSFUSS_AUDIT_LOG)")
+    p.add_argument("--registry", help="реестр визитов для аналитики (по умолчанию AUSSFUSS_REGISTRY)")
+    p.set_defaults(func=_cmd_batch)
+
+    p = sub.add_parser("validate", help="проверка выгрузки по схеме анкеты (все ошибки сразу)")
+    p.add_argument("input", help="входной файл (CSV, JSONL или Parquet; '-' — stdin)")
+    p.add_argument("--scale", default="row", help="FUSS, AUSS, both или row (как в batch)")
+    p.add_argument("--format", choices=("csv", "jsonl", "parquet"))
+    p.add_argument("--delimiter")
+    p.add_argument("--json", action="store_true", help="список ошибок в JSON (stdout)")
+    p.add_argument("--limit", type=int, default=50, help="сколько ошибок показать")
+    p.add_argument("--max-errors", type=int, default=0, help="остановиться после N ошибок (0 — проверить всё)")
+    p.set_defaults(func=_cmd_validate)
+
+    p = sub.add_parser("table", help="предрасчитанная таблица исходов: сборка и сверка")
+    p.add_argument("action", choices=("build", "verify"))
+    p.add_argument("path", help="файл таблицы")
+    p.add_argument("--verify", action="store_true", help="после сборки сверить таблицу с расчётом")
+    p.add_argument("--samples", type=int, default=10_000, help="число случайных полных анкет при сверке")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=_cmd_table)
+
+    p = sub.add_parser("whatif", help="переклассификация когорты при других баллах и порогах")
+    p.add_argument("input", help="выгрузка визитов (как для batch)")
+    p.add_argument("scenarios", nargs="*", help="JSON со сценариями: name, points, weights, thresholds")
+    p.add_argument("--grid", action="append", default=[], metavar="ШКАЛА[:N]",
+                   help="добавить все сдвиги порогов шкалы на ±N (по умолчанию 2)")
+    p.add_argument("--versions", action="append", default=[], metavar="JSON",
+                   help="описания версий правил (scoring.version_from_json); каждая версия — сценарий")
+    p.add_argument("--version", action="append", default=[], metavar="ШКАЛА:ВЕРСИЯ",
+                   help="сценарий перехода на описанную версию правил шкалы")
+    p.add_argument("--scale", default="row", help="FUSS, AUSS, both или row (как в batch)")
+    p.add_argument("--format", choices=("csv", "jsonl", "parquet"))
+    p.add_argument("--delimiter")
+    p.add_argument("-j", "--workers", type=int, default=0, help="число процессов (0 — по числу ядер)")
+    p.add_argument("-o", "--output", help="полный отчёт (JSON с матрицами переклассификации)")
+    p.add_argument("--top", type=int, default=20, help="сколько сценариев показать")
+    p.set_defaults(func=_cmd_whatif)
+
+    p = sub.add_parser("analytics", help="сводка реестра визитов: тяжесть, баллы, совпадение FUSS/AUSS")
+    p.add_argument("path", help="файл реестра (SQLite, timeline.Timeline)")
+    p.add_argument("--json", action="store_true", help="вывести сводку в JSON")
+    p.add_argument("--rebuild", action="store_true", help="пересчитать сводку по всем визитам")
+    p.set_defaults(func=_cmd_analytics)
+
+    p = sub.add_parser("store", help="локальная зашифрованная картотека пациентов, визитов и протоколов")
+    p.add_argument("action", choices=("import", "search", "protocol", "stats"))
+    p.add_argument("path", help="файл картотеки (SQLite; пароль — AUSSFUSS_STORE_KEY или запрос)")
+    p.add_argument("--input", help="import: выгрузка визитов (как для batch) с patient_id, patient_name, visited_at")
+    p.add_argument("--format", choices=("csv", "jsonl", "parquet"))
+    p.add_argument("--delimiter")
+    p.add_argument("--scale", default="row", help="FUSS, AUSS, both или row (как в batch); search: FUSS или AUSS")
+    p.add_argument("--breakdown", action="store_true", help="import: разложение баллов в протоколах")
+    p.add_argument("--id", help="search: ID/№карты пациента")
+    p.add_argument("--name", help="search: начало фамилии/имени (несколько слов — все должны совпасть)")
+    p.add_argument("--since", help="search: с даты (ISO)")
+    p.add_argument("--until", help="search: по дату (ISO)")
+    p.add_argument("--limit", type=int, default=100, help="сколько визитов (ошибок для import) показать")
+    p.add_argument("--json", action="store_true", help="search: вывести визиты в JSON")
+    p.add_argument("--visit", type=int, help="protocol: номер визита")
+    p.add_argument("-o", "--output", help="protocol: куда сохранить DOCX (по умолчанию — имя протокола)")
+    p.set_defaults(func=_cmd_store)
+
+    p = sub.add_parser("audit", help="журнал аудита расчётов: последние записи и пересчёт по текущим правилам")
+    p.add_argument("action", choices=("replay", "tail"))
+    p.add_argument("path", help="файл журнала аудита")
+    p.add_argument("--limit", type=int, default=20, help="tail: сколько записей; replay: сколько расхождений показать")
+    p.add_argument("--json", action="store_true", help="replay: отчёт в JSON (stdout)")
+    p.add_argument("--versions", action="append", default=[], metavar="JSON",
+                   help="replay: прежние версии правил — записи этих версий пересчитываются по ним")
+    p.set_defaults(func=_cmd_audit)
+
+    p = sub.add_parser("serve", help="локальный JSON-сервис расчёта (HTTP)")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--max-batch", type=int, default=256, help="наибольшая пачка одиночных расчётов")
+    p.add_argument("--max-delay-ms", type=float, default=0.0,
+                   help="сколько дополнительно ждать пополнения пачки, мс (по умолчанию не ждать)")
+    p.add_argument("--cache", help="файл кэша расчётов (загружается при запуске)")
+    p.set_defaults(func=_cmd_serve)
+
+    p = sub.add_parser("loadtest", help="нагрузочный тест сервиса на localhost")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("-c", "--connections", type=int, default=16)
+    p.add_argument("-d", "--duration", type=float, default=5.0, help="длительность, с")
+    p.add_argument("--spawn", action="store_true", help="запустить сервис в отдельном процессе на время теста")
+    p.add_argument("--p99-ms", type=float, help="завершиться с ошибкой, если p99 выше порога")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=_cmd_loadtest)
+
+    p = sub.add_parser("conformance", help="сверка всех путей расчёта с эталоном и пороги скорости")
+    p.add_argument("-n", type=int, default=5000, help="число анкет для сверки (перебор вариантов добавляется всегда)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--engine", action="append", help="проверить только этот движок (можно несколько раз)")
+    p.add_argument("--gates", help="JSON с порогами ускорения {движок: не менее} вместо встроенных")
+    p.add_argument("--no-gates", action="store_true", help="только сверка, без замеров скорости")
+    p.add_argument("--load", type=int, default=20000, help="размер нагрузки для замеров скорости")
+    p.add_argument("--repeat", type=int, default=3, help="повторов замера (берётся лучший)")
+    p.add_argument("-o", "--output", help="полный отчёт (JSON)")
+    p.set_defaults(func=_cmd_conformance)
+
+    p = sub.add_parser("bench", help="замеры скорости расчёта и формирования протоколов")
+    p.add_argument("-o", "--output", help="куда сохранить результаты (JSON)")
+    p.add_argument("--compare", help="базовый файл результатов для поиска регрессий")
+    p.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение (доля, по умолчанию 0.2)")
+    p.add_argument("--raw", action="store_true",
+                   help="сравнивать время без поправки на скорость машины (по эталонному замеру)")
+    p.add_argument("--quick", action="store_true", help="короткий прогон")
+    p.add_argument("--startup", action="store_true",
+                   help="время импорта модулей и холодного запуска (в отдельных процессах)")
+    p.add_argument("--repeat", type=int, default=5, help="число запусков процесса для --startup")
+    p.add_argument("-n", type=int, default=5000, help="число анкет для замеров одного вызова")
+    p.add_argument("--batch-rows", type=int, default=200_000, help="размер когорты для пакетного расчёта")
+    p.add_argument("--docs", type=int, default=300, help="число протоколов DOCX")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=_cmd_bench)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import repeat
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from scoring import CRITERIA, SCALE_VERSIONS, SCALES, SEVERITY_LEVELS, get_scale
+
+
+# Пакетный (векторизованный) расчёт FUSS/AUSS по когорте.
+# Каждый критерий один раз переводится в целочисленные коды (uint8),
+# баллы и тяжесть считаются табличными выборками по всему массиву сразу.
+# Результаты совпадают с compute_fuss/compute_auss/severity_from_score.
+# Коды вариантов общие для всех версий правил, поэтому когорта, закодированная
+# один раз, считается по нескольким версиям шкалы (score_versions).
+
+_BAD = 255
+
+# Варианты ответов и значения по умолчанию — из общего описания шкал в scoring
+FIELDS: Dict[str, Tuple[Tuple[Any, ...], Any]] = {
+    key: (crit.options, crit.default) for key, crit in CRITERIA.items()
+}
+
+# Числовые поля ОКТ: границы категорий (значение приводится к int, как в scoring)
+_THICKNESS_BINS = {
+    "min_thickness_um": (200, 300, 400),
+    "mean_thickness_um": (450, 520, 600),
+}
+_SIZE_MM_BINS = (2, 4, 6)
+
+
+@dataclass(frozen=True)
+class _BatchScale:
+    name: str
+    keys: Tuple[str, ...]
+    points: Tuple[np.ndarray, ...]
+    thresholds: Tuple[int, ...]
+    critical: Tuple[Tuple[str, int], ...]
+
+
+def _batch_scale(scale: str, version: Optional[str] = None) -> _BatchScale:
+    compiled = get_scale(scale, version)
+    return _BatchScale(
+        name=compiled.name,
+        keys=compiled.keys,
+        points=tuple(np.asarray(pts, dtype=np.int16) for pts in compiled.points),
+        thresholds=compiled.thresholds,
+        critical=tuple((compiled.keys[i], code) for i, code in compiled.critical_codes),
+    )
+
+
+_BATCH_SCALES: Dict[str, _BatchScale] = {name: _batch_scale(name) for name in SCALES}
+
+
+@lru_cache(maxsize=64)
+def _batch_version(scale: str, version: str) -> _BatchScale:
+    return _batch_scale(scale, version)
+
+
+def _spec(scale: str, version: Optional[str]) -> _BatchScale:
+    return _BATCH_SCALES[scale] if version is None else _batch_version(scale, version)
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    score: np.ndarray      # int32, сумма баллов
+    critical: np.ndarray   # bool
+    severity: np.ndarray   # uint8, индекс в SEVERITY_LEVELS
+
+    def __len__(self) -> int:
+        return int(self.score.shape[0])
+
+    def severity_labels(self) -> np.ndarray:
+        return np.asarray(SEVERITY_LEVELS, dtype=object)[self.severity]
+
+
+def _columns(cohort: Any) -> Mapping[str, Any]:
+    # Структурированный массив NumPy -> словарь столбцов
+    if isinstance(cohort, np.ndarray) and cohort.dtype.names:
+        return {name: cohort[name] for name in cohort.dtype.names}
+    return cohort
+
+
+def _cohort_len(cols: Mapping[str, Any]) -> int:
+    for key in FIELDS:
+        if key in cols:
+            return len(cols[key])
+    if "size_mm" in cols:
+        return len(cols["size_mm"])
+    raise ValueError("В когорте нет ни одного столбца анкеты")
+
+
+def _first_bad(col: np.ndarray, bad: np.ndarray) -> Any:
+    value = col[int(np.flatnonzero(bad)[0])]
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _encode_options(col: Any, options: Tuple[Any, ...]) -> np.ndarray:
+    arr = np.asarray(col)
+    int_opts = [opt for opt in options if type(opt) is int]
+    if arr.dtype.kind in "iub" and arr.size and len(int_opts) == len(options):
+        # Целочисленный столбец: одна выборка из плотной таблицы вместо сравнений
+        lo, hi = int(arr.min()), int(arr.max())
+        if lo >= 0 and hi < 256:
+            lut = np.full(hi + 1, _BAD, dtype=np.uint8)
+            for code, opt in enumerate(options):
+                if opt <= hi:
+                    lut[opt] = code
+            codes = lut.take(arr)
+        else:
+            codes = _compare_options(arr, options)
+    elif arr.dtype.kind == "O":
+        codes = _lookup_options(arr, options)
+    else:
+        codes = _compare_options(arr, options)
+    bad = codes == _BAD
+    if bad.any():
+        # Как и в покритериальном расчёте: неизвестный вариант -> KeyError
+        raise KeyError(_first_bad(arr, bad))
+    return codes
+
+
+def _compare_options(arr: np.ndarray, options: Tuple[Any, ...]) -> np.ndarray:
+    # Одно сравнение на вариант; совпадения копятся как «код + 1» без записи по маске,
+    # 0 (ни один вариант не подошёл) после вычитания становится _BAD.
+    # Строки NumPy сравниваются только с вариантами-строками: с числом они не равны
+    if arr.dtype.kind in "US":
+        kind = str if arr.dtype.kind == "U" else bytes
+        candidates = [(code, opt) for code, opt in enumerate(options) if type(opt) is kind]
+    else:
+        candidates = list(enumerate(options))
+    acc = np.zeros(arr.shape[0], dtype=np.uint8)
+    for code, opt in candidates:
+        acc += (arr == opt) * np.uint8(code + 1)
+    return acc - np.uint8(1)
+
+
+def _lookup_options(arr: np.ndarray, options: Tuple[Any, ...]) -> np.ndarray:
+    # Столбец объектов (pandas object, списки): сравнение с каждым вариантом — вызов
+    # == на каждый элемент, поэтому один проход с поиском в словаре вариантов
+    # (ключи словаря совпадают так же, как ==: 1 == 1.0 == True)
+    lookup = {opt: code for code, opt in enumerate(options)}
+    try:
+        return np.fromiter(map(lookup.get, arr.tolist(), repeat(_BAD)), dtype=np.uint8, count=arr.shape[0])
+    except TypeError:
+        # Нехешируемые значения
+        return _compare_options(arr, options)
+
+
+def _as_int(vals: np.ndarray) -> np.ndarray:
+    # Толщины в scoring приводятся int(value): те же значения допустимы и те же
+    # ошибки (None -> TypeError, NaN и "350.5" -> ValueError)
+    if vals.dtype.kind in "iub":
+        return vals
+    if vals.dtype.kind == "f":
+        finite = np.isfinite(vals)
+        if not finite.all():
+            raise ValueError(f"cannot convert float {_first_bad(vals, ~finite)} to integer")
+        return np.trunc(vals)
+    if vals.dtype.kind == "O":
+        return np.fromiter(map(int, vals.tolist()), dtype=np.int64, count=vals.shape[0])
+    # Строки — int() по различающимся значениям
+    try:
+        uniq, inverse = np.unique(vals, return_inverse=True)
+    except TypeError:
+        return np.asarray([int(v) for v in vals.tolist()], dtype=np.int64)
+    return np.asarray([int(v) for v in uniq.tolist()], dtype=np.int64)[inverse.reshape(-1)]
+
+
+def _encode_bins(col: Any, bins: Tuple[float, ...], truncate: bool, descending: bool) -> np.ndarray:
+    vals = np.asarray(col)
+    if truncate:
+        vals = _as_int(vals)
+    elif vals.dtype.kind not in "iu":
+        # Размер в мм — float(value), как _cat_size_mm в pipeline
+        vals = vals.astype(np.float64)
+    # Категория = число пересечённых границ (сравнения дешевле searchsorted)
+    codes = np.zeros(vals.shape[0], dtype=np.uint8)
+    for edge in bins:
+        if descending:
+            codes += vals < edge
+        else:
+            codes += vals > edge
+    if vals.dtype.kind == "f":
+        # NaN не меньше ни одной границы: _cat_size_mm даёт последнюю категорию
+        codes[np.isnan(vals)] = len(bins)
+    return codes
+
+
+def encode_field(key: str, col: Any) -> np.ndarray:
+    options, _ = FIELDS[key]
+    if key in _THICKNESS_BINS:
+        return _encode_bins(col, _THICKNESS_BINS[key], truncate=True, descending=True)
+    return _encode_options(col, options)
+
+
+def encode_cohort(cohort: Any, keys: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    cols = _columns(cohort)
+    n = _cohort_len(cols)
+    out: Dict[str, np.ndarray] = {}
+    for key in (keys or FIELDS):
+        crit = CRITERIA[key]
+        if key in cols:
+            out[key] = encode_field(key, cols[key])
+        elif key == "size_cat" and "size_mm" in cols:
+            out[key] = _encode_bins(cols["size_mm"], _SIZE_MM_BINS, truncate=False, descending=False)
+        elif crit.required:
+            raise KeyError(key)
+        else:
+            out[key] = np.full(n, encode_field(key, [crit.default])[0], dtype=np.uint8)
+    return out
+
+
+def scale_fields(scale: str, version: Optional[str] = None) -> Tuple[str, ...]:
+    return _spec(scale, version).keys
+
+
+def severity_codes(score: np.ndarray, scale: str, critical: Optional[np.ndarray] = None,
+                   version: Optional[str] = None) -> np.ndarray:
+    # Любая шкала без собственного описания оценивается по порогам AUSS — как в severity_from_score
+    if version is not None:
+        thresholds = _batch_version(scale, version).thresholds
+    else:
+        thresholds = (_BATCH_SCALES.get(scale) or _BATCH_SCALES["AUSS"]).thresholds
+    sev = np.zeros(score.shape[0], dtype=np.uint8)
+    for edge in thresholds:
+        sev += score > edge
+    if critical is not None:
+        sev[critical] = len(SEVERITY_LEVELS) - 1
+    return sev
+
+
+def score_codes(codes: Mapping[str, np.ndarray], scale: str, version: Optional[str] = None) -> BatchResult:
+    spec = _spec(scale, version)
+    n = codes[spec.keys[0]].shape[0]
+    score = np.zeros(n, dtype=np.int32)
+    for key, pts in zip(spec.keys, spec.points):
+        np.add(score, pts.take(codes[key]), out=score)
+    critical = np.zeros(n, dtype=bool)
+    for key, code in spec.critical:
+        critical |= codes[key] == code
+    return BatchResult(score=score, critical=critical, severity=severity_codes(score, scale, critical, version))
+
+
+def score_cohort(cohort: Any, scale: str) -> BatchResult:
+    return score_codes(encode_cohort(cohort, scale_fields(scale)), scale)
+
+
+def score_cohorts(cohort: Any, scales: Sequence[str] = ("FUSS", "AUSS")) -> Dict[str, BatchResult]:
+    # Несколько шкал по одной когорте: общие столбцы кодируются один раз,
+    # отдельные поля шкал (progress_speed_f и т. п.) заменяют общие
+    cols = _columns(cohort)
+    keys = []
+    for scale in scales:
+        keys += [key for key in scale_fields(scale) if key not in keys]
+    codes = encode_cohort(cols, keys)
+    return {scale: score_codes(_own_codes(codes, cols, SCALES[scale].fields), scale) for scale in scales}
+
+
+def score_versions(cohort: Any, scale: str, versions: Optional[Sequence[str]] = None) -> Dict[str, BatchResult]:
+    # Версия -> результат по когорте (по умолчанию — все описанные версии шкалы):
+    # столбцы кодируются один раз, затем каждая версия — только выборки баллов
+    cols = _columns(cohort)
+    versions = tuple(versions or SCALE_VERSIONS[scale])
+    keys: List[str] = []
+    fields: Dict[str, str] = {}
+    for version in versions:
+        keys += [key for key in scale_fields(scale, version) if key not in keys]
+        fields.update(SCALE_VERSIONS[scale][version].fields)
+    codes = _own_codes(encode_cohort(cols, keys), cols, fields)
+    return {version: score_codes(codes, scale, version) for version in versions}
+
+
+def _own_codes(codes: Dict[str, np.ndarray], cols: Mapping[str, Any], fields: Mapping[str, str]) -> Dict[str, np.ndarray]:
+    # Отдельные поля шкалы (progress_speed_f и т. п.) заменяют общие
+    own = codes
+    for key, name in fields.items():
+        if name in cols and key in codes:
+            own = dict(own) if own is codes else own
+            own[key] = encode_field(key, cols[name])
+    return own
+
+
+def score_fuss_batch(cohort: Any) -> BatchResult:
+    return score_cohort(cohort, "FUSS")
+
+
+def score_auss_batch(cohort: Any) -> BatchResult:
+    return score_cohort(cohort, "AUSS")
@@ -0,0 +1,340 @@
+from __future__ import annotations
+
+import gc
+import json
+import platform
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from scoring import (
+    CRITERIA,
+    SCALES,
+    choose_debridement,
+    compute_auss,
+    compute_fuss,
+    format_report_docx_local,
+    format_report_docx_web,
+    recommend_treatment,
+    severity_from_score,
+    spec_fingerprint,
+)
+
+
+# Воспроизводимые замеры скорости расчёта и формирования протоколов.
+# Результаты пишутся в JSON; режим сравнения отмечает регрессии относительно
+# сохранённого базового файла. Направление метрики задаётся суффиксом:
+# *_us, *_ms, *_kib — меньше лучше; *_per_s — больше лучше.
+
+BENCH_FORMAT = 1
+
+# Диапазоны толщин для каждой категории (мкм), чтобы покрыть все варианты
+_MIN_THICKNESS_RANGES = ((400, 700), (300, 399), (200, 299), (80, 199))
+_MEAN_THICKNESS_RANGES = ((600, 800), (520, 599), (450, 519), (300, 449))
+
+
+def random_questionnaires(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    # Первые строки перебирают все варианты каждого критерия, остальные — случайные
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        ctx: Dict[str, Any] = {}
+        for key, crit in CRITERIA.items():
+            options = crit.options
+            idx = i % len(options) if i < 8 else rng.randrange(len(options))
+            if key == "min_thickness_um":
+                ctx[key] = rng.randint(*_MIN_THICKNESS_RANGES[idx])
+            elif key == "mean_thickness_um":
+                ctx[key] = rng.randint(*_MEAN_THICKNESS_RANGES[idx])
+            else:
+                ctx[key] = options[idx]
+        rows.append(ctx)
+    return rows
+
+
+def _percentile(sorted_values: Sequence[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    pos = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[pos]
+
+
+def _peak_kib(fn: Callable[[], Any]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024
+
+
+def calibrate(repeat: int = 7) -> float:
+    # Эталонная нагрузка на чистом Python (мс): по ней сравнение поправляет
+    # общее замедление машины (частота процессора, соседние процессы)
+    data = list(range(20_000))
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        d = {}
+        for i in data:
+            d[i & 1023] = d.get(i & 1023, 0) + i
+        sorted(data, key=lambda x: -x)
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def bench_latency(fn: Callable[[Any], Any], inputs: Sequence[Any], repeat: int = 5) -> Dict[str, float]:
+    # Время одного вызова для каждого входа — минимум по repeat проходам,
+    # чтобы случайные задержки планировщика не попадали в перцентили
+    best = [float("inf")] * len(inputs)
+    perf = time.perf_counter_ns
+    for _ in range(repeat):
+        for i, item in enumerate(inputs):
+            t0 = perf()
+            fn(item)
+            elapsed = (perf() - t0) / 1000
+            if elapsed < best[i]:
+                best[i] = elapsed
+    best.sort()
+    total_s = sum(best) / 1e6
+    return {
+        "calls": len(best),
+        "median_us": _percentile(best, 0.5),
+        "p95_us": _percentile(best, 0.95),
+        "p99_us": _percentile(best, 0.99),
+        "calls_per_s": len(best) / total_s if total_s else 0.0,
+        "peak_kib": _peak_kib(lambda: [fn(item) for item in inputs[:200]]),
+    }
+
+
+def bench_throughput(fn: Callable[[], Any], items: int, repeat: int = 5) -> Dict[str, float]:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return {
+        "items": items,
+        "total_ms": best * 1000,
+        "items_per_s": items / best if best else 0.0,
+        "peak_kib": _peak_kib(fn),
+    }
+
+
+def bench_docx(fn: Callable[[Any], Tuple[bytes, str]], inputs: Sequence[Any], repeat: int = 5) -> Dict[str, float]:
+    best = float("inf")
+    total_bytes = 0
+    for _ in range(repeat):
+        total_bytes = 0
+        t0 = time.perf_counter()
+        for item in inputs:
+            data, _ = fn(item)
+            total_bytes += len(data)
+        best = min(best, time.perf_counter() - t0)
+    return {
+        "docs": len(inputs),
+        "per_doc_ms": best * 1000 / len(inputs),
+        "docs_per_s": len(inputs) / best,
+        "bytes_per_s": total_bytes / best,
+        "avg_doc_kib": total_bytes / len(inputs) / 1024,
+        "peak_kib": _peak_kib(lambda: [fn(item) for item in inputs[:50]]),
+    }
+
+
+def run_benchmarks(n: int = 5000, batch_rows: int = 200_000, docs: int = 300, seed: int = 0) -> Dict[str, Any]:
+    rows = random_questionnaires(n, seed)
+    scored = {
+        "FUSS": [(ctx, compute_fuss(ctx)) for ctx in rows],
+        "AUSS": [(ctx, compute_auss(ctx)) for ctx in rows],
+    }
+    graded = {
+        scale: [(ctx, res, severity_from_score(res.score, scale, res.critical)) for ctx, res in items]
+        for scale, items in scored.items()
+    }
+    results: Dict[str, Any] = {
+        "compute_fuss": bench_latency(compute_fuss, rows),
+        "compute_auss": bench_latency(compute_auss, rows),
+        "severity_from_score": bench_latency(
+            lambda item: severity_from_score(item[1].score, "FUSS", item[1].critical), scored["FUSS"]),
+        "choose_debridement": bench_latency(choose_debridement, rows),
+        "recommend_treatment": bench_latency(
+            lambda item: recommend_treatment("AUSS", item[2], item[1].score, item[0], item[1].critical), graded["AUSS"]),
+    }
+
+    for scale, compute in (("FUSS", compute_fuss), ("AUSS", compute_auss)):
+        results[f"loop_{scale.lower()}"] = bench_throughput(
+            lambda compute=compute, scale=scale: [
+                severity_from_score(r.score, scale, r.critical) for r in map(compute, rows)
+            ],
+            len(rows),
+        )
+
+    try:
+        import numpy as np
+        import batch
+    except ImportError:  # pragma: no cover - numpy необязателен для замеров
+        np = None
+    if np is not None:
+        reps = max(1, batch_rows // len(rows))
+        columns = {key: np.asarray([ctx[key] for ctx in rows] * reps) for key in CRITERIA}
+        total = len(rows) * reps
+        for scale in SCALES:
+            codes = batch.encode_cohort(columns, batch.scale_fields(scale))
+            results[f"batch_{scale.lower()}"] = bench_throughput(lambda scale=scale: batch.score_cohort(columns, scale), total)
+            results[f"batch_{scale.lower()}_encoded"] = bench_throughput(
+                lambda scale=scale, codes=codes: batch.score_codes(codes, scale), total)
+
+    reports = [
+        (scale, res.score, sev, recommend_treatment(scale, sev, res.score, ctx, res.critical), res.breakdown)
+        for scale in SCALES for ctx, res, sev in graded[scale][: docs // len(SCALES)]
+    ]
+    results["docx_web"] = bench_docx(lambda r: format_report_docx_web(*r), reports)
+    results["docx_local"] = bench_docx(lambda r: format_report_docx_local("Пациент", "ID-0001", *r), reports)
+
+    return {
+        "format": BENCH_FORMAT,
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "seed": seed,
+            "questionnaires": n,
+            "spec": spec_fingerprint(),
+            "calibration_ms": calibrate(),
+        },
+        "results": results,
+    }
+
+
+# --- время запуска ---------------------------------------------------------------
+
+# Что замеряется в отдельном процессе: импорт модуля и «холодный» первый результат
+STARTUP_MODULES = ("scoring", "cache", "batch", "score_table", "pipeline", "service", "aussfuss")
+_COLD_SNIPPETS = {
+    "cold_score": "import scoring; scoring.compute_fuss({'size_cat': '<=2', 'localization': 'central', 'depth_cat': 'mid'})",
+    "cold_report": "import scoring; scoring.format_report_docx_web('FUSS', 10, 'Лёгкая', 'текст')",
+    "cold_cli_help": "import sys; sys.argv = ['aussfuss', '--help']\ntry:\n import aussfuss; aussfuss.main()\nexcept SystemExit: pass",
+}
+
+
+def _run_python(args: Sequence[str]) -> subprocess.CompletedProcess:
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    return subprocess.run([sys.executable, *args], cwd=here, env=env, capture_output=True, text=True, check=True)
+
+
+def import_time_us(module: str) -> int:
+    # Накопленное время импорта модуля по -X importtime (мкс)
+    err = _run_python(["-X", "importtime", "-c", f"import {module}"]).stderr
+    for line in reversed(err.splitlines()):
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    raise RuntimeError(f"Нет строки импорта для {module}")
+
+
+def _wall_ms(code: str) -> float:
+    t0 = time.perf_counter()
+    _run_python(["-c", code])
+    return (time.perf_counter() - t0) * 1000
+
+
+def run_startup(repeat: int = 5) -> Dict[str, Any]:
+    # Лучшее из repeat запусков; cold_* — полное время процесса за вычетом пустого интерпретатора
+    results: Dict[str, Any] = {}
+    for module in STARTUP_MODULES:
+        try:
+            best = min(import_time_us(module) for _ in range(repeat))
+        except (subprocess.CalledProcessError, RuntimeError):
+            continue  # модуль с отсутствующей необязательной зависимостью
+        results[f"import_{module}"] = {"import_ms": best / 1000}
+    interpreter = min(_wall_ms("pass") for _ in range(repeat))
+    for name, code in _COLD_SNIPPETS.items():
+        best = min(_wall_ms(code) for _ in range(repeat))
+        results[name] = {"total_ms": best, "over_interpreter_ms": best - interpreter}
+    results["interpreter"] = {"startup_ms": interpreter}
+    return {
+        "format": BENCH_FORMAT,
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "spec": spec_fingerprint(),
+            "calibration_ms": calibrate(),
+        },
+        "results": results,
+    }
+
+
+def _direction(metric: str) -> int:
+    # +1 — больше лучше, -1 — меньше лучше, 0 — справочная величина
+    if metric.endswith("_per_s"):
+        return 1
+    if metric.endswith(("_us", "_ms", "_kib")) and metric != "avg_doc_kib":
+        return -1
+    return 0
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2,
+            calibrate_speed: bool = True) -> List[Dict[str, Any]]:
+    # Временные метрики приводятся к скорости машины базового прогона
+    # по отношению эталонных замеров; память сравнивается как есть
+    speed = 1.0
+    cur_cal = current.get("meta", {}).get("calibration_ms")
+    base_cal = baseline.get("meta", {}).get("calibration_ms")
+    if calibrate_speed and cur_cal and base_cal:
+        speed = cur_cal / base_cal
+    regressions = []
+    for name, metrics in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for metric, value in metrics.items():
+            direction = _direction(metric)
+            old = base.get(metric)
+            if not direction or not old:
+                continue
+            if metric.endswith("_per_s"):
+                value = value * speed
+            elif not metric.endswith("_kib"):
+                value = value / speed
+            change = (value - old) / old
+            if (direction < 0 and change > tolerance) or (direction > 0 and change < -tolerance):
+                regressions.append({"benchmark": name, "metric": metric, "baseline": old, "current": value, "change": change})
+    return regressions
+
+
+def format_summary(report: Dict[str, Any]) -> str:
+    lines = []
+    for name, m in report["results"].items():
+        if "median_us" in m:
+            lines.append(f"{name:24s} median {m['median_us']:9.2f} us   p99 {m['p99_us']:9.2f} us   {m['calls_per_s']:12,.0f}/s")
+        elif "import_ms" in m:
+            lines.append(f"{name:24s} {m['import_ms']:9.2f} ms")
+        elif "over_interpreter_ms" in m:
+            lines.append(f"{name:24s} {m['total_ms']:9.2f} ms  (+{m['over_interpreter_ms']:.2f} ms к пустому интерпретатору)")
+        elif "startup_ms" in m:
+            lines.append(f"{name:24s} {m['startup_ms']:9.2f} ms")
+        elif "docs_per_s" in m:
+            lines.append(f"{name:24s} {m['per_doc_ms']:9.3f} ms/doc  {m['docs_per_s']:10,.0f} docs/s  {m['bytes_per_s'] / 1e6:8.1f} MB/s")
+        else:
+            lines.append(f"{name:24s} {m['items_per_s']:14,.0f} rows/s  ({m['total_ms']:.1f} ms for {m['items']:,})")
+    return "\n".join(lines)
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save(report: Dict[str, Any], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import repeat
+from operator import itemgetter
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple, Union
+
+import metrics
+from scoring import (
+    FrozenBreakdown,
+    ScoreResult,
+    compute_scale,
+    compute_scales_many,
+    debridement_inputs,
+    get_group,
+    get_scale,
+    recommend_treatment,
+    score_encoded,
+    severity_from_score,
+    spec_fingerprint,
+)
+
+
+# Кэш расчётов по каноническому виду анкеты.
+# Все критерии категориальные (размер и толщины ОКТ сводятся к 4 категориям),
+# поэтому анкета однозначно задаётся кортежем кодов категорий, а результат
+# расчёта — чистая функция этого кортежа.
+#
+# Ключи:
+#   ("answers", шкалы, *ответы)                  -> исход (ScoreResult, тяжесть, рекомендация)
+#                                                   или список исходов (evaluate_scales)
+#   ("eval", шкала, *коды, *входы выбора кросслинкинга) -> исход
+#   ("score", шкала, *коды)                      -> ScoreResult
+#   ("rec", шкала, тяжесть, критичность, *входы выбора кросслинкинга) -> текст рекомендации
+#
+# Повторная анкета находится по самим ответам («answers») — без разбора полей в коды,
+# поэтому попадание дешевле расчёта. Значения, не подходящие для ключа (списки),
+# считаются по кодам. Результаты общие для всех обращений: разложение —
+# FrozenBreakdown, его нельзя изменить, и копировать результат не нужно.
+# На диск сохраняются только «score» и «rec».
+
+CACHE_FORMAT = 1
+_KINDS = ("answers", "eval", "score", "rec")
+
+
+def _debridement_context(inputs: Tuple[Any, ...]) -> Dict[str, Any]:
+    # Анкета с теми же входами выбора кросслинкинга (для текста рекомендации)
+    thickness_ok, localization, total_leucoma, edema = inputs
+    return {
+        "min_thickness_um": 400 if thickness_ok else 0,
+        "mean_thickness_um": 600 if thickness_ok else 0,
+        "localization": localization,
+        "total_leucoma": total_leucoma,
+        "edema": edema,
+    }
+
+
+# Поле не заполнено: отличается от значения по умолчанию, потому что у выбора
+# кросслинкинга (scoring.debridement_inputs) свои значения по умолчанию
+_MISSING = object()
+_UNHASHABLE = object()
+_DEBRIDEMENT_FIELDS = ("min_thickness_um", "mean_thickness_um", "pachy_uneven", "localization", "total_leucoma", "edema")
+
+
+@lru_cache(maxsize=64)
+def _answer_reader(scales: Tuple[str, ...]) -> Callable[[Dict[str, Any]], Tuple[Any, ...]]:
+    # Ответы на поля, от которых зависит исход: критерии шкал, их отдельные поля
+    # (progress_speed_f) для нескольких шкал и входы выбора кросслинкинга
+    if len(scales) == 1:
+        fields = list(get_scale(scales[0]).keys)
+    else:
+        group = get_group(scales)
+        fields = [key for key, _ in group.shared]
+        for alias, key, _ in group.own:
+            fields += [alias, key]
+    names = tuple(dict.fromkeys(fields + list(_DEBRIDEMENT_FIELDS)))
+    pick = itemgetter(*names)
+
+    def read(ctx: Dict[str, Any]) -> Tuple[Any, ...]:
+        try:
+            # Заполненная анкета — одна выборка без значений по умолчанию
+            return pick(ctx)
+        except KeyError:
+            return tuple(map(ctx.get, names, repeat(_MISSING)))
+
+    return read
+
+
+class ScoringCache:
+    def __init__(self, maxsize: int = 65536, path: Optional[str] = None):
+        if maxsize <= 0:
+            raise ValueError("maxsize должен быть положительным")
+        self.maxsize = maxsize
+        self.path = path
+        self.hits: Dict[str, int] = {kind: 0 for kind in _KINDS}
+        self.misses: Dict[str, int] = {kind: 0 for kind in _KINDS}
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        metrics.track_cache(self)
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _get(self, key: Tuple[Any, ...]) -> Any:
+        with self._lock:
+            # Значения кэша не бывают None
+            value = self._data.get(key)
+            if value is None:
+                self.misses[key[0]] += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits[key[0]] += 1
+            return value
+
+    def _put(self, key: Tuple[Any, ...], value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    # --- расчёт ---------------------------------------------------------------
+
+    def _get_answers(self, key: Tuple[Any, ...]) -> Any:
+        try:
+            return self._get(key)
+        except TypeError:
+            # Нехешируемый ответ: анкета считается по кодам и не запоминается
+            return _UNHASHABLE
+
+    def compute(self, scale: str, ctx: Dict[str, Any]) -> ScoreResult:
+        return self.evaluate(scale, ctx)[0]
+
+    def compute_fuss(self, ctx: Dict[str, Any]) -> ScoreResult:
+        return self.compute("FUSS", ctx)
+
+    def compute_auss(self, ctx: Dict[str, Any]) -> ScoreResult:
+        return self.compute("AUSS", ctx)
+
+    def recommend_treatment(self, scale: str, severity: str, score: int, ctx: Optional[Dict[str, Any]],
+                            critical: bool = False, inputs: Optional[Tuple[Any, ...]] = None) -> str:
+        # Текст рекомендации не зависит от суммы баллов — только от тяжести и входов выбора кросслинкинга;
+        # ctx можно не передавать, если даны inputs
+        key = ("rec", scale, severity, bool(critical)) + (inputs or debridement_inputs(ctx))
+        rec = self._get(key)
+        if rec is None:
+            if ctx is None:
+                ctx = _debridement_context(inputs)
+            rec = recommend_treatment(scale, severity, score, ctx, critical=critical)
+            self._put(key, rec)
+        return rec
+
+    def evaluate(self, scale: str, ctx: Dict[str, Any]) -> Tuple[ScoreResult, str, str]:
+        key = ("answers", scale) + _answer_reader((scale,))(ctx)
+        out = self._get_answers(key)
+        if out is None or out is _UNHASHABLE:
+            # Новая анкета считается напрямую: разбор в коды ради ключа «score» дороже
+            res = compute_scale(scale, ctx, frozen=True)
+            sev = severity_from_score(res.score, scale, critical=res.critical)
+            rec = self.recommend_treatment(scale, sev, res.score, ctx, critical=res.critical)
+            if out is None:
+                self._put(key, (res, sev, rec))
+            out = (res, sev, rec)
+        return out
+
+    def evaluate_scales(self, scales: Sequence[str], ctx: Dict[str, Any]) -> List[Union[Tuple[ScoreResult, str, str], Exception]]:
+        # Несколько шкал по одной общей анкете (поля вида progress_speed_f — см. scale_context):
+        # общие поля разбираются один раз; для шкалы с ошибкой в анкете — исключение
+        names = tuple(scales)
+        key = ("answers", names) + _answer_reader(names)(ctx)
+        cached = self._get_answers(key)
+        if cached is not None and cached is not _UNHASHABLE:
+            return list(cached)
+        out: List[Union[Tuple[ScoreResult, str, str], Exception]] = []
+        inputs = None
+        for scale, res in zip(names, compute_scales_many(names, ctx, frozen=True)):
+            if isinstance(res, Exception):
+                out.append(res)
+                continue
+            if inputs is None:
+                inputs = debridement_inputs(ctx)
+            sev = severity_from_score(res.score, scale, critical=res.critical)
+            out.append((res, sev, self.recommend_treatment(scale, sev, res.score, ctx, critical=res.critical, inputs=inputs)))
+        # Исходы с ошибкой не запоминаются
+        if cached is None and not any(isinstance(o, Exception) for o in out):
+            self._put(key, tuple(out))
+        return out
+
+    def evaluate_codes(self, scale: str, codes: Tuple[int, ...], inputs: Tuple[Any, ...],
+                       ctx: Optional[Dict[str, Any]] = None) -> Tuple[ScoreResult, str, str]:
+        # Анкета, уже переведённая в коды (canonical_codes, schema.Schema), и входы
+        # выбора кросслинкинга (debridement_inputs) — без повторного разбора полей
+        key = ("eval", scale, *codes, *inputs)
+        out = self._get(key)
+        if out is None:
+            out = self._outcome(scale, codes, inputs, ctx)
+            self._put(key, out)
+        return out
+
+    def _outcome(self, scale: str, codes: Tuple[int, ...], inputs: Tuple[Any, ...],
+                 ctx: Optional[Dict[str, Any]]) -> Tuple[ScoreResult, str, str]:
+        key = ("score", scale) + tuple(codes)
+        res = self._get(key)
+        if res is None:
+            res = score_encoded(get_scale(scale), key[2:], frozen=True)
+            self._put(key, res)
+        sev = severity_from_score(res.score, scale, critical=res.critical)
+        if ctx is None:
+            ctx = _debridement_context(inputs)
+        rec = self.recommend_treatment(scale, sev, res.score, ctx, critical=res.critical, inputs=inputs)
+        return res, sev, rec
+
+    # --- статистика -----------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        hits = sum(self.hits.values())
+        misses = sum(self.misses.values())
+        total = hits + misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": (hits / total) if total else 0.0,
+            "by_kind": {kind: {"hits": self.hits[kind], "misses": self.misses[kind]} for kind in self.hits},
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            for kind in self.hits:
+                self.hits[kind] = 0
+                self.misses[kind] = 0
+
+    # --- хранение на диске ----------------------------------------------------
+
+    def save(self, path: Optional[str] = None) -> None:
+        path = path or self.path
+        if not path:
+            raise ValueError("Не указан путь к файлу кэша")
+        with self._lock:
+            entries = []
+            for key, value in self._data.items():
+                if key[0] == "score":
+                    entries.append([list(key), [value.score, value.critical, list(value.breakdown.values())]])
+                elif key[0] == "rec":
+                    entries.append([list(key), value])
+        payload = {"format": CACHE_FORMAT, "fingerprint": spec_fingerprint(), "entries": entries}
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def load(self, path: Optional[str] = None) -> int:
+        path = path or self.path
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        # Кэш, посчитанный по другой редакции шкал, молча отбрасывается
+        if payload.get("format") != CACHE_FORMAT or payload.get("fingerprint") != spec_fingerprint():
+            return 0
+        loaded = 0
+        for raw_key, value in payload.get("entries", []):
+            key = tuple(raw_key)
+            if key[0] == "score":
+                score, critical, pts = value
+                labels = get_scale(key[1]).labels
+                value = ScoreResult(score=score, breakdown=FrozenBreakdown(zip(labels, pts)), critical=critical)
+            self._put(key, value)
+            loaded += 1
+        return loaded
+
+
+# Замеры, включённые во время импорта этого модуля (metrics.enable)
+metrics.enable_module(__name__)
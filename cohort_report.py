@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import os
+import tempfile
+from datetime import date
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional
+
+from docx_template import (
+    PAGE_BREAK_XML,
+    TABLE_END_XML,
+    DocxTemplate,
+    default_template,
+    paragraph_xml,
+    table_row_xml,
+    table_xml_start,
+)
+from scoring import SEVERITY_LEVELS, report_blocks_local
+
+
+# Сводный протокол по отделению: один DOCX со сводной таблицей в начале и
+# разделом на каждый расчёт (с новой страницы) — вместо N отдельных протоколов.
+# Стили берутся из общей заготовки (docx_template), XML пишется по мере
+# добавления: строки сводной таблицы и разделы копятся во временных файлах,
+# при закрытии всё потоково сжимается в word/document.xml. Память не зависит
+# от числа пациентов; в памяти только счётчики по тяжести.
+
+# Ширины столбцов сводной таблицы, twips (ширина текста страницы — 8640)
+_COLUMNS = (
+    ("№", 600),
+    ("Пациент", 2640),
+    ("ID/№карты", 1500),
+    ("Шкала", 900),
+    ("Баллы", 900),
+    ("Степень тяжести", 2100),
+)
+_WIDTHS = tuple(w for _, w in _COLUMNS)
+_CHUNK = 1 << 20
+
+
+class CohortReportWriter:
+    def __init__(self, path: str, title: str = "Сводный протокол AUSS/FUSS", template: Optional[DocxTemplate] = None):
+        self.path = path
+        self.title = title
+        self.template = template or default_template()
+        self.count = 0
+        # шкала -> число расчётов по степеням тяжести
+        self.severity: Dict[str, List[int]] = {}
+        self._rows: BinaryIO = tempfile.TemporaryFile()
+        self._sections: BinaryIO = tempfile.TemporaryFile()
+        self._closed = False
+
+    def add(self, patient_name: str, patient_id: str, scale: str, score: int, severity: str, recommendation: str,
+            breakdown: Optional[Dict[str, int]] = None) -> None:
+        n = self.count + 1
+        who = patient_name or patient_id or "Пациент"
+        # XML собирается целиком до записи: ошибка в тексте не оставляет обрывков
+        row = table_row_xml(_WIDTHS, (str(n), patient_name, patient_id, scale, str(score), severity))
+        blocks = report_blocks_local(patient_name, patient_id, scale, score, severity, recommendation, breakdown)
+        section = PAGE_BREAK_XML + paragraph_xml(1, f"{n}. {who} — {scale}") + "".join(
+            paragraph_xml(level, text) for level, text in blocks[1:]
+        )
+        self._rows.write(row.encode("utf-8"))
+        self._sections.write(section.encode("utf-8"))
+        counts = self.severity.setdefault(scale, [0] * len(SEVERITY_LEVELS))
+        if severity in SEVERITY_LEVELS:
+            counts[SEVERITY_LEVELS.index(severity)] += 1
+        self.count = n
+
+    def _summary(self) -> Iterator[str]:
+        yield paragraph_xml(0, self.title)
+        yield paragraph_xml(None, f"Дата: {date.today().strftime('%d.%m.%Y')}")
+        yield paragraph_xml(None, f"Расчётов: {self.count}")
+        for scale, counts in self.severity.items():
+            parts = ", ".join(f"{level.lower()} — {n}" for level, n in zip(SEVERITY_LEVELS, counts) if n)
+            yield paragraph_xml(None, f"{scale}: {sum(counts)} ({parts})")
+        if self.count:
+            yield table_xml_start(_WIDTHS, [name for name, _ in _COLUMNS])
+
+    def _body(self) -> Iterator[Any]:
+        yield from self._summary()
+        if self.count:
+            yield from _spooled(self._rows)
+            yield TABLE_END_XML
+            yield from _spooled(self._sections)
+
+    def close(self) -> int:
+        # -> размер файла; файл появляется целиком (через временный рядом)
+        if self._closed:
+            return 0
+        self._closed = True
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                size = self.template.write_stream(f, self._body())
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        finally:
+            self._rows.close()
+            self._sections.close()
+        return size
+
+    def abort(self) -> None:
+        self._closed = True
+        self._rows.close()
+        self._sections.close()
+
+    def __enter__(self) -> "CohortReportWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _spooled(f: BinaryIO) -> Iterator[bytes]:
+    f.seek(0)
+    while True:
+        chunk = f.read(_CHUNK)
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_cohort_report(path: str, entries: Iterable[Dict[str, Any]], title: str = "Сводный протокол AUSS/FUSS") -> int:
+    # entries — словари с полями CohortReportWriter.add -> размер файла
+    with CohortReportWriter(path, title) as writer:
+        for entry in entries:
+            writer.add(**entry)
+    return os.path.getsize(path)
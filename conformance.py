@@ -0,0 +1,623 @@
+from __future__ import annotations
+
+import itertools
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import scoring
+import scoring_baseline as baseline
+from scoring import (
+    CRITERIA,
+    SCALES,
+    SEVERITY_LEVELS,
+    debridement_inputs,
+    get_scale,
+    recommend_treatment,
+    scale_context,
+    spec_fingerprint,
+)
+
+
+# Сверка всех ускоренных путей расчёта с эталоном и пороги скорости.
+# Эталон — замороженная копия расчёта исходной версии (scoring_baseline):
+# compute_fuss/compute_auss, severity_from_score и recommend_treatment.
+# Каждый «движок» (сам scoring.py, кэш, таблица исходов, векторизованный batch,
+# схема анкеты, what-if, объяснения, реестр визитов, сервис) получает одни и те же анкеты;
+# сравниваются сумма, разложение, критичность, тяжесть и текст рекомендации —
+# то, что движок выдаёт (None в исходе — поле движком не вычисляется).
+#
+# Анкеты детерминированы (seed): сначала перебор каждого варианта каждого
+# критерия, границ категорий толщин и пропусков необязательных полей,
+# затем случайные. Отдельно полностью перебираются тяжесть по сумме и
+# рекомендация по входам выбора кросслинкинга.
+#
+# Пороги скорости — наименьшее ускорение движка относительно эталона на тех же
+# анкетах (отношение не зависит от скорости машины). Исправление, вернувшее
+# движок к скорости эталона, не проходит проверку так же, как расхождение.
+
+CONFORMANCE_FORMAT = 1
+
+# Исход: (сумма, разложение, критичность, тяжесть, рекомендация)
+Outcome = Tuple[int, Optional[Dict[str, int]], bool, str, Optional[str]]
+_FIELDS = ("score", "breakdown", "critical", "severity", "recommendation")
+
+# Наименьшее ускорение относительно эталона (scoring_baseline) на нагрузке workload():
+# все пороги не ниже ×1 и примерно на 20% ниже наименьшего из замеров (одно ядро,
+# разброс между запусками до ±15%). Одиночная выборка из таблицы исходов (table)
+# порога не имеет: она не быстрее эталона, таблица ускоряет только расчёт когорт
+# (table_cohort, см. score_table.ScoreTable.evaluate).
+GATES: Dict[str, float] = {
+    "cache": 1.3,
+    "cache_scales": 1.2,
+    "records": 1.1,
+    "table_cohort": 15.0,
+    "batch": 15.0,
+    "batch_cohorts": 25.0,
+    "schema": 1.5,
+    "whatif": 1.3,
+    "service": 1.2,
+}
+
+_MAX_MISMATCHES = 100
+# Движки по общей анкете: один проход считает все шкалы, для замера хватает одного
+_ALL_SCALES = ("cache_scales", "compute_scales", "batch_cohorts", "schema")
+# Движки, которые получают строки CSV (текст): их скорость сравнивается с приведением
+# типов (pipeline.coerce_row) и эталоном на тех же строках
+_TEXT = ("schema",)
+_REFERENCE = {"FUSS": baseline.compute_fuss, "AUSS": baseline.compute_auss}
+
+
+# --- анкеты --------------------------------------------------------------------------
+
+def _edges(key: str) -> List[Any]:
+    # Значения по обе стороны каждой границы категории числового поля (в т. ч. дробные)
+    categorize = CRITERIA[key].categorize
+    out: List[Any] = []
+    prev = categorize(0)
+    for value in range(1, 1000):
+        cat = categorize(value)
+        if cat != prev:
+            out += [value - 1, value, value - 0.5]
+            prev = cat
+    return out
+
+
+def _option_values(key: str) -> List[Any]:
+    crit = CRITERIA[key]
+    if crit.categorize is None:
+        return list(crit.options)
+    return [0, 50] + _edges(key) + [999]
+
+
+def _aliases() -> Dict[str, List[str]]:
+    # Поле общей анкеты -> отдельные поля шкал (progress_speed -> progress_speed_f, _a)
+    out: Dict[str, List[str]] = {}
+    for spec in SCALES.values():
+        for key, name in spec.fields.items():
+            out.setdefault(key, []).append(name)
+    return out
+
+
+def questionnaires(n: int = 5000, seed: int = 0) -> List[Dict[str, Any]]:
+    # Общие анкеты (для всех шкал сразу). Первые — перебор: каждый вариант
+    # каждого поля, отдельные поля шкал и пропуск поля со значением по умолчанию
+    rng = random.Random(seed)
+    values = {key: _option_values(key) for key in CRITERIA}
+    aliases = _aliases()
+
+    def random_ctx() -> Dict[str, Any]:
+        ctx = {key: rng.choice(v) for key, v in values.items()}
+        for key in CRITERIA:
+            if not CRITERIA[key].required and rng.random() < 0.1:
+                del ctx[key]
+        for key, names in aliases.items():
+            for name in names:
+                if rng.random() < 0.3:
+                    ctx[name] = rng.choice(values[key])
+        return ctx
+
+    rows: List[Dict[str, Any]] = []
+    for key, options in values.items():
+        for value in options:
+            ctx = random_ctx()
+            ctx[key] = value
+            rows.append(ctx)
+            for name in aliases.get(key, ()):
+                rows.append(dict(ctx, **{name: value, key: rng.choice(options)}))
+        if not CRITERIA[key].required:
+            ctx = random_ctx()
+            ctx.pop(key, None)
+            rows.append(ctx)
+    # Перебор не обрезается, даже если он длиннее n
+    while len(rows) < n:
+        rows.append(random_ctx())
+    return rows
+
+
+def workload(n: int = 20000, seed: int = 0, unique: float = 0.25) -> List[Dict[str, Any]]:
+    # Нагрузка для замера скорости — как выгрузка отделения: все поля заполнены,
+    # анкеты повторяются (уникальна доля unique)
+    rng = random.Random(seed)
+    values = {key: _option_values(key) for key in CRITERIA}
+    pool = [{key: rng.choice(v) for key, v in values.items()} for _ in range(max(1, int(n * unique)))]
+    return [dict(rng.choice(pool)) for _ in range(n)]
+
+
+# --- эталон ---------------------------------------------------------------------------
+
+def reference(scale: str, ctx: Dict[str, Any]) -> Outcome:
+    res = _REFERENCE[scale](ctx)
+    sev = baseline.severity_from_score(res.score, scale, critical=res.critical)
+    rec = baseline.recommend_treatment(scale, sev, res.score, ctx, critical=res.critical)
+    return res.score, res.breakdown, res.critical, sev, rec
+
+
+# --- движки ---------------------------------------------------------------------------
+# Движок: (шкала, анкеты шкалы, общие анкеты) -> (run, collect). Подготовка входа
+# (столбцы, строки CSV) — при вызове движка, вне замера скорости; run() — сам расчёт;
+# collect(результат run) -> [(анкета шкалы, исход)], где анкета — та, для которой
+# считается эталон (обычно входная)
+
+Pairs = List[Tuple[Dict[str, Any], Outcome]]
+Engine = Callable[[str, List[Dict[str, Any]], List[Dict[str, Any]]], Tuple[Callable[[], Any], Callable[[Any], Pairs]]]
+
+
+def _results(ctxs: List[Dict[str, Any]]) -> Callable[[Any], Pairs]:
+    # Для движков, которые возвращают ScoreResult, тяжесть и рекомендацию по каждой анкете
+    def collect(results: List[Any]) -> Pairs:
+        return [
+            (ctx, (res.score, res.breakdown, res.critical, sev, rec))
+            for ctx, (res, sev, rec) in zip(ctxs, results)
+        ]
+    return collect
+
+
+def _engine_scoring(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    # Сам scoring.py: compute_fuss/compute_auss по скомпилированным таблицам
+    compute = {"FUSS": scoring.compute_fuss, "AUSS": scoring.compute_auss}[scale]
+
+    def run() -> List[Any]:
+        out = []
+        for ctx in ctxs:
+            res = compute(ctx)
+            sev = scoring.severity_from_score(res.score, scale, critical=res.critical)
+            out.append((res, sev, recommend_treatment(scale, sev, res.score, ctx, critical=res.critical)))
+        return out
+    return run, _results(ctxs)
+
+
+def _engine_cache(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    from cache import ScoringCache
+
+    def run() -> List[Any]:
+        evaluate = ScoringCache().evaluate
+        return [evaluate(scale, ctx) for ctx in ctxs]
+    return run, _results(ctxs)
+
+
+def _engine_cache_scales(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    # Обе шкалы по общей анкете; сверяется шкала scale
+    from cache import ScoringCache
+
+    i = tuple(SCALES).index(scale)
+
+    def run() -> List[Any]:
+        evaluate = ScoringCache().evaluate_scales
+        return [evaluate(tuple(SCALES), ctx)[i] for ctx in shared]
+    return run, _results(ctxs)
+
+
+def _engine_compute_scales(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    from scoring import compute_scales
+
+    def collect(results: List[Any]) -> Pairs:
+        return [(ctx, (res.score, res.breakdown, res.critical, None, None)) for ctx, res in zip(ctxs, results)]
+    return (lambda: [compute_scales(ctx)[scale] for ctx in shared]), collect
+
+
+def _engine_records(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    from records import CompactResult
+
+    def collect(results: List[Any]) -> Pairs:
+        return [(ctx, (r.score, r.breakdown, r.critical, r.severity, None)) for ctx, r in zip(ctxs, results)]
+    return (lambda: [CompactResult.from_context(scale, ctx) for ctx in ctxs]), collect
+
+
+def _engine_table(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    from score_table import default_table
+
+    evaluate = default_table().evaluate
+    return (lambda: [evaluate(scale, ctx) for ctx in ctxs]), _results(ctxs)
+
+
+def _by_fields(ctxs: List[Dict[str, Any]]) -> List[Tuple[List[int], Dict[str, Any]]]:
+    # Векторизованные пути принимают столбцы: анкеты группируются по набору полей
+    import numpy as np
+
+    groups: Dict[Tuple[str, ...], List[int]] = {}
+    for i, ctx in enumerate(ctxs):
+        groups.setdefault(tuple(sorted(ctx)), []).append(i)
+    out = []
+    for keys, index in groups.items():
+        cols = {}
+        for key in keys:
+            column = [ctxs[i][key] for i in index]
+            # Числа и строки вперемешку (после str() из CSV так не бывает) — столбец объектов
+            mixed = len({type(v) is str for v in column}) > 1
+            cols[key] = np.asarray(column, dtype=object if mixed else None)
+        out.append((index, cols))
+    return out
+
+
+def _engine_table_cohort(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    from score_table import default_table
+
+    table = default_table()
+    groups = _by_fields(ctxs)
+
+    def collect(results: List[Any]) -> Pairs:
+        out: List[Any] = [None] * len(ctxs)
+        for (index, _), (result, recs) in zip(groups, results):
+            for i, score, critical, sev, rec in zip(
+                    index, result.score.tolist(), result.critical.tolist(), result.severity.tolist(), recs.tolist()):
+                out[i] = (ctxs[i], (score, None, critical, SEVERITY_LEVELS[sev], table.recommendations[rec]))
+        return out
+    return (lambda: [table.score_cohort(cols, scale) for _, cols in groups]), collect
+
+
+def _batch_collect(ctxs: List[Dict[str, Any]], groups: List[Tuple[List[int], Dict[str, Any]]]) -> Callable[[Any], Pairs]:
+    def collect(results: List[Any]) -> Pairs:
+        out: List[Any] = [None] * len(ctxs)
+        for (index, _), res in zip(groups, results):
+            for i, score, critical, sev in zip(index, res.score.tolist(), res.critical.tolist(), res.severity.tolist()):
+                out[i] = (ctxs[i], (score, None, critical, SEVERITY_LEVELS[sev], None))
+        return out
+    return collect
+
+
+def _engine_batch(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    import batch
+
+    groups = _by_fields(ctxs)
+    return (lambda: [batch.score_cohort(cols, scale) for _, cols in groups]), _batch_collect(ctxs, groups)
+
+
+def _engine_batch_cohorts(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    import batch
+
+    groups = _by_fields(shared)
+    return (lambda: [batch.score_cohorts(cols)[scale] for _, cols in groups]), _batch_collect(ctxs, groups)
+
+
+def _engine_schema(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    # Строки как из CSV: все значения — текст
+    from cache import ScoringCache
+    from schema import get_schema
+
+    schema = get_schema()
+    rows = [{key: str(value) for key, value in ctx.items()} for ctx in shared]
+
+    def run() -> List[Any]:
+        # Строка разбирается один раз на обе шкалы, сверяется шкала scale
+        evaluate = ScoringCache().evaluate_codes
+        out = []
+        for row in rows:
+            decoded = schema.decode(row)
+            inputs = schema.debridement_inputs(decoded)
+            for name in SCALES:
+                codes = schema.scale_codes(decoded, name)
+                if isinstance(codes, Exception):
+                    raise codes
+                outcome = evaluate(name, codes, inputs)
+                if name == scale:
+                    out.append(outcome)
+        return out
+    return run, _results(ctxs)
+
+
+def _whatif_texts(scale: str) -> List[str]:
+    # Тексты рекомендаций в порядке индексов whatif._outcome_tables
+    from whatif import N_LEVELS, _variant_context, _variants
+
+    seen: Dict[str, int] = {}
+    for level in range(N_LEVELS):
+        for v in range(len(_variants()[0])):
+            seen.setdefault(recommend_treatment(scale, SEVERITY_LEVELS[level], 0, _variant_context(v)), len(seen))
+    return list(seen)
+
+
+def _engine_whatif(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    from whatif import Scenario, WhatIfCohort, WhatIfEngine
+
+    texts = _whatif_texts(scale)
+
+    def run() -> Any:
+        cohort = WhatIfCohort.from_contexts(ctxs, scale)
+        return cohort.critical, WhatIfEngine([cohort]).evaluate_arrays(Scenario("base"), scale)
+
+    def collect(result: Any) -> Pairs:
+        critical, (score, sev, rec) = result
+        return [
+            (ctx, (s, None, c, SEVERITY_LEVELS[v], texts[r]))
+            for ctx, s, c, v, r in zip(ctxs, score.tolist(), critical.tolist(), sev.tolist(), rec.tolist())
+        ]
+    return run, collect
+
+
+def _engine_explain(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    # Исход анкеты и исход каждой одиночной правки (правка — отдельная анкета)
+    from explain import _field_values, explain
+
+    compiled = get_scale(scale)
+    position = {key: i for i, key in enumerate(compiled.keys)}
+
+    def collect(results: List[Any]) -> Pairs:
+        out = []
+        for ctx, ex in zip(ctxs, results):
+            out.append((ctx, (ex.score, ex.breakdown, ex.critical, ex.severity, ex.recommendation)))
+            for e in ex.edits:
+                value = _field_values(e.key)[compiled.codes[position[e.key]][e.value]]
+                out.append((dict(ctx, **{e.key: value}), (e.score, None, e.critical, e.severity, e.recommendation)))
+        return out
+    return (lambda: [explain(scale, ctx) for ctx in ctxs]), collect
+
+
+def _engine_timeline(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    # Визит с предыдущей анкетой, затем правка до текущей — пересчёт по разности баллов
+    from timeline import THINNING_FIELD, Timeline
+
+    keys = get_scale(scale).keys
+    full = [{key: ctx.get(key, CRITERIA[key].default) for key in keys} for ctx in ctxs]
+    first = [dict(ctx, **{THINNING_FIELD: ctx.get(THINNING_FIELD, 0)}) for ctx in ctxs[-1:] + ctxs[:-1]]
+
+    def run() -> List[Any]:
+        with Timeline() as tl:
+            out = []
+            for n, (a, b) in enumerate(zip(first, full)):
+                visit = tl.add_visit(f"p{n}", scale, a, visited_at=float(n))
+                out.append(tl.update_visit(visit.id, b))
+            return out
+
+    def collect(results: List[Any]) -> Pairs:
+        return [(ctx, (v.score, v.result().breakdown, v.critical, v.severity, None)) for ctx, v in zip(full, results)]
+    return run, collect
+
+
+def _engine_service(scale: str, ctxs: List[Dict[str, Any]], shared: List[Dict[str, Any]]):
+    # Пачки одного состава полей идут векторизованным путём, остальные — через кэш
+    from service import Scorer
+
+    batches: Dict[Tuple[str, ...], List[int]] = {}
+    for i, ctx in enumerate(ctxs):
+        batches.setdefault(tuple(sorted(ctx)), []).append(i)
+    groups = list(batches.values())
+
+    def run() -> List[Any]:
+        scorer = Scorer()
+        return [scorer.evaluate_many(scale, [ctxs[i] for i in index])[0] for index in groups]
+
+    def collect(results: List[Any]) -> Pairs:
+        out: List[Any] = [None] * len(ctxs)
+        for index, items in zip(groups, results):
+            for i, item in zip(index, items):
+                if "error" in item:
+                    raise ValueError(item["error"])
+                out[i] = (ctxs[i], (item["score"], None, item["critical"], item["severity"], item["recommendation"]))
+        return out
+    return run, collect
+
+
+ENGINES: Dict[str, Engine] = {
+    "scoring": _engine_scoring,
+    "cache": _engine_cache,
+    "cache_scales": _engine_cache_scales,
+    "compute_scales": _engine_compute_scales,
+    "records": _engine_records,
+    "table": _engine_table,
+    "table_cohort": _engine_table_cohort,
+    "batch": _engine_batch,
+    "batch_cohorts": _engine_batch_cohorts,
+    "schema": _engine_schema,
+    "whatif": _engine_whatif,
+    "explain": _engine_explain,
+    "timeline": _engine_timeline,
+    "service": _engine_service,
+}
+
+
+# --- сверка ---------------------------------------------------------------------------
+
+def _diff(expected: Outcome, got: Outcome) -> List[str]:
+    return [
+        name for name, e, g in zip(_FIELDS, expected, got)
+        if g is not None and e != g
+    ]
+
+
+def _check_severity(mismatches: List[str], failed: Dict[str, int]) -> int:
+    # Тяжесть по каждой сумме с критичностью и без: scoring.severity_from_score и batch.severity_codes
+    import numpy as np
+
+    import batch
+
+    checked = 0
+    for scale in SCALES:
+        top = sum(max(p) for p in get_scale(scale).points) + 3
+        scores = np.arange(top + 1, dtype=np.int32)
+        for critical in (False, True):
+            flags = np.full(len(scores), critical)
+            got = batch.severity_codes(scores, scale, flags).tolist()
+            for score, sev in zip(scores.tolist(), got):
+                expected = baseline.severity_from_score(score, scale, critical=critical)
+                direct = scoring.severity_from_score(score, scale, critical=critical)
+                for name, text in (("severity_codes", SEVERITY_LEVELS[sev]), ("scoring", direct)):
+                    if text != expected:
+                        failed["severity"] = failed.get("severity", 0) + 1
+                    if text != expected and len(mismatches) < _MAX_MISMATCHES:
+                        mismatches.append(f"severity/{name} {scale} {score}/{critical}: {text} != {expected}")
+                checked += 1
+    return checked
+
+
+def _check_recommendations(mismatches: List[str], failed: Dict[str, int]) -> int:
+    # Рекомендация по каждой тяжести, критичности и сочетанию полей выбора кросслинкинга:
+    # кэш хранит только входы (debridement_inputs) и восстанавливает по ним анкету
+    from cache import ScoringCache, _debridement_context
+    from score_table import DEBRIDEMENT_FIELDS, _representatives
+
+    cache = ScoringCache()
+    reps = [_representatives(key) + ([None] if not CRITERIA[key].required else []) for key in DEBRIDEMENT_FIELDS]
+    checked = 0
+    for scale in SCALES:
+        for values in itertools.product(*reps):
+            ctx = {key: v for key, v in zip(DEBRIDEMENT_FIELDS, values) if v is not None}
+            inputs = debridement_inputs(ctx)
+            for sev in SEVERITY_LEVELS:
+                for critical in (False, True):
+                    expected = baseline.recommend_treatment(scale, sev, 0, ctx, critical=critical)
+                    direct = recommend_treatment(scale, sev, 0, ctx, critical=critical)
+                    restored = recommend_treatment(scale, sev, 0, _debridement_context(inputs), critical=critical)
+                    cached = cache.recommend_treatment(scale, sev, 0, ctx, critical=critical, inputs=inputs)
+                    for name, text in (("scoring", direct), ("inputs", restored), ("cache", cached)):
+                        if text != expected:
+                            failed["recommendation"] = failed.get("recommendation", 0) + 1
+                        if text != expected and len(mismatches) < _MAX_MISMATCHES:
+                            mismatches.append(f"recommendation/{name} {scale} {sev}/{critical} {ctx!r}")
+                    checked += 1
+    return checked
+
+
+def check_engines(shared: List[Dict[str, Any]], engines: Sequence[str], mismatches: List[str],
+                  failed: Dict[str, int]) -> Dict[str, int]:
+    # -> число сверенных исходов по движкам; failed — число расхождений по движкам
+    checked: Dict[str, int] = {}
+    for scale in SCALES:
+        ctxs = [scale_context(ctx, scale) for ctx in shared]
+        expected = {id(ctx): reference(scale, ctx) for ctx in ctxs}
+        for name in engines:
+            try:
+                run, collect = ENGINES[name](scale, ctxs, shared)
+                pairs = collect(run())
+            except Exception as e:  # любой сбой движка — расхождение, а не остановка сверки
+                failed[name] = failed.get(name, 0) + 1
+                mismatches.append(f"{name} {scale}: {type(e).__name__}: {e}")
+                continue
+            for ctx, got in pairs:
+                ref = expected.get(id(ctx)) or reference(scale, ctx)
+                fields = _diff(ref, got)
+                if fields:
+                    failed[name] = failed.get(name, 0) + 1
+                    if len(mismatches) < _MAX_MISMATCHES:
+                        # Ожидаемое -> полученное (текст рекомендации не выводится целиком)
+                        shown = ", ".join(
+                            f"{f}: {e!r} -> {g!r}" if f != "recommendation" else f
+                            for f, e, g in zip(_FIELDS, ref, got) if f in fields
+                        )
+                        mismatches.append(f"{name} {scale}: {shown}; анкета {ctx!r}")
+                checked[name] = checked.get(name, 0) + 1
+    return checked
+
+
+def _best(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def measure_speedups(shared: List[Dict[str, Any]], engines: Sequence[str], repeat: int = 3) -> Dict[str, Dict[str, float]]:
+    # Анкет в секунду по обеим шкалам и ускорение относительно эталона на тех же анкетах.
+    # Эталон замеряется вперемежку с каждым движком: отношение не зависит от того,
+    # как менялась нагрузка на машину за время всей проверки
+    from pipeline import coerce_row
+
+    per_scale = {scale: [scale_context(ctx, scale) for ctx in shared] for scale in SCALES}
+    items = len(shared) * len(per_scale)
+    rows = [{key: str(value) for key, value in ctx.items()} for ctx in shared]
+
+    def ref() -> None:
+        for scale, ctxs in per_scale.items():
+            for ctx in ctxs:
+                reference(scale, ctx)
+
+    def ref_text() -> None:
+        # Строки CSV без схемы: приведение типов, затем эталон
+        for row in rows:
+            ctx = coerce_row(row)
+            for scale in SCALES:
+                reference(scale, scale_context(ctx, scale))
+
+    out: Dict[str, Dict[str, float]] = {}
+    fastest = float("inf")
+    for name in engines:
+        runs = [ENGINES[name](scale, ctxs, shared)[0] for scale, ctxs in per_scale.items()]
+        if name in _ALL_SCALES:
+            runs = runs[:1]
+        for run in runs:
+            run()  # ленивые таблицы и импорты — вне замера
+        base = t = float("inf")
+        for _ in range(repeat):
+            base = min(base, _best(ref_text if name in _TEXT else ref, 1))
+            t = min(t, _best(lambda: [run() for run in runs], 1))
+        if name not in _TEXT:
+            fastest = min(fastest, base)
+        out[name] = {"per_s": items / t, "speedup": base / t}
+    if fastest == float("inf"):
+        fastest = _best(ref, repeat)
+    return dict({"reference": {"per_s": items / fastest, "speedup": 1.0}}, **out)
+
+
+def run_conformance(n: int = 5000, seed: int = 0, engines: Optional[Sequence[str]] = None,
+                    gates: Optional[Dict[str, float]] = None, repeat: int = 3, load: int = 20000) -> Dict[str, Any]:
+    engines = list(engines or ENGINES)
+    unknown = [name for name in engines if name not in ENGINES]
+    if unknown:
+        raise ValueError(f"Неизвестные движки: {', '.join(unknown)} (есть: {', '.join(ENGINES)})")
+    gates = GATES if gates is None else gates
+    shared = questionnaires(n, seed)
+    mismatches: List[str] = []
+    failed: Dict[str, int] = {}
+    checked = check_engines(shared, engines, mismatches, failed)
+    checked["severity"] = _check_severity(mismatches, failed)
+    checked["recommendation"] = _check_recommendations(mismatches, failed)
+    gated = [name for name in engines if name in gates]
+    speed = measure_speedups(workload(load, seed), gated, repeat) if gated and load else {}
+    slow = [
+        {"engine": name, "speedup": speed[name]["speedup"], "gate": gates[name]}
+        for name in gated if name in speed and speed[name]["speedup"] < gates[name]
+    ]
+    return {
+        "format": CONFORMANCE_FORMAT,
+        "spec": spec_fingerprint(),
+        "questionnaires": len(shared),
+        "seed": seed,
+        "checked": checked,
+        "failed": failed,
+        "mismatches": mismatches,
+        "throughput": speed,
+        "gate_failures": slow,
+    }
+
+
+def load_gates(path: str) -> Dict[str, float]:
+    # JSON {"движок": наименьшее ускорение}; дополняет и заменяет GATES
+    with open(path, "r", encoding="utf-8") as f:
+        return dict(GATES, **{key: float(value) for key, value in json.load(f).items()})
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [f"Анкет: {report['questionnaires']} (seed {report['seed']})"]
+    for name, count in report["checked"].items():
+        bad = report["failed"].get(name, 0)
+        lines.append(f"  {name:<16} сверено {count:>9,}{f', расхождений {bad:,}' if bad else ''}".replace(",", " "))
+    for name, s in report["throughput"].items():
+        lines.append(f"  {name:<16} {s['per_s']:>12,.0f} анкет/с  ×{s['speedup']:.1f}".replace(",", " "))
+    for line in report["mismatches"]:
+        lines.append(f"РАСХОЖДЕНИЕ {line}")
+    for g in report["gate_failures"]:
+        lines.append(f"МЕДЛЕННО {g['engine']}: ускорение ×{g['speedup']:.2f} < ×{g['gate']:.2f}")
+    return "\n".join(lines)
@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import itertools
+import re
+import struct
+import threading
+import time
+import zlib
+from io import BytesIO
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+
+# Быстрая сборка DOCX-протоколов по заготовке.
+# Пустой документ python-docx сохраняется один раз; все его части, кроме
+# word/document.xml, заранее сжимаются (deflate) и при каждом отчёте
+# копируются в архив как есть. Для отчёта формируется только XML абзацев.
+#
+# Блок отчёта: (уровень заголовка, текст); None — обычный абзац.
+# Разметка абзацев повторяет python-docx (add_heading/add_paragraph):
+# табуляция -> <w:tab/>, перевод строки -> <w:br/>, xml:space="preserve"
+# при пробелах по краям.
+
+Block = Tuple[Optional[int], str]
+
+_DOCUMENT_PART = "word/document.xml"
+# Символы, недопустимые в XML 1.0 (lxml в python-docx на них тоже падает)
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+_RUN_SPLIT = re.compile(r"(\t|\r|\n)")
+
+
+def escape(text: str) -> str:
+    # То же, что xml.sax.saxutils.escape, без импорта xml.sax (тянет urllib и email)
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _style_xml(level: Optional[int]) -> str:
+    if level is None:
+        return ""
+    style = "Title" if level == 0 else f"Heading{level}"
+    return f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>'
+
+
+def _run_xml(text: str) -> str:
+    out: List[str] = []
+    for piece in _RUN_SPLIT.split(text):
+        if not piece:
+            continue
+        if piece == "\t":
+            out.append("<w:tab/>")
+        elif piece in ("\r", "\n"):
+            out.append("<w:br/>")
+        elif len(piece.strip()) < len(piece):
+            out.append(f'<w:t xml:space="preserve">{escape(piece)}</w:t>')
+        else:
+            out.append(f"<w:t>{escape(piece)}</w:t>")
+    return "<w:r>" + "".join(out) + "</w:r>"
+
+
+def paragraph_xml(level: Optional[int], text: str) -> str:
+    if _INVALID_XML.search(text):
+        raise ValueError("All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters")
+    style = _style_xml(level)
+    if not text:
+        return f"<w:p>{style}</w:p>" if style else "<w:p/>"
+    return f"<w:p>{style}{_run_xml(text)}</w:p>"
+
+
+PAGE_BREAK_XML = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+
+
+def table_xml_start(widths: Sequence[int], header: Sequence[str], style: str = "TableGrid") -> str:
+    # Начало таблицы (ширины столбцов — в twips) со строкой заголовка,
+    # повторяемой на каждой странице; строки — table_row_xml, конец — TABLE_END_XML
+    grid = "".join(f'<w:gridCol w:w="{w}"/>' for w in widths)
+    return (
+        f'<w:tbl><w:tblPr><w:tblStyle w:val="{style}"/><w:tblW w:w="0" w:type="auto"/>'
+        f'<w:tblLook w:val="04A0"/></w:tblPr><w:tblGrid>{grid}</w:tblGrid>'
+        + table_row_xml(widths, header, header=True)
+    )
+
+
+def table_row_xml(widths: Sequence[int], cells: Sequence[str], header: bool = False) -> str:
+    row = "<w:tr><w:trPr><w:tblHeader/></w:trPr>" if header else "<w:tr>"
+    for width, text in zip(widths, cells):
+        para = paragraph_xml(None, text)
+        if header and text:
+            para = para.replace("<w:r>", "<w:r><w:rPr><w:b/></w:rPr>")
+        row += f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/></w:tcPr>{para}</w:tc>'
+    return row + "</w:tr>"
+
+
+TABLE_END_XML = "</w:tbl>"
+
+
+def render_python_docx(blocks: Iterable[Block]) -> bytes:
+    # Эталонная сборка через python-docx (прежний путь; нужен для заготовки и сверки)
+    from docx import Document
+
+    doc = Document()
+    for level, text in blocks:
+        if level is None:
+            doc.add_paragraph(text)
+        else:
+            doc.add_heading(text, level=level)
+    bio = BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
+
+
+class _Part:
+    __slots__ = ("name", "data", "crc", "size")
+
+    def __init__(self, name: str, raw: bytes):
+        self.name = name.encode("ascii")
+        self.crc = zlib.crc32(raw)
+        self.size = len(raw)
+        self.data = _deflate(raw)
+
+
+def _deflate(raw: bytes) -> bytes:
+    comp = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    return comp.compress(raw) + comp.flush()
+
+
+def _dos_datetime(ts: float) -> Tuple[int, int]:
+    t = time.localtime(ts)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class DocxTemplate:
+    def __init__(self, source: Optional[bytes] = None):
+        # source — готовый .docx-файл-заготовка; по умолчанию пустой документ python-docx
+        self._source = source
+        self._parts: Optional[List[Optional[_Part]]] = None
+        self._head = ""
+        self._tail = ""
+        self._lock = threading.Lock()
+
+    def _load(self) -> List[Optional[_Part]]:
+        with self._lock:
+            if self._parts is not None:
+                return self._parts
+            import zipfile
+
+            source = self._source if self._source is not None else render_python_docx(())
+            parts: List[Optional[_Part]] = []
+            with zipfile.ZipFile(BytesIO(source)) as zf:
+                for info in zf.infolist():
+                    raw = zf.read(info.filename)
+                    if info.filename == _DOCUMENT_PART:
+                        xml = raw.decode("utf-8")
+                        body_start = xml.index("<w:body>") + len("<w:body>")
+                        sect = xml.find("<w:sectPr", body_start)
+                        body_end = sect if sect >= 0 else xml.index("</w:body>")
+                        self._head = xml[:body_start]
+                        self._tail = xml[body_end:]
+                        parts.append(None)  # место основной части в архиве
+                    else:
+                        parts.append(_Part(info.filename, raw))
+            self._parts = parts
+            return parts
+
+    def document_xml(self, blocks: Iterable[Block]) -> bytes:
+        self._load()
+        body = "".join(paragraph_xml(level, text) for level, text in blocks)
+        return (self._head + body + self._tail).encode("utf-8")
+
+    def render(self, blocks: Iterable[Block]) -> bytes:
+        # Части собираются одним join без промежуточного BytesIO и копии getvalue()
+        chunks: List[bytes] = []
+        self.prepare(blocks).write(_Chunks(chunks))
+        return b"".join(chunks)
+
+    def render_xml(self, document: bytes) -> bytes:
+        # Архив по готовому word/document.xml (document_xml), остальные части — из заготовки
+        parts = self._load()
+        main = _Part(_DOCUMENT_PART, document)
+        chunks: List[bytes] = []
+        PreparedDocx([part or main for part in parts]).write(_Chunks(chunks))
+        return b"".join(chunks)
+
+    def write(self, out, blocks: Iterable[Block]) -> int:
+        # Запись архива в файловый объект; возвращает число записанных байт
+        return self.prepare(blocks).write(out)
+
+    def prepare(self, blocks: Iterable[Block]) -> "PreparedDocx":
+        # XML документа собирается и проверяется до записи первого байта,
+        # поэтому ошибка в тексте не оставляет в выходном потоке обрывков
+        parts = self._load()
+        document = _Part(_DOCUMENT_PART, self.document_xml(blocks))
+        return PreparedDocx([part or document for part in parts])
+
+    def write_stream(self, out, body: Iterable[Union[str, bytes]]) -> int:
+        # Документ произвольного размера: XML тела (куски body) сжимается по мере
+        # поступления, CRC и размеры элемента — в дескрипторе данных после него,
+        # поэтому out может быть и несдвигаемым потоком. -> число записанных байт
+        parts = self._load()
+        dos_time, dos_date = _dos_datetime(time.time())
+        central: List[bytes] = []
+        offset = 0
+        for part in parts:
+            if part is not None:
+                name, flags = part.name, 0
+                crc, csize, size = part.crc, len(part.data), part.size
+                header = struct.pack(
+                    "<IHHHHHIIIHH", 0x04034B50, 20, flags, 8, dos_time, dos_date, crc, csize, size, len(name), 0,
+                ) + name
+                out.write(header)
+                out.write(part.data)
+                offset_next = offset + len(header) + csize
+            else:
+                name, flags = _DOCUMENT_PART.encode("ascii"), 0x08
+                header = struct.pack(
+                    "<IHHHHHIIIHH", 0x04034B50, 20, flags, 8, dos_time, dos_date, 0, 0, 0, len(name), 0,
+                ) + name
+                out.write(header)
+                crc, csize, size = _deflate_stream(out, itertools.chain((self._head,), body, (self._tail,)))
+                if csize >= 0xFFFFFFFF or size >= 0xFFFFFFFF:
+                    raise ValueError("document.xml больше 4 ГиБ")
+                out.write(struct.pack("<IIII", 0x08074B50, crc, csize, size))
+                offset_next = offset + len(header) + csize + 16
+            central.append(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, 0x0314, 20, flags, 8, dos_time, dos_date,
+                crc, csize, size, len(name), 0, 0, 0, 0, 0o600 << 16, offset,
+            ) + name)
+            offset = offset_next
+        cd = b"".join(central)
+        out.write(cd)
+        out.write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(central), len(central), len(cd), offset, 0))
+        return offset + len(cd) + 22
+
+
+def _deflate_stream(out, pieces: Iterable[Union[str, bytes]], flush_every: int = 1 << 16) -> Tuple[int, int, int]:
+    # -> (crc32, сжатый размер, исходный размер)
+    comp = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    crc = size = csize = 0
+    buf: List[bytes] = []
+    pending = 0
+    for piece in pieces:
+        data = piece.encode("utf-8") if isinstance(piece, str) else piece
+        crc = zlib.crc32(data, crc)
+        size += len(data)
+        buf.append(data)
+        pending += len(data)
+        if pending >= flush_every:
+            packed = comp.compress(b"".join(buf))
+            out.write(packed)
+            csize += len(packed)
+            buf.clear()
+            pending = 0
+    packed = comp.compress(b"".join(buf)) + comp.flush()
+    out.write(packed)
+    return crc, csize + len(packed), size
+
+
+class _Chunks:
+    __slots__ = ("write",)
+
+    def __init__(self, chunks: List[bytes]):
+        self.write = chunks.append
+
+
+class PreparedDocx:
+    __slots__ = ("parts",)
+
+    def __init__(self, parts: List[_Part]):
+        self.parts = parts
+
+    @property
+    def nbytes(self) -> int:
+        local = sum(30 + len(p.name) + len(p.data) for p in self.parts)
+        return local + sum(46 + len(p.name) for p in self.parts) + 22
+
+    def write(self, out) -> int:
+        dos_time, dos_date = _dos_datetime(time.time())
+        central: List[bytes] = []
+        offset = 0
+        for part in self.parts:
+            header = struct.pack(
+                "<IHHHHHIIIHH", 0x04034B50, 20, 0, 8, dos_time, dos_date,
+                part.crc, len(part.data), part.size, len(part.name), 0,
+            )
+            out.write(header)
+            out.write(part.name)
+            out.write(part.data)
+            central.append(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, 0x0314, 20, 0, 8, dos_time, dos_date,
+                part.crc, len(part.data), part.size, len(part.name), 0, 0, 0, 0, 0o600 << 16, offset,
+            ) + part.name)
+            offset += len(header) + len(part.name) + len(part.data)
+        cd = b"".join(central)
+        out.write(cd)
+        out.write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(central), len(central), len(cd), offset, 0))
+        return offset + len(cd) + 22
+
+
+_DEFAULT = DocxTemplate()
+
+
+def default_template() -> DocxTemplate:
+    return _DEFAULT
+
+
+def render_blocks(blocks: Sequence[Block]) -> bytes:
+    return _DEFAULT.render(blocks)
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from score_table import DEBRIDEMENT_FIELDS, _representatives
+from scoring import (
+    CRITERIA,
+    SEVERITY_LEVELS,
+    _lookup,
+    choose_debridement,
+    get_scale,
+    recommend_treatment,
+)
+
+
+# Что изменится при замене одного ответа анкеты.
+# Сумма аддитивна: новая сумма = сумма − баллы критерия + баллы нового варианта;
+# критичность — «или» по ответам, поэтому достаточно знать, сколько критичных
+# ответов в анкете и какой критерий их даёт. Тяжесть берётся из таблицы порогов,
+# рекомендация пересчитывается только для критериев, влияющих на выбор
+# кросслинкинга (DEBRIDEMENT_FIELDS), остальные тексты берутся из памяти
+# по (тяжесть, критичность, вариант). Итого — один разбор анкеты на все правки.
+
+
+@dataclass(frozen=True)
+class Edit:
+    key: str
+    label: str
+    current: Any
+    value: Any
+    delta: int
+    score: int
+    severity: str
+    critical: bool
+    recommendation: str
+    recommendation_changed: bool
+
+
+@dataclass(frozen=True)
+class Explanation:
+    scale: str
+    score: int
+    severity: str
+    critical: bool
+    recommendation: str
+    breakdown: Dict[str, int]
+    # Сколько баллов до следующей/предыдущей степени (None — крайняя степень или критичность)
+    to_upgrade: Optional[int]
+    to_downgrade: Optional[int]
+    edits: Tuple[Edit, ...]
+
+    def changing(self) -> List[Edit]:
+        # Правки, меняющие степень тяжести или рекомендацию; сначала наименьшие по баллам
+        out = [e for e in self.edits if e.severity != self.severity or e.recommendation_changed]
+        return sorted(out, key=lambda e: (abs(e.delta), e.key))
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "scale": self.scale,
+            "score": self.score,
+            "severity": self.severity,
+            "critical": self.critical,
+            "to_upgrade": self.to_upgrade,
+            "to_downgrade": self.to_downgrade,
+            "edits": [
+                {
+                    "key": e.key,
+                    "label": e.label,
+                    "from": e.current,
+                    "to": e.value,
+                    "delta": e.delta,
+                    "score": e.score,
+                    "severity": e.severity,
+                    "critical": e.critical,
+                    "recommendation_changed": e.recommendation_changed,
+                }
+                for e in self.edits
+            ],
+        }
+
+
+@lru_cache(maxsize=None)
+def _field_values(key: str) -> Tuple[Any, ...]:
+    # Значение поля анкеты для каждого варианта (для толщин — из категории)
+    return tuple(_representatives(key))
+
+
+def _severity(score: int, critical: bool, thresholds: Tuple[int, ...]) -> str:
+    if critical:
+        return SEVERITY_LEVELS[-1]
+    return SEVERITY_LEVELS[bisect_left(thresholds, score)]
+
+
+def explain(scale: str, ctx: Dict[str, Any]) -> Explanation:
+    compiled = get_scale(scale)
+    values, pts = _lookup(compiled, ctx, compiled.lookups)
+    thresholds = compiled.thresholds
+    score = sum(pts)
+
+    # Критичные ответы по позициям критериев
+    critical_at = [i for i, opt in compiled.critical if values[i] == opt]
+    critical_options: Dict[int, set] = {}
+    for i, opt in compiled.critical:
+        critical_options.setdefault(i, set()).add(opt)
+    critical = bool(critical_at)
+
+    severity = _severity(score, critical, thresholds)
+    base_debridement = choose_debridement(ctx)
+    recs: Dict[Tuple[str, bool, str], str] = {}
+
+    def recommendation(sev: str, crit: bool, debridement: str, edited: Dict[str, Any]) -> str:
+        # Текст зависит только от тяжести, критичности и выбранного вида кросслинкинга
+        key = (sev, crit, debridement)
+        text = recs.get(key)
+        if text is None:
+            text = recs[key] = recommend_treatment(compiled.name, sev, 0, edited, critical=crit)
+        return text
+
+    current_rec = recommendation(severity, critical, base_debridement, ctx)
+
+    if critical:
+        to_upgrade = to_downgrade = None
+    else:
+        level = SEVERITY_LEVELS.index(severity)
+        to_upgrade = thresholds[level] + 1 - score if level < len(thresholds) else None
+        to_downgrade = score - thresholds[level - 1] if level > 0 else None
+
+    edits: List[Edit] = []
+    for i, key in enumerate(compiled.keys):
+        codes = compiled.codes[i]
+        current = values[i]
+        others_critical = any(j != i for j in critical_at)
+        for opt, code in codes.items():
+            if opt == current:
+                continue
+            delta = compiled.points[i][code] - pts[i]
+            new_critical = others_critical or opt in critical_options.get(i, ())
+            new_score = score + delta
+            sev = _severity(new_score, new_critical, thresholds)
+            if key in DEBRIDEMENT_FIELDS:
+                edited = dict(ctx)
+                edited[key] = _field_values(key)[code]
+                debridement = choose_debridement(edited)
+            else:
+                edited, debridement = ctx, base_debridement
+            rec = recommendation(sev, new_critical, debridement, edited)
+            edits.append(Edit(
+                key=key,
+                label=compiled.labels[i],
+                current=current,
+                value=opt,
+                delta=delta,
+                score=new_score,
+                severity=sev,
+                critical=new_critical,
+                recommendation=rec,
+                recommendation_changed=rec != current_rec,
+            ))
+
+    return Explanation(
+        scale=compiled.name,
+        score=score,
+        severity=severity,
+        critical=critical,
+        recommendation=current_rec,
+        breakdown=dict(zip(compiled.labels, pts)),
+        to_upgrade=to_upgrade,
+        to_downgrade=to_downgrade,
+        edits=tuple(edits),
+    )
+
+
+def option_text(key: str, value: Any) -> str:
+    # Короткая подпись варианта для таблиц (категории толщин и размера — как есть)
+    crit = CRITERIA[key]
+    if isinstance(value, int) and set(crit.options) <= {0, 1}:
+        return "да" if value else "нет"
+    return str(value)
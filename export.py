@@ -0,0 +1,496 @@
+from __future__ import annotations
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from scoring import format_report_docx_local, report_blocks_local, report_filename_local
+
+
+# Параллельная сборка DOCX-протоколов для больших выгрузок.
+# Записи группируются в пачки (chunksize) и отправляются в пул процессов;
+# одновременно в работе не больше max_pending пачек, поэтому память не растёт
+# с размером выгрузки. Готовые протоколы сразу дописываются в один zip —
+# по порядку подачи (ordered=True) или по мере готовности.
+# Ошибка в одной записи не прерывает выгрузку: она попадает в сводку.
+#
+# Потоковая выгрузка (StreamingReportWriter): каждый протокол пишется
+# напрямую в приёмник — элемент zip (StreamingZip) или файл в каталоге
+# (DirectorySink) — без сборки документа в отдельный буфер. Центральный
+# каталог zip копится во временном файле, поэтому память не зависит от
+# числа протоколов (для 100k и больше — zip64).
+
+
+@dataclass(frozen=True)
+class ReportJob:
+    member: str  # имя файла в архиве; пустое — имя из format_report_docx_local
+    patient_name: str
+    patient_id: str
+    scale: str
+    score: int
+    severity: str
+    recommendation: str
+    breakdown: Optional[Dict[str, int]] = None
+
+
+@dataclass(frozen=True)
+class RenderedReport:
+    member: str
+    data: Optional[bytes]
+    error: str = ""
+
+
+@dataclass
+class ExportSummary:
+    written: int = 0
+    failed: int = 0
+    bytes: int = 0
+    errors: List[Tuple[str, str]] = field(default_factory=list)
+    seconds: float = 0.0
+    peak_rss_kib: int = 0  # пик RSS процесса (ru_maxrss) к моменту сводки
+    peak_traced_kib: float = 0.0  # пик выделений Python за выгрузку (trace_memory=True)
+
+    def add_error(self, member: str, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < _MAX_ERRORS:
+            self.errors.append((member, error))
+
+
+ProgressCallback = Callable[[ExportSummary], None]
+
+
+def peak_rss_kib() -> int:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+_MAX_ERRORS = 1000
+
+
+def render_job(job: ReportJob) -> RenderedReport:
+    try:
+        data, filename = format_report_docx_local(
+            job.patient_name, job.patient_id, job.scale, job.score,
+            job.severity, job.recommendation, job.breakdown,
+        )
+    except Exception as e:  # запись с ошибкой не должна ронять всю пачку
+        return RenderedReport(job.member or job.patient_id or "?", None, f"{type(e).__name__}: {e}")
+    return RenderedReport(job.member or filename, data)
+
+
+def _render_chunk(jobs: List[ReportJob]) -> List[RenderedReport]:
+    return [render_job(job) for job in jobs]
+
+
+def _warm_worker() -> None:
+    # Заготовка DOCX загружается один раз на процесс, а не на первой пачке
+    from docx_template import default_template
+
+    default_template().render(())
+
+
+def default_workers() -> int:
+    return max(1, (os.cpu_count() or 1))
+
+
+class ReportRenderer:
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        chunksize: int = 64,
+        ordered: bool = True,
+        max_pending: Optional[int] = None,
+    ):
+        # Процессов не больше, чем ядер: лишние только делят ядро с основным процессом,
+        # а на одном ядре пул медленнее последовательной сборки
+        self.workers = min(workers or default_workers(), default_workers())
+        self.chunksize = max(1, chunksize)
+        self.ordered = ordered
+        self.max_pending = max_pending or self.workers * 2
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if self.workers > 1:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        self._chunk: List[ReportJob] = []
+        self._pending: Deque[Future] = deque()
+
+    def submit(self, job: ReportJob) -> List[RenderedReport]:
+        # Возвращает протоколы, готовые к этому моменту
+        self._chunk.append(job)
+        if len(self._chunk) < self.chunksize:
+            return []
+        return self._flush_chunk()
+
+    def _flush_chunk(self) -> List[RenderedReport]:
+        chunk, self._chunk = self._chunk, []
+        if not chunk:
+            return []
+        if self._pool is None:
+            return _render_chunk(chunk)
+        out: List[RenderedReport] = []
+        while len(self._pending) >= self.max_pending:
+            out.extend(self._drain(block=True))
+        self._pending.append(self._pool.submit(_render_chunk, chunk))
+        out.extend(self._drain(block=False))
+        return out
+
+    def _drain(self, block: bool) -> List[RenderedReport]:
+        out: List[RenderedReport] = []
+        if not self._pending:
+            return out
+        if self.ordered:
+            # Выдаём только с головы очереди, сохраняя порядок подачи
+            if block:
+                self._pending[0].result()
+            while self._pending and self._pending[0].done():
+                out.extend(self._pending.popleft().result())
+            return out
+        done, _ = wait(list(self._pending), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for fut in [f for f in self._pending if f in done]:
+            self._pending.remove(fut)
+            out.extend(fut.result())
+        return out
+
+    def finish(self) -> Iterator[RenderedReport]:
+        yield from self._flush_chunk()
+        while self._pending:
+            yield from self._drain(block=True)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def __enter__(self) -> "ReportRenderer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _dos_datetime(ts: float) -> Tuple[int, int]:
+    t = time.localtime(ts)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class _MemberStream:
+    # Файловый объект элемента zip: считает CRC и длину на лету
+    __slots__ = ("_out", "crc", "size")
+
+    def __init__(self, out: BinaryIO):
+        self._out = out
+        self.crc = 0
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self._out.write(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        return len(data)
+
+
+class StreamingZip:
+    # zip без сжатия (DOCX уже сжат внутри). Заголовок элемента пишется
+    # с нулевыми CRC/размером (флаг 3), они идут в дескрипторе данных после
+    # элемента — без возврата к заголовку; записи центрального каталога уходят
+    # во временный файл.
+    def __init__(self, path: str):
+        self.path = path
+        self._out = open(path, "wb")
+        self._central = tempfile.TemporaryFile()
+        self._names = _MemberNames()
+        self._count = 0
+        self._offset = 0
+        self._dos = _dos_datetime(time.time())
+
+    def write_member(self, name: str, write: Callable[[BinaryIO], object]) -> int:
+        # write(stream) пишет содержимое; -> число байт данных элемента
+        raw = self._names.unique(name).encode("utf-8")
+        flags = 0x08 if raw.isascii() else 0x808
+        offset = self._offset
+        header = struct.pack("<IHHHHHIIIHH", 0x04034B50, 20, flags, 0, *self._dos, 0, 0, 0, len(raw), 0) + raw
+        self._out.write(header)
+        stream = _MemberStream(self._out)
+        try:
+            write(stream)
+        except BaseException:
+            # Недописанный элемент отрезается
+            self._out.seek(offset)
+            self._out.truncate()
+            raise
+        if stream.size >= 0xFFFFFFFF:
+            self._out.seek(offset)
+            self._out.truncate()
+            raise ValueError(f"Элемент {name} больше 4 ГиБ")
+        descriptor = struct.pack("<IIII", 0x08074B50, stream.crc, stream.size, stream.size)
+        self._out.write(descriptor)
+        self._offset = offset + len(header) + stream.size + len(descriptor)
+        extra = b""
+        if offset >= 0xFFFFFFFF:
+            extra = struct.pack("<HHQ", 0x0001, 8, offset)
+        self._central.write(struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, 0x0314, 45 if extra else 20, flags, 0, *self._dos,
+            stream.crc, stream.size, stream.size, len(raw), len(extra), 0, 0, 0, 0o644 << 16,
+            min(offset, 0xFFFFFFFF),
+        ) + raw + extra)
+        self._count += 1
+        return stream.size
+
+    def close(self) -> None:
+        if self._out.closed:
+            return
+        try:
+            start = self._offset
+            self._central.seek(0)
+            shutil.copyfileobj(self._central, self._out, 1 << 20)
+            size = self._out.tell() - start
+            if self._count >= 0xFFFF or start >= 0xFFFFFFFF or size >= 0xFFFFFFFF:
+                end64 = start + size
+                self._out.write(struct.pack(
+                    "<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, self._count, self._count, size, start,
+                ))
+                self._out.write(struct.pack("<IIQI", 0x07064B50, 0, end64, 1))
+            self._out.write(struct.pack(
+                "<IHHHHIIH", 0x06054B50, 0, 0, min(self._count, 0xFFFF), min(self._count, 0xFFFF),
+                min(size, 0xFFFFFFFF), min(start, 0xFFFFFFFF), 0,
+            ))
+        finally:
+            self._central.close()
+            self._out.close()
+
+
+def member_name(name: str) -> str:
+    # Имя элемента без разделителей каталогов и ведущих точек: элемент не выходит
+    # за пределы архива или каталога выгрузки
+    for sep in {"/", "\\", os.sep}:
+        name = name.replace(sep, "_")
+    return name.lstrip(".") or "_"
+
+
+class _MemberNames:
+    # Имена, уже записанные этой выгрузкой: совпавшее имя (без учёта регистра —
+    # файловые системы Windows/macOS и распаковщики) получает суффикс _2, _3, ...
+    def __init__(self) -> None:
+        self._seen: Set[str] = set()
+
+    def unique(self, name: str) -> str:
+        name = member_name(name)
+        stem, ext = os.path.splitext(name)
+        n = 1
+        while name.lower() in self._seen:
+            n += 1
+            name = f"{stem}_{n}{ext}"
+        self._seen.add(name.lower())
+        return name
+
+
+class DirectorySink:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._names = _MemberNames()
+
+    def write_member(self, name: str, write: Callable[[BinaryIO], object]) -> int:
+        target = os.path.join(self.path, self._names.unique(name))
+        try:
+            with open(target, "wb") as f:
+                write(f)
+                return f.tell()
+        except BaseException:
+            if os.path.exists(target):
+                os.remove(target)
+            raise
+
+    def close(self) -> None:
+        pass
+
+
+def open_sink(path: str):
+    # -> StreamingZip | DirectorySink: write_member(name, write) и close()
+    # Существующий каталог или путь с «/» в конце — каталог, иначе zip
+    if path.endswith(("/", os.sep)) or os.path.isdir(path):
+        return DirectorySink(path)
+    return StreamingZip(path)
+
+
+class StreamingReportWriter:
+    # Последовательная выгрузка в приёмник без промежуточных буферов документа.
+    # progress(summary) вызывается каждые progress_every протоколов и в конце
+    def __init__(
+        self,
+        target,
+        progress: Optional[ProgressCallback] = None,
+        progress_every: int = 1000,
+        trace_memory: bool = False,
+    ):
+        from docx_template import default_template
+
+        self.summary = ExportSummary()
+        self._sink = open_sink(target) if isinstance(target, str) else target
+        self._template = default_template()
+        self._progress = progress
+        self._every = max(1, progress_every)
+        self._trace = trace_memory
+        self._t0 = time.perf_counter()
+        if trace_memory:
+            import tracemalloc
+
+            tracemalloc.start()
+
+    def submit(self, job: ReportJob) -> None:
+        member = job.member or report_filename_local(job.patient_name, job.patient_id, job.scale)
+        try:
+            doc = self._template.prepare(report_blocks_local(
+                job.patient_name, job.patient_id, job.scale, job.score,
+                job.severity, job.recommendation, job.breakdown,
+            ))
+        except Exception as e:  # запись с ошибкой не должна ронять выгрузку
+            self.summary.add_error(job.member or job.patient_id or "?", f"{type(e).__name__}: {e}")
+        else:
+            self.summary.bytes += self._sink.write_member(member, doc.write)
+            self.summary.written += 1
+        done = self.summary.written + self.summary.failed
+        if self._progress is not None and done % self._every == 0:
+            self._progress(self._snapshot())
+
+    def submit_many(self, jobs: Iterable[ReportJob]) -> None:
+        for job in jobs:
+            self.submit(job)
+
+    def _snapshot(self) -> ExportSummary:
+        self.summary.seconds = time.perf_counter() - self._t0
+        self.summary.peak_rss_kib = peak_rss_kib()
+        if self._trace:
+            import tracemalloc
+
+            self.summary.peak_traced_kib = tracemalloc.get_traced_memory()[1] / 1024
+        return self.summary
+
+    def close(self) -> ExportSummary:
+        try:
+            self._sink.close()
+        finally:
+            self._snapshot()
+            if self._trace:
+                import tracemalloc
+
+                tracemalloc.stop()
+                self._trace = False
+        if self._progress is not None:
+            self._progress(self.summary)
+        return self.summary
+
+    def __enter__(self) -> "StreamingReportWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ParallelReportWriter:
+    def __init__(
+        self,
+        zip_path: str,
+        workers: Optional[int] = None,
+        chunksize: int = 64,
+        ordered: bool = True,
+        max_pending: Optional[int] = None,
+        progress: Optional[ProgressCallback] = None,
+        progress_every: int = 1000,
+    ):
+        # zip_path — путь к zip или каталогу (см. open_sink)
+        self.summary = ExportSummary()
+        self._renderer = ReportRenderer(workers, chunksize, ordered, max_pending)
+        self._sink = open_sink(zip_path)
+        self._progress = progress
+        self._every = max(1, progress_every)
+        self._t0 = time.perf_counter()
+
+    def submit(self, job: ReportJob) -> None:
+        self._write_all(self._renderer.submit(job))
+
+    def submit_many(self, jobs: Iterable[ReportJob]) -> None:
+        for job in jobs:
+            self.submit(job)
+
+    def _write_all(self, rendered: Iterable[RenderedReport]) -> None:
+        for item in rendered:
+            if item.data is None:
+                self.summary.add_error(item.member, item.error)
+            else:
+                self.summary.bytes += self._sink.write_member(item.member, lambda out, data=item.data: out.write(data))
+                self.summary.written += 1
+            if self._progress is not None and (self.summary.written + self.summary.failed) % self._every == 0:
+                self._progress(self._snapshot())
+
+    def _snapshot(self) -> ExportSummary:
+        self.summary.seconds = time.perf_counter() - self._t0
+        self.summary.peak_rss_kib = peak_rss_kib()
+        return self.summary
+
+    def close(self) -> ExportSummary:
+        try:
+            self._write_all(self._renderer.finish())
+        finally:
+            self._renderer.close()
+            self._sink.close()
+        self._snapshot()
+        if self._progress is not None:
+            self._progress(self.summary)
+        return self.summary
+
+    def __enter__(self) -> "ParallelReportWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def render_parallel(
+    jobs: Iterable[ReportJob],
+    zip_path: str,
+    workers: Optional[int] = None,
+    chunksize: int = 64,
+    ordered: bool = True,
+) -> ExportSummary:
+    writer = ParallelReportWriter(zip_path, workers=workers, chunksize=chunksize, ordered=ordered)
+    with writer:
+        writer.submit_many(jobs)
+    return writer.summary
+
+
+def stream_reports(
+    jobs: Iterable[ReportJob],
+    target: str,
+    progress: Optional[ProgressCallback] = None,
+    progress_every: int = 1000,
+    trace_memory: bool = False,
+) -> ExportSummary:
+    writer = StreamingReportWriter(target, progress, progress_every, trace_memory)
+    with writer:
+        writer.submit_many(jobs)
+    return writer.summary
+
+
+def iter_rendered(
+    jobs: Iterable[ReportJob],
+    workers: Optional[int] = None,
+    chunksize: int = 64,
+    ordered: bool = True,
+) -> Iterator[RenderedReport]:
+    # Потоковая выдача готовых протоколов без записи в архив
+    with ReportRenderer(workers, chunksize, ordered) as renderer:
+        for job in jobs:
+            yield from renderer.submit(job)
+        yield from renderer.finish()
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from bench import _percentile, random_questionnaires
+
+
+# Нагрузочный тест сервиса расчёта (service.py) на localhost:
+# connections соединений keep-alive шлют одиночные POST /v1/score подряд,
+# замеряется время ответа каждого запроса.
+
+
+async def _client(host: str, port: int, bodies: Sequence[bytes], deadline: float,
+                  latencies: List[float], errors: List[int], offset: int) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    i = offset
+    try:
+        while time.perf_counter() < deadline:
+            body = bodies[i % len(bodies)]
+            i += 1
+            request = (
+                f"POST /v1/score HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            ).encode("latin-1") + body
+            t0 = time.perf_counter()
+            writer.write(request)
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            await reader.readexactly(length)
+            latencies.append((time.perf_counter() - t0) * 1e6)
+            if not head.startswith(b"HTTP/1.1 200"):
+                errors.append(1)
+    finally:
+        writer.close()
+
+
+async def _run(host: str, port: int, connections: int, duration: float, seed: int) -> Dict[str, Any]:
+    rows = random_questionnaires(1000, seed)
+    bodies = [
+        json.dumps({"scale": "FUSS" if i % 2 else "AUSS", "ctx": ctx}, ensure_ascii=False).encode("utf-8")
+        for i, ctx in enumerate(rows)
+    ]
+    latencies: List[float] = []
+    errors: List[int] = []
+    t0 = time.perf_counter()
+    deadline = t0 + duration
+    await asyncio.gather(*(
+        _client(host, port, bodies, deadline, latencies, errors, k * 97) for k in range(connections)
+    ))
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "connections": connections,
+        "duration_s": elapsed,
+        "requests_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": _percentile(latencies, 0.5) / 1000,
+        "p95_ms": _percentile(latencies, 0.95) / 1000,
+        "p99_ms": _percentile(latencies, 0.99) / 1000,
+        "max_ms": (latencies[-1] / 1000) if latencies else 0.0,
+    }
+
+
+def run_load(host: str = "127.0.0.1", port: int = 8765, connections: int = 16, duration: float = 5.0,
+             seed: int = 0) -> Dict[str, Any]:
+    return asyncio.run(_run(host, port, connections, duration, seed))
+
+
+def spawn_server(port: int, max_batch: int = 256, max_delay_ms: float = 0.0) -> subprocess.Popen:
+    # Сервис в отдельном процессе (как в реальной интеграции); ждём, пока откроется порт
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "aussfuss", "serve", "--port", str(port),
+         "--max-batch", str(max_batch), "--max-delay-ms", str(max_delay_ms)],
+        env=env,
+    )
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            asyncio.run(_probe(port))
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.terminate()
+    raise RuntimeError("Сервис не запустился за 10 секунд")
+
+
+async def _probe(port: int) -> None:
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.close()
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    return (
+        f"Запросов: {report['requests']} за {report['duration_s']:.1f} с "
+        f"({report['requests_per_s']:,.0f}/с, соединений: {report['connections']}), ошибок: {report['errors']}\n"
+        f"Задержка: p50 {report['p50_ms']:.2f} мс, p95 {report['p95_ms']:.2f} мс, "
+        f"p99 {report['p99_ms']:.2f} мс, max {report['max_ms']:.2f} мс"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from aussfuss import main as cli
+
+    return cli(["loadtest"] + list(sys.argv[1:] if argv is None else argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,463 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import os
+import re
+import sqlite3
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from cache import ScoringCache
+from docx_template import default_template
+from records import CompactResult
+from scoring import (
+    SEVERITY_LEVELS,
+    ScoreResult,
+    canonical_codes,
+    debridement_inputs,
+    get_scale,
+    report_blocks_local,
+    report_filename_local,
+    scale_context,
+)
+from timeline import Timestamp, _add_version_column, _timestamp
+
+
+# Локальная редакция: картотека пациентов, визитов и протоколов в одном файле
+# SQLite, где всё, что указывает на пациента, зашифровано (AES-256-GCM,
+# пакет cryptography). Ключ выводится из пароля (scrypt, соль в таблице meta).
+#
+# Зашифрованы: ID и ФИО пациента, коды анкеты визита и входы выбора
+# кросслинкинга, DOCX протоколов. Открыто: время визита, шкала, сумма баллов
+# и тяжесть — без зашифрованных данных они не указывают на пациента.
+#
+# Поиск без расшифровки всей базы — по «слепым» индексам: HMAC-SHA256 (свой
+# ключ, выведенный из того же пароля) от нормализованного ID и от префиксов
+# слов ФИО (до NAME_PREFIX символов). Индекс раскрывает только совпадения
+# значений между записями, но не сами значения. Диапазон дат — обычный индекс.
+#
+# Протоколы хранятся по содержимому: ключ — HMAC блоков отчёта, которые
+# однозначно задаются пациентом, шкалой и кодами анкеты. Повторный визит с той
+# же анкетой ссылается на уже сохранённый протокол, сборка не повторяется.
+
+STORE_FORMAT = 1
+NAME_PREFIX = 12
+SCRYPT = {"n": 2 ** 15, "r": 8, "p": 1}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS patients (
+    id INTEGER PRIMARY KEY,
+    id_tag BLOB NOT NULL UNIQUE,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS name_tokens (
+    tag BLOB NOT NULL,
+    patient INTEGER NOT NULL,
+    PRIMARY KEY (tag, patient)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS protocols (
+    id INTEGER PRIMARY KEY,
+    digest BLOB NOT NULL UNIQUE,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS visits (
+    id INTEGER PRIMARY KEY,
+    patient INTEGER NOT NULL REFERENCES patients (id),
+    visited_at REAL NOT NULL,
+    scale TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    critical INTEGER NOT NULL,
+    severity INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    protocol INTEGER REFERENCES protocols (id),
+    version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS visits_patient_time ON visits (patient, visited_at);
+CREATE INDEX IF NOT EXISTS visits_time ON visits (visited_at);
+"""
+
+_VISIT_COLUMNS = "v.id, v.patient, p.data, v.visited_at, v.scale, v.score, v.critical, v.severity, v.data, v.protocol, v.version"
+_WORD = re.compile(r"\w+")
+
+
+@dataclass(frozen=True)
+class Patient:
+    id: int
+    patient_id: str
+    name: str
+
+
+@dataclass(frozen=True)
+class StoredVisit:
+    id: int
+    patient: Patient
+    visited_at: float  # секунды UNIX (UTC)
+    scale: str
+    score: int
+    critical: bool
+    severity: str
+    codes: bytes
+    inputs: Tuple[Any, ...]  # входы выбора кросслинкинга (debridement_inputs)
+    protocol: Optional[int]
+    version: str  # версия правил шкалы
+
+    @property
+    def visited(self) -> datetime:
+        return datetime.fromtimestamp(self.visited_at, tz=timezone.utc)
+
+    def result(self) -> ScoreResult:
+        return CompactResult(self.scale, self.codes, self.score, self.critical, self.version).to_score_result()
+
+
+def _normalize(text: str) -> str:
+    return " ".join(str(text).casefold().replace("ё", "е").split())
+
+
+def _name_prefixes(name: str) -> Set[str]:
+    return {word[:n] for word in _WORD.findall(_normalize(name)) for n in range(1, min(len(word), NAME_PREFIX) + 1)}
+
+
+def _visit_time(value: Any) -> Timestamp:
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return str(value)
+
+
+def _aead(key: bytes) -> Any:
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError as e:  # pragma: no cover - зависит от окружения
+        raise RuntimeError("Для локальной картотеки нужен пакет cryptography") from e
+    return AESGCM(key)
+
+
+class LocalStore:
+    def __init__(self, path: str, passphrase: str, cache: Optional[ScoringCache] = None):
+        self.path = path
+        self.cache = cache or ScoringCache()
+        self._db = sqlite3.connect(path)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(_SCHEMA)
+        _add_version_column(self._db)
+        meta = dict(self._db.execute("SELECT key, value FROM meta"))
+        if not meta:
+            meta = {"format": str(STORE_FORMAT).encode(), "salt": os.urandom(16),
+                    "kdf": json.dumps(SCRYPT).encode()}
+        elif int(meta["format"]) != STORE_FORMAT:
+            raise ValueError(f"Неподдерживаемый формат картотеки: {meta['format'].decode()}")
+        kdf = json.loads(meta["kdf"])
+        key = hashlib.scrypt(passphrase.encode("utf-8"), salt=meta["salt"], dklen=64, maxmem=2 ** 27, **kdf)
+        self._aes = _aead(key[:32])
+        self._tag_key = key[32:]
+        if "check" in meta:
+            try:
+                self._decrypt(meta["check"], b"check")
+            except Exception:
+                self._db.close()
+                raise ValueError("Неверный пароль картотеки") from None
+        else:
+            meta["check"] = self._encrypt(b"aussfuss", b"check")
+            with self._db:
+                self._db.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", meta.items())
+        self._patients: Dict[int, Patient] = {}
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "LocalStore":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM visits").fetchone()[0]
+
+    # --- шифрование ---------------------------------------------------------------
+
+    def _encrypt(self, data: bytes, aad: bytes) -> bytes:
+        nonce = os.urandom(12)
+        return nonce + self._aes.encrypt(nonce, data, aad)
+
+    def _decrypt(self, blob: bytes, aad: bytes) -> bytes:
+        return self._aes.decrypt(blob[:12], blob[12:], aad)
+
+    def _tag(self, kind: str, value: str) -> bytes:
+        return hmac.new(self._tag_key, f"{kind}\x00{value}".encode("utf-8"), hashlib.sha256).digest()[:16]
+
+    # --- запись -------------------------------------------------------------------
+
+    @contextmanager
+    def _write(self) -> Iterator[None]:
+        # При откате транзакции номера строк пациентов в кэше могут стать чужими
+        try:
+            with self._db:
+                yield
+        except BaseException:
+            self._patients.clear()
+            raise
+
+    def add_patient(self, patient_id: str, name: str = "") -> Patient:
+        with self._write():
+            return self._patient(str(patient_id), str(name), {})
+
+    def add_visit(self, patient_id: str, name: str, scale: str, ctx: Dict[str, Any], visited_at: Timestamp = None,
+                  breakdown: bool = False) -> StoredVisit:
+        with self._write():
+            visit_id = self._add(str(patient_id), str(name), scale, ctx, _timestamp(visited_at), breakdown, {})
+        return self.get_visit(visit_id)
+
+    def add_visits(self, visits: Iterable[Tuple[str, str, str, Dict[str, Any], Timestamp]], breakdown: bool = False) -> int:
+        # Одна транзакция на всю пачку: (ID пациента, ФИО, шкала, анкета, время визита)
+        count = 0
+        known: Dict[bytes, Patient] = {}
+        with self._write():
+            for patient_id, name, scale, ctx, visited_at in visits:
+                self._add(str(patient_id), str(name), scale, ctx, _timestamp(visited_at), breakdown, known)
+                count += 1
+        return count
+
+    def import_rows(self, rows: Iterable[Dict[str, Any]], scale: str = "row", breakdown: bool = False,
+                    max_errors: int = 1000) -> Tuple[int, List[Tuple[int, str]]]:
+        # Строки выгрузки (как для batch) с patient_id, patient_name и, по желанию,
+        # visited_at (ISO или секунды UNIX). Одна транзакция; строки с ошибками
+        # пропускаются -> (добавлено визитов, [(номер строки, ошибка)])
+        from pipeline import coerce_row, row_scales
+        from schema import error_text
+
+        added = 0
+        errors: List[Tuple[int, str]] = []
+        known: Dict[bytes, Patient] = {}
+        with self._write():
+            for index, raw in enumerate(rows, start=1):
+                try:
+                    ctx = coerce_row(raw)
+                    ts = _timestamp(_visit_time(raw.get("visited_at")))
+                    for name in row_scales(ctx, scale):
+                        self._add(str(raw.get("patient_id") or ""), str(raw.get("patient_name") or ""),
+                                  name, ctx, ts, breakdown, known)
+                        added += 1
+                except (KeyError, TypeError, ValueError) as e:
+                    if len(errors) < max_errors:
+                        errors.append((index, error_text(e)))
+        return added, errors
+
+    def _patient(self, patient_id: str, name: str, known: Dict[bytes, Patient]) -> Patient:
+        pid = _normalize(patient_id)
+        if not pid:
+            raise ValueError("Не указан ID/№карты пациента")
+        id_tag = self._tag("id", pid)
+        patient = known.get(id_tag)
+        if patient is None:
+            row = self._db.execute("SELECT id, data FROM patients WHERE id_tag = ?", (id_tag,)).fetchone()
+            if row is not None:
+                patient = self._patient_row(row[0], row[1])
+        if patient is not None and (not name or patient.name == name):
+            known[id_tag] = patient
+            return patient
+        data = self._encrypt(json.dumps([patient_id, name], ensure_ascii=False).encode("utf-8"), b"patient")
+        if patient is None:
+            rowid = self._db.execute("INSERT INTO patients (id_tag, data) VALUES (?, ?)", (id_tag, data)).lastrowid
+        else:
+            rowid = patient.id
+            self._db.execute("UPDATE patients SET data = ? WHERE id = ?", (data, rowid))
+            self._db.execute("DELETE FROM name_tokens WHERE patient = ?", (rowid,))
+        self._db.executemany(
+            "INSERT INTO name_tokens (tag, patient) VALUES (?, ?)",
+            ((self._tag("name", p), rowid) for p in _name_prefixes(name)),
+        )
+        patient = self._patients[rowid] = known[id_tag] = Patient(rowid, patient_id, name)
+        return patient
+
+    def _add(self, patient_id: str, name: str, scale: str, ctx: Dict[str, Any], ts: float, breakdown: bool,
+             known: Dict[bytes, Patient]) -> int:
+        compiled = get_scale(scale)
+        patient = self._patient(patient_id, name, known)
+        ctx = scale_context(ctx, compiled.name)
+        codes, inputs = canonical_codes(compiled.name, ctx), debridement_inputs(ctx)
+        res, sev, rec = self.cache.evaluate_codes(compiled.name, codes, inputs, ctx)
+        blocks = report_blocks_local(patient.name, patient.patient_id, compiled.name, res.score, sev, rec,
+                                     res.breakdown if breakdown else None)
+        protocol = self._protocol(blocks)
+        data = self._encrypt(json.dumps([list(codes), list(inputs)], ensure_ascii=False).encode("utf-8"), b"visit")
+        return self._db.execute(
+            "INSERT INTO visits (patient, visited_at, scale, score, critical, severity, data, protocol, version) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (patient.id, ts, compiled.name, res.score, int(res.critical), SEVERITY_LEVELS.index(sev), data, protocol,
+             compiled.version),
+        ).lastrowid
+
+    def _protocol(self, blocks: Sequence[Tuple[Optional[int], str]]) -> int:
+        # Один протокол на одинаковое содержимое. Хранится только сжатый
+        # word/document.xml: остальные части DOCX (стили и т. п.) одинаковы
+        # у всех протоколов и берутся из общей заготовки при выдаче
+        digest = self._tag("protocol", "\x1e".join(f"{level}\x1f{text}" for level, text in blocks))
+        row = self._db.execute("SELECT id FROM protocols WHERE digest = ?", (digest,)).fetchone()
+        if row is not None:
+            return row[0]
+        xml = default_template().document_xml(blocks)
+        return self._db.execute(
+            "INSERT INTO protocols (digest, data, size) VALUES (?, ?, ?)",
+            (digest, self._encrypt(zlib.compress(xml), b"protocol" + digest), len(xml)),
+        ).lastrowid
+
+    def delete_visit(self, visit_id: int) -> None:
+        # Протокол удаляется вместе с последним ссылающимся на него визитом
+        with self._write():
+            row = self._db.execute("SELECT protocol FROM visits WHERE id = ?", (visit_id,)).fetchone()
+            if row is None:
+                raise KeyError(visit_id)
+            self._db.execute("DELETE FROM visits WHERE id = ?", (visit_id,))
+            if row[0] is not None:
+                self._db.execute(
+                    "DELETE FROM protocols WHERE id = ? AND NOT EXISTS (SELECT 1 FROM visits WHERE protocol = ?)",
+                    (row[0], row[0]),
+                )
+
+    # --- чтение -------------------------------------------------------------------
+
+    def _patient_row(self, rowid: int, data: bytes) -> Patient:
+        patient = self._patients.get(rowid)
+        if patient is None:
+            patient_id, name = json.loads(self._decrypt(data, b"patient"))
+            patient = self._patients[rowid] = Patient(rowid, patient_id, name)
+        return patient
+
+    def _visit(self, row: Tuple[Any, ...]) -> StoredVisit:
+        vid, prow, pdata, ts, scale, score, critical, severity, data, protocol, version = row
+        codes, inputs = json.loads(self._decrypt(data, b"visit"))
+        return StoredVisit(vid, self._patient_row(prow, pdata), ts, scale, score, bool(critical),
+                           SEVERITY_LEVELS[severity], bytes(codes), tuple(inputs), protocol, version)
+
+    def get_visit(self, visit_id: int) -> StoredVisit:
+        row = self._db.execute(
+            f"SELECT {_VISIT_COLUMNS} FROM visits v JOIN patients p ON p.id = v.patient WHERE v.id = ?", (visit_id,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(visit_id)
+        return self._visit(row)
+
+    def find_patient(self, patient_id: str) -> Optional[Patient]:
+        row = self._db.execute(
+            "SELECT id, data FROM patients WHERE id_tag = ?", (self._tag("id", _normalize(patient_id)),),
+        ).fetchone()
+        return self._patient_row(*row) if row else None
+
+    def _name_query(self, name: str) -> Tuple[List[str], str, List[bytes], bool]:
+        # -> (слова запроса, подзапрос номеров пациентов, его параметры, хватает ли индекса).
+        # Каждое слово запроса — префикс какого-либо слова ФИО («ив ан» -> «Иванов Анна»).
+        # Префиксы длиннее NAME_PREFIX ищутся по индексу первых символов и
+        # досверяются после расшифровки (_name_matches)
+        words = sorted(set(_WORD.findall(_normalize(name))), key=len, reverse=True)
+        sql = " INTERSECT ".join("SELECT patient FROM name_tokens WHERE tag = ?" for _ in words)
+        tags = [self._tag("name", w[:NAME_PREFIX]) for w in words]
+        return words, sql, tags, all(len(w) <= NAME_PREFIX for w in words)
+
+    @staticmethod
+    def _name_matches(patient: Patient, words: List[str]) -> bool:
+        have = _WORD.findall(_normalize(patient.name))
+        return all(any(h.startswith(w) for h in have) for w in words)
+
+    def search_patients(self, name: str, limit: int = 50) -> List[Patient]:
+        words, sql, tags, exact = self._name_query(name)
+        if not words:
+            return []
+        out: List[Patient] = []
+        rows = self._db.execute(
+            f"SELECT p.id, p.data FROM patients p WHERE p.id IN ({sql}) ORDER BY p.id"
+            + (" LIMIT ?" if exact else ""),
+            tags + ([limit] if exact else []),
+        )
+        for rowid, data in rows:
+            patient = self._patient_row(rowid, data)
+            if not exact and not self._name_matches(patient, words):
+                continue
+            out.append(patient)
+            if len(out) >= limit:
+                break
+        return out
+
+    def visits(self, patient_id: Optional[str] = None, name: Optional[str] = None, since: Timestamp = None,
+               until: Timestamp = None, scale: Optional[str] = None, limit: Optional[int] = 100) -> List[StoredVisit]:
+        # Визиты по ID или префиксу ФИО пациента и/или диапазону дат — новые первыми
+        sql = f"SELECT {_VISIT_COLUMNS} FROM visits v JOIN patients p ON p.id = v.patient WHERE 1"
+        params: List[Any] = []
+        words: List[str] = []
+        exact = True
+        if patient_id is not None:
+            patient = self.find_patient(patient_id)
+            if patient is None:
+                return []
+            sql += " AND v.patient = ?"
+            params.append(patient.id)
+        if name:
+            words, names, tags, exact = self._name_query(name)
+            if not words:
+                return []
+            sql += f" AND v.patient IN ({names})"
+            params.extend(tags)
+        if since is not None:
+            sql += " AND v.visited_at >= ?"
+            params.append(_timestamp(since))
+        if until is not None:
+            sql += " AND v.visited_at <= ?"
+            params.append(_timestamp(until))
+        if scale is not None:
+            sql += " AND v.scale = ?"
+            params.append(get_scale(scale).name)
+        sql += " ORDER BY v.visited_at DESC, v.id DESC"
+        if exact:
+            if limit is not None:
+                sql += " LIMIT ?"
+                params.append(limit)
+            return [self._visit(row) for row in self._db.execute(sql, params)]
+        # Длинные префиксы досверяются после расшифровки ФИО — лимит отсчитывается здесь
+        out: List[StoredVisit] = []
+        for row in self._db.execute(sql, params):
+            if not self._name_matches(self._patient_row(row[1], row[2]), words):
+                continue
+            out.append(self._visit(row))
+            if limit is not None and len(out) >= limit:
+                break
+        return out
+
+    def protocol(self, visit_id: int) -> Tuple[bytes, str]:
+        # -> (DOCX, имя файла)
+        row = self._db.execute(
+            "SELECT v.scale, v.patient, p.data, pr.digest, pr.data FROM visits v JOIN patients p ON p.id = v.patient "
+            "JOIN protocols pr ON pr.id = v.protocol WHERE v.id = ?",
+            (visit_id,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(visit_id)
+        scale, prow, pdata, digest, data = row
+        patient = self._patient_row(prow, pdata)
+        xml = zlib.decompress(self._decrypt(data, b"protocol" + digest))
+        return default_template().render_xml(xml), report_filename_local(patient.name, patient.patient_id, scale)
+
+    def recommendation(self, visit: StoredVisit) -> str:
+        # По сохранённой тяжести: визит мог быть посчитан по прежней версии правил
+        return self.cache.recommend_treatment(visit.scale, visit.severity, visit.score, None, critical=visit.critical,
+                                              inputs=visit.inputs)
+
+    def stats(self) -> Dict[str, int]:
+        patients, visits, with_protocol, protocols, size = self._db.execute(
+            "SELECT (SELECT COUNT(*) FROM patients), (SELECT COUNT(*) FROM visits), "
+            "(SELECT COUNT(*) FROM visits WHERE protocol IS NOT NULL), (SELECT COUNT(*) FROM protocols), "
+            "(SELECT COALESCE(SUM(size), 0) FROM protocols)"
+        ).fetchone()
+        return {"patients": patients, "visits": visits, "protocols": protocols,
+                "protocols_reused": with_protocol - protocols, "protocol_xml_bytes": size}
@@ -0,0 +1,350 @@
+from __future__ import annotations
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import warnings
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+# Замеры по этапам расчёта и формирования протоколов (включаются явно).
+#
+#   AUSSFUSS_METRICS=1               — счётчики и таймеры этапов
+#   AUSSFUSS_METRICS_OUT=путь        — при выходе записать снимок (.json) или Prometheus (.prom/.txt)
+#   AUSSFUSS_PROFILE=cprofile        — профиль cProfile всего процесса
+#   AUSSFUSS_PROFILE=tracemalloc     — крупнейшие места выделения памяти
+#   AUSSFUSS_PROFILE_OUT=путь        — файл профиля (по умолчанию aussfuss.prof / aussfuss-tracemalloc.txt)
+#
+# Включение подменяет функции этапов обёртками с таймером — в модуле-владельце
+# и во всех загруженных модулях, импортировавших их по имени (from scoring import ...).
+# Выключенные замеры ничего не подменяют, поэтому накладных расходов нет.
+# Время этапа включает вложенные этапы (compute_fuss -> compute_scale -> categorize).
+# Пакетный расчёт и приложение идут через кэш и коды вариантов (cache_*, compute_scale,
+# compute_scales_many, schema_decode, canonical_codes, score_encoded), а не через
+# compute_fuss/compute_auss.
+
+STAGES: Dict[str, Tuple[str, str]] = {
+    "categorize": ("scoring", "_lookup"),
+    "compute_scale": ("scoring", "compute_scale"),
+    "compute_fuss": ("scoring", "compute_fuss"),
+    "compute_auss": ("scoring", "compute_auss"),
+    "severity": ("scoring", "severity_from_score"),
+    "recommend_treatment": ("scoring", "recommend_treatment"),
+    "choose_debridement": ("scoring", "choose_debridement"),
+    "canonical_codes": ("scoring", "canonical_codes"),
+    "canonical_codes_many": ("scoring", "canonical_codes_many"),
+    "compute_scales_many": ("scoring", "compute_scales_many"),
+    "score_encoded": ("scoring", "score_encoded"),
+    "schema_decode": ("schema", "Schema.decode"),
+    "schema_scale_codes": ("schema", "Schema.scale_codes"),
+    "cache_evaluate": ("cache", "ScoringCache.evaluate"),
+    "cache_evaluate_scales": ("cache", "ScoringCache.evaluate_scales"),
+    "cache_evaluate_codes": ("cache", "ScoringCache.evaluate_codes"),
+    "report_docx_web": ("scoring", "format_report_docx_web"),
+    "report_docx_local": ("scoring", "format_report_docx_local"),
+    "docx_serialize": ("docx_template", "PreparedDocx.write"),
+}
+
+# Границы гистограммы времени этапа, секунды
+BUCKETS = (1e-6, 5e-6, 2e-5, 1e-4, 5e-4, 2e-3, 1e-2, 5e-2, 0.25, 1.0)
+
+_PREFIX = "aussfuss"
+
+
+class StageStats:
+    __slots__ = ("calls", "errors", "total_ns", "max_ns", "buckets")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, ns: int) -> None:
+        self.calls += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+        seconds = ns / 1e9
+        for i, upper in enumerate(BUCKETS):
+            if seconds <= upper:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_s": self.total_ns / 1e9,
+            "mean_us": (self.total_ns / self.calls / 1e3) if self.calls else 0.0,
+            "max_us": self.max_ns / 1e3,
+        }
+
+
+_stages: Dict[str, StageStats] = {}
+_caches: "weakref.WeakSet[Any]" = weakref.WeakSet()
+_retired: Dict[str, Dict[str, int]] = {}
+_originals: Dict[str, Tuple[Any, str, Callable[..., Any]]] = {}
+_lock = threading.Lock()
+_profiler: Any = None
+# Этапы модулей, которые ещё импортировались при enable (scoring -> metrics -> cache -> scoring)
+_deferred: List[str] = []
+
+
+def enabled() -> bool:
+    return bool(_originals)
+
+
+# --- этапы ------------------------------------------------------------------------
+
+def _timed(stage: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+    stats = _stages.setdefault(stage, StageStats())
+    clock = time.perf_counter_ns
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        t0 = clock()
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            stats.errors += 1
+            raise
+        finally:
+            stats.observe(clock() - t0)
+
+    return wrapper
+
+
+def _resolve(module_name: str, path: str) -> Tuple[Any, str]:
+    __import__(module_name)
+    owner: Any = sys.modules[module_name]
+    *parents, attr = path.split(".")
+    for name in parents:
+        owner = getattr(owner, name)
+    return owner, attr
+
+
+def _rebind(replace: Dict[str, Tuple[Any, Any]]) -> None:
+    # Имена, импортированные из модуля-владельца (from scoring import ...), указывают
+    # на тот же объект; replace — имя -> (старый объект, новый)
+    for module in list(sys.modules.values()):
+        namespace = getattr(module, "__dict__", None)
+        if not namespace or getattr(module, "__name__", None) == __name__:
+            continue
+        for name, (old, new) in replace.items():
+            if namespace.get(name) is old:
+                namespace[name] = new
+
+
+def enable(stages: Optional[List[str]] = None) -> None:
+    with _lock:
+        replace: Dict[str, Tuple[Any, Any]] = {}
+        for stage in stages or list(STAGES):
+            if stage in _originals:
+                continue
+            try:
+                owner, attr = _resolve(*STAGES[stage])
+            except AttributeError:
+                # Модуль загружен не до конца: этап подключит enable_module в его конце
+                if stage not in _deferred:
+                    _deferred.append(stage)
+                continue
+            original = vars(owner)[attr]
+            wrapper = _timed(stage, original)
+            setattr(owner, attr, wrapper)
+            if not isinstance(owner, type):
+                replace[attr] = (original, wrapper)
+            _originals[stage] = (owner, attr, original)
+        if replace:
+            _rebind(replace)
+
+
+def enable_module(module_name: str) -> None:
+    # Вызывается в конце модулей с этапами (cache, schema)
+    stages = [stage for stage in _deferred if STAGES[stage][0] == module_name]
+    if stages:
+        for stage in stages:
+            _deferred.remove(stage)
+        enable(stages)
+
+
+def disable() -> None:
+    with _lock:
+        _deferred.clear()
+        replace: Dict[str, Tuple[Any, Any]] = {}
+        for owner, attr, original in _originals.values():
+            wrapper = vars(owner)[attr]
+            setattr(owner, attr, original)
+            if not isinstance(owner, type):
+                replace[attr] = (wrapper, original)
+        _originals.clear()
+        if replace:
+            _rebind(replace)
+
+
+def reset() -> None:
+    with _lock:
+        for stats in _stages.values():
+            stats.__init__()
+        _retired.clear()
+
+
+def track_cache(cache: Any) -> None:
+    # Кэш расчётов (cache.ScoringCache): живые опрашиваются через stats(),
+    # счётчики удалённых складываются в _retired
+    _caches.add(cache)
+    weakref.finalize(cache, _retire, cache.hits, cache.misses)
+
+
+def _retire(hits: Dict[str, int], misses: Dict[str, int]) -> None:
+    for kind in hits:
+        agg = _retired.setdefault(kind, {"hits": 0, "misses": 0})
+        agg["hits"] += hits[kind]
+        agg["misses"] += misses[kind]
+
+
+# --- выгрузка ---------------------------------------------------------------------
+
+def _cache_totals() -> Dict[str, Dict[str, int]]:
+    totals = {kind: dict(row) for kind, row in _retired.items()}
+    for cache in list(_caches):
+        for kind, row in cache.stats()["by_kind"].items():
+            agg = totals.setdefault(kind, {"hits": 0, "misses": 0})
+            agg["hits"] += row["hits"]
+            agg["misses"] += row["misses"]
+    return totals
+
+
+def snapshot() -> Dict[str, Any]:
+    caches = _cache_totals()
+    hits = sum(row["hits"] for row in caches.values())
+    lookups = hits + sum(row["misses"] for row in caches.values())
+    return {
+        "enabled": enabled(),
+        "time": time.time(),
+        "stages": {name: stats.as_dict() for name, stats in _stages.items() if stats.calls},
+        "cache": {
+            "live": len(_caches),
+            "by_kind": caches,
+            "hit_rate": (hits / lookups) if lookups else 0.0,
+        },
+    }
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(extra: Optional[Dict[str, float]] = None) -> str:
+    # Текстовый формат Prometheus 0.0.4; extra — дополнительные показатели (имя -> значение)
+    lines: List[str] = []
+    name = f"{_PREFIX}_stage_seconds"
+    lines += [f"# HELP {name} Время этапа расчёта/формирования протокола.", f"# TYPE {name} histogram"]
+    for stage, stats in _stages.items():
+        if not stats.calls:
+            continue
+        label = f'stage="{_label(stage)}"'
+        cumulative = 0
+        for upper, n in zip(BUCKETS, stats.buckets):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{label},le="{upper:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{label},le="+Inf"}} {stats.calls}')
+        lines.append(f"{name}_sum{{{label}}} {stats.total_ns / 1e9:.9f}")
+        lines.append(f"{name}_count{{{label}}} {stats.calls}")
+    name = f"{_PREFIX}_stage_errors_total"
+    lines += [f"# HELP {name} Исключения на этапе.", f"# TYPE {name} counter"]
+    lines += [f'{name}{{stage="{_label(s)}"}} {stats.errors}' for s, stats in _stages.items() if stats.calls]
+    caches = _cache_totals()
+    if caches:
+        for outcome in ("hits", "misses"):
+            name = f"{_PREFIX}_cache_{outcome}_total"
+            lines += [f"# HELP {name} Обращения к кэшу расчётов ({outcome}).", f"# TYPE {name} counter"]
+            lines += [f'{name}{{kind="{_label(k)}"}} {row[outcome]}' for k, row in caches.items()]
+    for key, value in sorted((extra or {}).items()):
+        name = f"{_PREFIX}_{key}"
+        lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+def write(path: str) -> None:
+    # .json — снимок snapshot(), иначе текст Prometheus (для node_exporter textfile)
+    if path.endswith(".json"):
+        text = json.dumps(snapshot(), ensure_ascii=False, indent=2)
+    else:
+        text = prometheus_text()
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+# --- профилирование ---------------------------------------------------------------
+
+def start_profile(mode: str, path: Optional[str] = None) -> None:
+    global _profiler
+    if _profiler is not None:
+        return
+    if mode == "cprofile":
+        import cProfile
+
+        _profiler = ("cprofile", cProfile.Profile(), path or "aussfuss.prof")
+        _profiler[1].enable()
+    elif mode == "tracemalloc":
+        import tracemalloc
+
+        tracemalloc.start(25)
+        _profiler = ("tracemalloc", None, path or "aussfuss-tracemalloc.txt")
+    else:
+        raise ValueError(f"Неизвестный режим профилирования: {mode!r} (cprofile или tracemalloc)")
+
+
+def stop_profile() -> Optional[str]:
+    # -> путь к записанному профилю
+    global _profiler
+    if _profiler is None:
+        return None
+    mode, profiler, path = _profiler
+    _profiler = None
+    if mode == "cprofile":
+        profiler.disable()
+        profiler.dump_stats(path)
+        return path
+    import tracemalloc
+
+    snap = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n")
+        for stat in snap.statistics("traceback")[:30]:
+            f.write(f"\n{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+            f.write("\n".join(stat.traceback.format(limit=8)) + "\n")
+    return path
+
+
+def _at_exit() -> None:
+    stop_profile()
+    out = os.environ.get("AUSSFUSS_METRICS_OUT")
+    if out and enabled():
+        write(out)
+
+
+def enable_from_env() -> None:
+    if os.environ.get("AUSSFUSS_METRICS", "").lower() not in ("", "0", "false", "no"):
+        enable()
+    mode = os.environ.get("AUSSFUSS_PROFILE", "").lower()
+    if mode:
+        # Опечатка в переменной окружения не должна ломать импорт scoring
+        try:
+            start_profile(mode, os.environ.get("AUSSFUSS_PROFILE_OUT"))
+        except ValueError as e:
+            warnings.warn(f"AUSSFUSS_PROFILE: {e}; профилирование отключено", RuntimeWarning, stacklevel=2)
+    if enabled() or _profiler is not None:
+        atexit.register(_at_exit)
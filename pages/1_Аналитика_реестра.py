@@ -0,0 +1,79 @@
+import os
+from pathlib import Path
+
+import streamlit as st
+from analytics import Aggregates
+from scoring import SEVERITY_LEVELS
+
+st.set_page_config(page_title="AUSS/FUSS — аналитика", layout="wide")
+
+# Сводка реестра визитов (timeline.Timeline): читается только таблица aggregates,
+# которая обновляется при каждом расчёте, — визиты не перебираются
+DEFAULT_REGISTRY = os.environ.get("AUSSFUSS_REGISTRY", str(Path(__file__).parent.parent / "registry.db"))
+
+
+@st.cache_data(ttl=10, show_spinner=False)
+def _aggregates(path: str, mtime: float) -> Aggregates:
+    from timeline import Timeline
+
+    with Timeline(path) as tl:
+        return tl.aggregates()
+
+
+st.markdown("## Аналитика реестра")
+path = st.text_input("Файл реестра (SQLite)", value=DEFAULT_REGISTRY)
+if not os.path.exists(path):
+    st.info("Реестр не найден. Визиты добавляются при расчёте, если задан AUSSFUSS_REGISTRY, "
+            "или командой `aussfuss batch --registry`.")
+    st.stop()
+
+# Записи в режиме WAL сначала попадают в файл -wal
+mtime = max(os.path.getmtime(p) for p in (path, path + "-wal") if os.path.exists(p))
+agg = _aggregates(path, mtime)
+if not agg.visits:
+    st.info("В реестре пока нет визитов.")
+    st.stop()
+
+c1, c2, c3, c4 = st.columns(4)
+c1.metric("Визитов", f"{agg.visits:,}".replace(",", " "))
+c2.metric("Оценено по обеим шкалам", f"{agg.pairs:,}".replace(",", " "))
+c3.metric("Совпадение тяжести FUSS/AUSS", f"{agg.agreement_rate():.0%}" if agg.pairs else "—")
+c4.metric("Каппа (квадр. веса)", f"{agg.kappa(weighted=True):.2f}" if agg.pairs else "—")
+
+scales = [name for name, s in agg.scales.items() if s.visits]
+for tab, name in zip(st.tabs(scales), scales):
+    s = agg[name]
+    with tab:
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Визитов", f"{s.visits:,}".replace(",", " "))
+        c2.metric("Средняя сумма баллов", f"{s.mean_score:.1f}")
+        c3.metric("Критические признаки", f"{s.critical / s.visits:.1%}")
+
+        left, right = st.columns(2)
+        with left:
+            st.markdown("#### Степень тяжести")
+            st.bar_chart([{"Тяжесть": level, "Визитов": n} for level, n in s.severity_counts.items()],
+                         x="Тяжесть", y="Визитов", sort=False)
+        with right:
+            st.markdown("#### Сумма баллов")
+            st.bar_chart([{"Баллы": score, "Визитов": n} for score, n in s.score_histogram.items()],
+                         x="Баллы", y="Визитов")
+
+        st.markdown("#### Вклад критериев")
+        sums = s.criterion_sums()
+        rows = sorted(
+            ({"Критерий": label, "Средний балл": mean, "Доля суммы": (sums[label] / max(1, sum(sums.values())))}
+             for label, mean in s.criterion_means().items()),
+            key=lambda row: -row["Средний балл"],
+        )
+        st.dataframe(rows, hide_index=True, column_config={
+            "Средний балл": st.column_config.NumberColumn(format="%.2f"),
+            "Доля суммы": st.column_config.ProgressColumn(format="percent", min_value=0.0, max_value=1.0),
+        })
+
+if agg.pairs:
+    st.markdown("#### Совпадение тяжести FUSS (строки) и AUSS (столбцы)")
+    st.dataframe(
+        [{"FUSS": level, **dict(zip(SEVERITY_LEVELS, row))} for level, row in zip(SEVERITY_LEVELS, agg.agreement)],
+        hide_index=True,
+    )
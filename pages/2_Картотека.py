@@ -0,0 +1,64 @@
+import os
+from datetime import date, datetime, time, timezone
+
+import streamlit as st
+from local_store import LocalStore
+
+st.set_page_config(page_title="AUSS/FUSS — картотека", layout="wide")
+
+# Поиск по локальной зашифрованной картотеке (local_store.LocalStore):
+# по ID, началу ФИО и диапазону дат визитов; протокол выдаётся из картотеки
+LOCAL_STORE = os.environ.get("AUSSFUSS_LOCAL_STORE")
+
+st.markdown("## Картотека пациентов")
+if not LOCAL_STORE:
+    st.info("Картотека доступна в локальной версии: укажите файл в переменной окружения AUSSFUSS_LOCAL_STORE.")
+    st.stop()
+if not os.path.exists(LOCAL_STORE):
+    st.info("Картотека пока пуста: визиты сохраняются кнопкой «Сохранить в картотеку» после расчёта.")
+    st.stop()
+
+passphrase = st.text_input("Пароль картотеки", type="password", key="store_key")
+if not passphrase:
+    st.stop()
+
+c1, c2, c3, c4 = st.columns(4)
+patient_id = c1.text_input("ID/№карты")
+name = c2.text_input("ФИО (начало слов)")
+since = c3.date_input("С даты", value=None)
+until = c4.date_input("По дату", value=None)
+
+
+def _day(d: date | None, end: bool) -> datetime | None:
+    if d is None:
+        return None
+    return datetime.combine(d, time.max if end else time.min, tzinfo=timezone.utc)
+
+
+try:
+    store = LocalStore(LOCAL_STORE, passphrase)
+except (ValueError, RuntimeError) as e:
+    # Неверный пароль или не установлен пакет cryptography
+    st.error(str(e))
+    st.stop()
+
+with store:
+    visits = store.visits(patient_id=patient_id or None, name=name or None,
+                          since=_day(since, False), until=_day(until, True), limit=200)
+    if not visits:
+        st.info("Визиты не найдены.")
+        st.stop()
+    st.dataframe(
+        [
+            {"№": v.id, "Дата": v.visited.strftime("%d.%m.%Y %H:%M"), "ID/№карты": v.patient.patient_id,
+             "Пациент": v.patient.name, "Шкала": v.scale, "Баллы": v.score, "Степень тяжести": v.severity}
+            for v in visits
+        ],
+        hide_index=True,
+    )
+    titles = {v.id: f"№{v.id} — {v.patient.name} ({v.scale})" for v in visits}
+    chosen = st.selectbox("Протокол визита", list(titles), format_func=titles.get)
+    data, filename = store.protocol(chosen)
+
+st.download_button("Скачать протокол (DOCX)", data=data, file_name=filename,
+                   mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
@@ -0,0 +1,438 @@
+from __future__ import annotations
+
+import csv
+import json
+import os
+import sys
+import uuid
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, TextIO, Tuple, Union
+
+from cache import ScoringCache
+from schema import SchemaError, error_text, get_schema, validate
+from scoring import CRITERIA, SCALES, ScoreResult, _cat_size_mm, report_filename_local, scale_context
+
+if TYPE_CHECKING:
+    from audit import AuditLog
+    from export import ExportSummary, ParallelReportWriter, StreamingReportWriter
+    from score_table import ScoreTable
+    from timeline import Timeline
+
+
+# Пакетная обработка выгрузок: строки CSV/JSONL/Parquet -> расчёт FUSS/AUSS ->
+# файл результатов (+ zip или каталог с DOCX-протоколами). Строки читаются и пишутся
+# потоково, в памяти держится только текущая строка и кэш расчётов.
+#
+# Поля строки совпадают с base/ctx_f/ctx_a в app.py. Дополнительно:
+#   scale                         — FUSS / AUSS / both (при --scale row)
+#   size_mm                       — размер в мм, если нет size_cat
+#   progress_speed_f / _a         — скорость прогрессирования отдельно для FUSS/AUSS
+#   patient_id / patient_name     — для имени и шапки протокола
+#
+# Строка разбирается скомпилированной схемой анкеты (schema) сразу в коды
+# вариантов; strict=True сначала проверяет весь файл (schema.validate).
+# С audit каждый расчёт записывается в журнал аудита (audit.AuditLog, ссылка — номер строки).
+# С registry каждый расчёт добавляется визитом в реестр (timeline.Timeline):
+#   visited_at                    — время визита (ISO 8601; без него — время расчёта)
+
+RESULT_FIELDS = ("row", "patient_id", "patient_name", "scale", "score", "critical", "severity", "recommendation", "error")
+
+_SCALE_ALIASES = {
+    "fuss": ("FUSS",),
+    "auss": ("AUSS",),
+    "both": ("FUSS", "AUSS"),
+    "": ("FUSS", "AUSS"),
+}
+# Отдельные поля шкал в общей анкете (progress_speed_f -> progress_speed)
+_PER_SCALE = {name: key for spec in SCALES.values() for key, name in spec.fields.items()}
+_MAX_ERROR_ROWS = 1000
+_REGISTRY_BATCH = 1000
+
+
+@dataclass
+class BatchSummary:
+    rows: int = 0
+    results: int = 0
+    errors: int = 0
+    reports: int = 0
+    report_errors: int = 0
+    report_bytes: int = 0
+    report_peak_rss_kib: int = 0
+    cohort_bytes: int = 0
+    registry_visits: int = 0
+    registry_errors: int = 0
+    error_rows: List[int] = field(default_factory=list)
+
+    def add_error(self, index: int) -> None:
+        self.errors += 1
+        # Номера строк храним выборочно, чтобы память не росла с размером выгрузки
+        if len(self.error_rows) < _MAX_ERROR_ROWS and (not self.error_rows or self.error_rows[-1] != index):
+            self.error_rows.append(index)
+
+
+# --- чтение ---------------------------------------------------------------------
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".jsonl", ".ndjson", ".json"):
+        return "jsonl"
+    if ext in (".parquet", ".pq"):
+        return "parquet"
+    return "csv"
+
+
+def _open_text(path: str) -> TextIO:
+    if path == "-":
+        return sys.stdin
+    # utf-8-sig: выгрузки из Excel часто начинаются с BOM
+    return open(path, "r", encoding="utf-8-sig", newline="")
+
+
+def read_csv(path: str, delimiter: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    f = _open_text(path)
+    try:
+        if delimiter is None:
+            head = f.readline()
+            try:
+                delimiter = csv.Sniffer().sniff(head, delimiters=",;\t").delimiter
+            except csv.Error:
+                delimiter = ","
+            lines: Any = _chain_first(head, f)
+        else:
+            lines = f
+        for row in csv.DictReader(lines, delimiter=delimiter):
+            yield row
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _chain_first(first: str, rest: TextIO) -> Iterator[str]:
+    yield first
+    yield from rest
+
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    f = _open_text(path)
+    try:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def read_parquet(path: str, batch_size: int = 4096) -> Iterator[Dict[str, Any]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:  # pragma: no cover - зависит от окружения
+        raise RuntimeError("Для чтения Parquet нужен пакет pyarrow") from e
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def read_rows(path: str, fmt: Optional[str] = None, delimiter: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    fmt = fmt or detect_format(path)
+    if fmt == "csv":
+        return read_csv(path, delimiter)
+    if fmt == "jsonl":
+        return read_jsonl(path)
+    if fmt == "parquet":
+        return read_parquet(path)
+    raise ValueError(f"Неизвестный формат входного файла: {fmt}")
+
+
+# --- приведение типов -------------------------------------------------------------
+
+def _coerce(key: str, value: Any) -> Any:
+    crit = CRITERIA[key]
+    if crit.categorize is not None:
+        # Толщины ОКТ — числа
+        if isinstance(value, str):
+            value = value.strip().replace(",", ".")
+            return int(value) if value.lstrip("-").isdigit() else float(value)
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        for opt in crit.options:
+            if str(opt) == value:
+                return opt
+    return value
+
+
+def coerce_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    # Пустые ячейки считаются отсутствующими (используется значение по умолчанию)
+    ctx: Dict[str, Any] = {}
+    for key, value in row.items():
+        if value is None or value == "":
+            continue
+        if key in CRITERIA:
+            ctx[key] = _coerce(key, value)
+        elif key in _PER_SCALE:
+            ctx[key] = _coerce(_PER_SCALE[key], value)
+        elif key == "size_mm":
+            ctx[key] = float(str(value).replace(",", ".")) if isinstance(value, str) else value
+        else:
+            ctx[key] = value
+    if "size_cat" not in ctx and "size_mm" in ctx:
+        ctx["size_cat"] = _cat_size_mm(float(ctx["size_mm"]))
+    return ctx
+
+
+def row_scales(row: Dict[str, Any], mode: str) -> Tuple[str, ...]:
+    if mode == "row":
+        value = str(row.get("scale") or "").strip()
+        if value in SCALES:
+            return (value,)
+        try:
+            return _SCALE_ALIASES[value.lower()]
+        except KeyError:
+            raise ValueError(f"Неизвестная шкала: {value!r}") from None
+    return _SCALE_ALIASES[mode.lower()] if mode.lower() in _SCALE_ALIASES else (mode,)
+
+
+# --- запись ------------------------------------------------------------------------
+
+class ResultWriter:
+    def __init__(self, path: str, fmt: Optional[str] = None, breakdown: bool = False):
+        self.fmt = fmt or ("jsonl" if detect_format(path) == "jsonl" else "csv")
+        self.breakdown = breakdown
+        self._f = sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")
+        self._csv = None
+        if self.fmt == "csv":
+            fields = RESULT_FIELDS + (("breakdown",) if breakdown else ())
+            self._csv = csv.DictWriter(self._f, fieldnames=fields)
+            self._csv.writeheader()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        if self._csv is not None:
+            if "breakdown" in record:
+                record = dict(record, breakdown=json.dumps(record["breakdown"], ensure_ascii=False))
+            self._csv.writerow(record)
+        else:
+            self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        if self._f is not sys.stdout:
+            self._f.close()
+
+    def __enter__(self) -> "ResultWriter":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def result_record(index: int, row: Dict[str, Any], scale: str, res: Optional[ScoreResult], sev: str, rec: str,
+                  error: str = "", breakdown: bool = False) -> Dict[str, Any]:
+    record: Dict[str, Any] = {
+        "row": index,
+        "patient_id": row.get("patient_id", "") or "",
+        "patient_name": row.get("patient_name", "") or "",
+        "scale": scale,
+        "score": res.score if res else "",
+        "critical": res.critical if res else "",
+        "severity": sev,
+        "recommendation": rec,
+        "error": error,
+    }
+    if breakdown:
+        record["breakdown"] = res.breakdown if res else {}
+    return record
+
+
+def report_member(index: int, filename: str) -> str:
+    # Номер строки в имени — протоколы одного пациента не перезаписывают друг друга
+    return f"{index:06d}_{filename}"
+
+
+# --- конвейер ------------------------------------------------------------------------
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    scale: str = "row",
+    reports_path: Optional[str] = None,
+    breakdown: bool = False,
+    input_format: Optional[str] = None,
+    delimiter: Optional[str] = None,
+    cache: Optional[ScoringCache] = None,
+    workers: int = 1,
+    ordered: bool = True,
+    table: Optional["ScoreTable"] = None,
+    progress: Optional[Callable[["ExportSummary"], None]] = None,
+    strict: bool = False,
+    cohort_path: Optional[str] = None,
+    audit: Optional["AuditLog"] = None,
+    registry: Optional["Timeline"] = None,
+) -> BatchSummary:
+    if cache is None:
+        cache = ScoringCache()
+    if strict:
+        # Сначала проверяется вся выгрузка: при ошибках расчёт не начинается
+        if input_path == "-":
+            raise ValueError("Проверка перед расчётом невозможна при чтении из stdin")
+        rows, errors = validate(read_rows(input_path, input_format, delimiter), scale)
+        if errors:
+            raise SchemaError(errors, rows)
+    # Предрасчитанная таблица исходов заменяет кэш: результат тот же
+    evaluate = table.evaluate if table is not None else cache.evaluate
+    # Без таблицы строка сразу переводится в коды по схеме анкеты (schema)
+    schema = get_schema() if table is None else None
+    summary = BatchSummary()
+    reports: Union["ParallelReportWriter", "StreamingReportWriter", None] = None
+    if reports_path:
+        # Пул процессов и сборка DOCX нужны только при выгрузке протоколов
+        from export import ParallelReportWriter, ReportJob, StreamingReportWriter
+
+        if workers != 1:
+            reports = ParallelReportWriter(reports_path, workers=workers, ordered=ordered, progress=progress)
+        else:
+            # Один процесс: протоколы пишутся прямо в архив или каталог
+            reports = StreamingReportWriter(reports_path, progress=progress)
+    cohort = None
+    if cohort_path:
+        # Сводный протокол — один документ на всю выгрузку (cohort_report)
+        from cohort_report import CohortReportWriter
+
+        cohort = CohortReportWriter(cohort_path)
+    visits: Optional[_RegistryVisits] = _RegistryVisits(registry, summary) if registry is not None else None
+    try:
+        with ResultWriter(output_path, breakdown=breakdown) as writer:
+            for index, raw in enumerate(read_rows(input_path, input_format, delimiter), start=1):
+                summary.rows += 1
+                try:
+                    if schema is not None:
+                        decoded = schema.decode(raw)
+                        if decoded.row_errors:
+                            # Как FieldError: с именем столбца, значение которого не число
+                            key, _, e = decoded.row_errors[0]
+                            raise ValueError(f"{key}: {error_text(e)}") from e
+                        scales = row_scales(raw, scale)
+                    else:
+                        ctx = coerce_row(raw)
+                        scales = row_scales(ctx, scale)
+                except (KeyError, TypeError, ValueError) as e:
+                    writer.write(result_record(index, raw, "", None, "", "", error=error_text(e), breakdown=breakdown))
+                    summary.add_error(index)
+                    continue
+                if schema is not None:
+                    outcomes = _evaluate_decoded(cache, schema, decoded, scales, audit, index)
+                else:
+                    outcomes = [_evaluate(evaluate, name, ctx) for name in scales]
+                for name, outcome in zip(scales, outcomes):
+                    if isinstance(outcome, Exception):
+                        writer.write(result_record(index, raw, name, None, "", "", error=error_text(outcome), breakdown=breakdown))
+                        summary.add_error(index)
+                        continue
+                    res, sev, rec = outcome
+                    if audit is not None and schema is None:
+                        audit.record_context(name, ctx, outcome, source="batch", ref=index)
+                    writer.write(result_record(index, raw, name, res, sev, rec, breakdown=breakdown))
+                    summary.results += 1
+                    if visits is not None:
+                        visits.add(index, raw, name, ctx if schema is None else None)
+                    if reports is None and cohort is None:
+                        continue
+                    patient_name = str(raw.get("patient_name") or "")
+                    patient_id = str(raw.get("patient_id") or "")
+                    if cohort is not None:
+                        try:
+                            cohort.add(patient_name, patient_id, name, res.score, sev, rec,
+                                       breakdown=res.breakdown if breakdown else None)
+                        except ValueError:
+                            # Текст, недопустимый в XML: раздел пропускается, как и отдельный протокол
+                            summary.report_errors += 1
+                    if reports is not None:
+                        reports.submit(ReportJob(
+                            member=report_member(index, report_filename_local(patient_name, patient_id, name)),
+                            patient_name=patient_name,
+                            patient_id=patient_id,
+                            scale=name,
+                            score=res.score,
+                            severity=sev,
+                            recommendation=rec,
+                            breakdown=res.breakdown if breakdown else None,
+                        ))
+        if cohort is not None:
+            summary.cohort_bytes = cohort.close()
+        if visits is not None:
+            visits.flush()
+    finally:
+        if audit is not None:
+            audit.flush()
+        if cohort is not None:
+            cohort.abort()
+        if reports is not None:
+            exported = reports.close()
+            summary.reports = exported.written
+            summary.report_errors += exported.failed
+            summary.report_bytes = exported.bytes
+            summary.report_peak_rss_kib = exported.peak_rss_kib
+    return summary
+
+
+class _RegistryVisits:
+    # Визиты пишутся в реестр пачками: одна транзакция на _REGISTRY_BATCH расчётов
+    def __init__(self, registry: "Timeline", summary: BatchSummary):
+        from timeline import _timestamp
+
+        self.registry = registry
+        self.summary = summary
+        self.timestamp = _timestamp
+        # Строки без patient_id — отдельные пациенты, не связанные с другими запусками
+        self.run = uuid.uuid4().hex[:8]
+        self.pending: List[Tuple[str, str, Dict[str, Any], float]] = []
+        self._index = 0
+        self._row: Optional[Tuple[float, Optional[Dict[str, Any]]]] = None
+
+    def add(self, index: int, raw: Dict[str, Any], scale: str, ctx: Optional[Dict[str, Any]]) -> None:
+        # Время и анкета разбираются один раз на строку: FUSS и AUSS строки — один визит
+        if self._index != index:
+            self._index = index
+            try:
+                visited_at = self.timestamp(str(raw.get("visited_at") or "").strip() or None)
+                # Путь по схеме анкеты не строит ctx
+                self._row = (visited_at, coerce_row(raw) if ctx is None else None)
+            except (TypeError, ValueError):
+                self._row = None
+                self.summary.registry_errors += 1
+        if self._row is None:
+            return
+        visited_at, row_ctx = self._row
+        patient_id = str(raw.get("patient_id") or "").strip() or f"batch-{self.run}-{index}"
+        self.pending.append((patient_id, scale, scale_context(ctx if ctx is not None else row_ctx, scale), visited_at))
+        if len(self.pending) >= _REGISTRY_BATCH:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            self.summary.registry_visits += self.registry.add_visits(self.pending)
+            self.pending.clear()
+
+
+def _evaluate(evaluate: Callable[..., Any], scale: str, ctx: Dict[str, Any]) -> Any:
+    try:
+        return evaluate(scale, scale_context(ctx, scale))
+    except (KeyError, TypeError, ValueError) as e:
+        return e
+
+
+def _evaluate_decoded(cache: ScoringCache, schema: Any, decoded: Any, scales: Tuple[str, ...],
+                      audit: Optional["AuditLog"] = None, index: int = 0) -> List[Any]:
+    out: List[Any] = []
+    inputs = None
+    for name in scales:
+        codes = schema.scale_codes(decoded, name)
+        if isinstance(codes, Exception):
+            out.append(codes)
+            continue
+        if inputs is None:
+            inputs = schema.debridement_inputs(decoded)
+        outcome = cache.evaluate_codes(name, codes, inputs)
+        if audit is not None:
+            audit.record(name, codes, inputs, outcome, source="batch", ref=index)
+        out.append(outcome)
+    return out
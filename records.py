@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+from array import array
+from operator import getitem
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from scoring import (
+    CRITERIA,
+    SEVERITY_LEVELS,
+    ScoreResult,
+    canonical_codes,
+    get_scale,
+    severity_from_score,
+    total_encoded,
+)
+
+
+# Компактное хранение визитов и результатов для больших когорт.
+# Анкета хранится как bytes с кодами категорий (один байт на критерий в порядке
+# шкалы), результат — сумма, критичность и тяжесть. Подписи критериев и баллы
+# разложения не хранятся: они восстанавливаются по кодам из описания шкалы
+# при показе или выгрузке (to_score_result даёт тот же ScoreResult, что compute_scale).
+# Вместе с кодами хранится версия правил шкалы (get_scale(...).version): коды
+# и баллы читаются по той версии, по которой визит был посчитан.
+#
+# VisitRecord/CompactResult — по объекту на визит (__slots__);
+# ResultStore — столбцы в array (около 30 байт на визит), без объектов на визит.
+
+
+class VisitRecord:
+    __slots__ = ("scale", "codes", "version")
+
+    def __init__(self, scale: str, codes: bytes, version: Optional[str] = None):
+        self.scale = scale
+        self.codes = codes
+        self.version = version or get_scale(scale).version
+
+    @classmethod
+    def from_context(cls, scale: str, ctx: Dict[str, Any], version: Optional[str] = None) -> "VisitRecord":
+        compiled = get_scale(scale, version)
+        return cls(compiled.name, bytes(canonical_codes(scale, ctx, version)), compiled.version)
+
+    def to_context(self) -> Dict[str, Any]:
+        # Значения в виде категорий (толщины ОКТ — категорией, а не в мкм);
+        # compute_scale не принимает категории толщин, поэтому считать через score()
+        compiled = get_scale(self.scale, self.version)
+        return {key: CRITERIA[key].options[c] for key, c in zip(compiled.keys, self.codes)}
+
+    def score(self) -> "CompactResult":
+        score, critical = total_encoded(get_scale(self.scale, self.version), self.codes)
+        return CompactResult(self.scale, self.codes, score, critical, self.version)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, VisitRecord) and (
+            (self.scale, self.codes, self.version) == (other.scale, other.codes, other.version)
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.scale, self.codes, self.version))
+
+    def __repr__(self) -> str:
+        return f"VisitRecord({self.scale!r}, {self.codes!r}, version={self.version!r})"
+
+
+class CompactResult:
+    __slots__ = ("scale", "codes", "score", "critical", "version")
+
+    def __init__(self, scale: str, codes: bytes, score: int, critical: bool, version: Optional[str] = None):
+        self.scale = scale
+        self.codes = codes
+        self.score = score
+        self.critical = critical
+        self.version = version or get_scale(scale).version
+
+    @classmethod
+    def from_context(cls, scale: str, ctx: Dict[str, Any], version: Optional[str] = None) -> "CompactResult":
+        compiled = get_scale(scale, version)
+        codes = bytes(canonical_codes(scale, ctx, version))
+        return cls(compiled.name, codes, *total_encoded(compiled, codes), compiled.version)
+
+    @property
+    def severity(self) -> str:
+        return severity_from_score(self.score, self.scale, critical=self.critical, version=self.version)
+
+    @property
+    def breakdown(self) -> Dict[str, int]:
+        compiled = get_scale(self.scale, self.version)
+        return dict(zip(compiled.labels, map(getitem, compiled.points, self.codes)))
+
+    def to_score_result(self) -> ScoreResult:
+        return ScoreResult(score=self.score, breakdown=self.breakdown, critical=self.critical)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, CompactResult) and (
+            (self.scale, self.codes, self.score, self.critical, self.version)
+            == (other.scale, other.codes, other.score, other.critical, other.version)
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.scale, self.codes, self.version))
+
+    def __repr__(self) -> str:
+        return f"CompactResult({self.scale!r}, score={self.score}, critical={self.critical}, version={self.version!r})"
+
+
+class ResultStore:
+    # Столбцы одной шкалы: коды (n × число критериев, uint8), сумма (int16),
+    # флаги (бит 0 — критичность, биты 1-2 — индекс тяжести); все визиты — одной версии правил
+    def __init__(self, scale: str, version: Optional[str] = None):
+        compiled = get_scale(scale, version)
+        self.scale = compiled.name
+        self.version = compiled.version
+        self.width = len(compiled.keys)
+        self.codes = array("B")
+        self.scores = array("h")
+        self.flags = array("B")
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.codes, self.scores, self.flags))
+
+    def _append(self, codes: Any, score: int, critical: bool) -> None:
+        sev = SEVERITY_LEVELS.index(severity_from_score(score, self.scale, critical=critical, version=self.version))
+        self.codes.extend(codes)
+        self.scores.append(score)
+        self.flags.append(int(critical) | (sev << 1))
+
+    def append(self, ctx: Dict[str, Any]) -> int:
+        # -> номер визита
+        codes = canonical_codes(self.scale, ctx, self.version)
+        self._append(codes, *total_encoded(get_scale(self.scale, self.version), codes))
+        return len(self.scores) - 1
+
+    def append_result(self, result: CompactResult) -> int:
+        if result.scale != self.scale:
+            raise ValueError(f"Результат шкалы {result.scale} нельзя добавить в хранилище {self.scale}")
+        if result.version != self.version:
+            raise ValueError(f"Результат версии {result.version} нельзя добавить в хранилище версии {self.version}")
+        self._append(result.codes, result.score, result.critical)
+        return len(self.scores) - 1
+
+    def extend(self, contexts: Iterable[Dict[str, Any]]) -> None:
+        for ctx in contexts:
+            self.append(ctx)
+
+    def extend_codes(self, codes: Dict[str, Any], result: Optional[Any] = None) -> None:
+        # Пакетное добавление кодов batch.encode_cohort (и, если есть, готового BatchResult)
+        import numpy as np
+
+        from batch import score_codes
+
+        keys = get_scale(self.scale, self.version).keys
+        if result is None:
+            result = score_codes(codes, self.scale, self.version)
+        matrix = np.stack([np.asarray(codes[key], dtype=np.uint8) for key in keys], axis=1)
+        flags = result.critical.astype(np.uint8) | (result.severity.astype(np.uint8) << 1)
+        self.codes.frombytes(np.ascontiguousarray(matrix).tobytes())
+        self.scores.frombytes(result.score.astype(self.scores.typecode).tobytes())
+        self.flags.frombytes(flags.tobytes())
+
+    def __getitem__(self, index: int) -> CompactResult:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = index * self.width
+        return CompactResult(
+            self.scale, self.codes[start:start + self.width].tobytes(), self.scores[index], bool(self.flags[index] & 1),
+            self.version,
+        )
+
+    def __iter__(self) -> Iterator[CompactResult]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def severity(self, index: int) -> str:
+        return SEVERITY_LEVELS[self.flags[index] >> 1]
+
+    def to_score_result(self, index: int) -> ScoreResult:
+        return self[index].to_score_result()
+
+    def as_numpy(self) -> Tuple[Any, Any, Any, Any]:
+        # Представления без копирования: (коды n × k, сумма, критичность, тяжесть).
+        # Пока коды и сумма используются, хранилище нельзя дополнять (BufferError)
+        import numpy as np
+
+        codes = np.frombuffer(self.codes, dtype=np.uint8).reshape(-1, self.width)
+        flags = np.frombuffer(self.flags, dtype=np.uint8)
+        return codes, np.frombuffer(self.scores, dtype=np.int16), (flags & 1).astype(bool), flags >> 1
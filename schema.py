@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import metrics
+from scoring import CRITERIA, SCALES, _cat_size_mm, get_group
+
+
+# Скомпилированная схема анкеты: строка выгрузки (CSV — строки, JSON — числа и
+# строки) за один проход переводится в коды вариантов всех критериев выбранных
+# шкал (общий список полей — как в scoring.CompiledGroup). Для каждого поля
+# заранее собрана таблица «сырое значение -> код», включая пустое/отсутствующее
+# значение; таблицы толщин ОКТ пополняются по мере чтения. Всё, что не нашлось
+# в таблице, разбирается медленным путём с теми же правилами и ошибками, что
+# pipeline.coerce_row + scoring.canonical_codes.
+#
+# Ошибки бывают двух видов:
+#   - строки (неразборчивое число в толщине или size_mm) — строка не считается;
+#   - поля (недопустимый вариант, нет обязательного поля) — не считаются шкалы,
+#     которым нужно это поле.
+# validate() собирает все ошибки файла до расчёта.
+
+# Наибольший размер таблицы значений толщины (целые мкм повторяются)
+_MEMO_LIMIT = 1 << 16
+_SIZE_CODES = {opt: code for code, opt in enumerate(CRITERIA["size_cat"].options)}
+
+
+def error_text(e: BaseException) -> str:
+    if isinstance(e, KeyError):
+        return f"Недопустимое или отсутствующее значение: {e.args[0]!r}"
+    return str(e)
+
+
+@dataclass(frozen=True)
+class FieldError:
+    row: int
+    field: str
+    value: Any
+    message: str
+    # Шкала, которую нельзя рассчитать (пусто — вся строка)
+    scale: str = ""
+
+
+class SchemaError(ValueError):
+    def __init__(self, errors: Sequence[FieldError], rows: int = 0):
+        self.errors = list(errors)
+        self.rows = rows
+        first = self.errors[0] if self.errors else None
+        head = f"строка {first.row}, {first.field}: {first.message}" if first else ""
+        super().__init__(f"Ошибок в анкетах: {len(self.errors)} ({head})")
+
+
+@dataclass
+class DecodedRow:
+    # Коды по полям схемы (None — ошибка, см. errors) и ошибки полей
+    codes: List[Optional[int]]
+    errors: Optional[Dict[int, BaseException]]
+    # Ошибки приведения типов строки: (поле, значение, исключение) в порядке столбцов
+    row_errors: Optional[List[Tuple[str, Any, BaseException]]]
+    # Толщины ОКТ заданы в строке (для выбора кросслинкинга отсутствующая = 0 мкм)
+    thickness: Tuple[bool, bool]
+
+    @property
+    def row_error(self) -> Optional[BaseException]:
+        return self.row_errors[0][2] if self.row_errors else None
+
+
+class _Slot:
+    # Поле схемы: критерий (и отдельное поле шкалы, если есть)
+    __slots__ = ("key", "alias", "options", "codes", "default", "categorize", "table", "fallback")
+
+    def __init__(self, key: str, alias: Optional[str]):
+        crit = CRITERIA[key]
+        self.key = key
+        self.alias = alias
+        self.options = crit.options
+        self.codes = {opt: code for code, opt in enumerate(crit.options)}
+        self.default = None if crit.required else crit.default
+        self.categorize = crit.categorize
+        table: Dict[Any, int] = {}
+        if self.categorize is None:
+            table.update(self.codes)
+            table.update({str(opt): code for opt, code in self.codes.items()})
+        if self.default is not None and alias is None:
+            # Пустая ячейка -> значение по умолчанию
+            default = self.categorize(self.default) if self.categorize else self.default
+            table[""] = table[None] = self.codes[default]
+        self.table = table
+        # При пустом поле: (другое поле строки, его таблица) — общее поле критерия
+        # для отдельного поля шкалы, size_mm для size_cat
+        self.fallback: Optional[Tuple[str, Dict[Any, int]]] = None
+        if alias is not None:
+            self.fallback = (key, _Slot(key, None).table)
+
+
+class Schema:
+    def __init__(self, scales: Sequence[str] = tuple(SCALES)):
+        self.group = get_group(tuple(scales))
+        self.scales = tuple(c.name for c in self.group.scales)
+        self.slots = [_Slot(key, None) for key, _ in self.group.shared]
+        self.slots += [_Slot(key, alias) for alias, key, _ in self.group.own]
+        self._names = tuple(slot.alias or slot.key for slot in self.slots)
+        self._tables = tuple(slot.table for slot in self.slots)
+        self._numeric = {s.key for s in self.slots if s.categorize is not None} | {"size_mm"}
+        shared = {s.key: i for i, s in enumerate(self.slots) if s.alias is None}
+        self._thickness = tuple(shared.get(key) for key in ("min_thickness_um", "mean_thickness_um"))
+        # (позиция поля, варианты) входов выбора кросслинкинга
+        self._debridement = tuple(
+            (shared.get(key), CRITERIA[key].options) for key in ("pachy_uneven", "localization", "total_leucoma", "edema")
+        )
+        # Категория размера по уже разобранным значениям size_mm
+        self._sizes: Dict[Any, int] = {}
+        for slot in self.slots:
+            if slot.key == "size_cat":
+                slot.fallback = ("size_mm", self._sizes)
+        # Позиции полей каждой шкалы (в порядке критериев шкалы)
+        self._positions = [self.group.positions[a:b] for a, b in self.group.bounds]
+        self._pickers = [itemgetter(*p) if len(p) > 1 else (lambda codes, i=p[0]: (codes[i],)) for p in self._positions]
+        self._scale_index = {name: n for n, name in enumerate(self.scales)}
+
+    # --- разбор строки --------------------------------------------------------------
+
+    def decode(self, row: Dict[str, Any]) -> DecodedRow:
+        get = row.get
+        codes: List[Optional[int]] = []
+        try:
+            codes = list(map(dict.get, self._tables, map(get, self._names)))
+        except TypeError:
+            # Нехешируемое значение (список/словарь из JSON) — медленный путь
+            codes = [None] * len(self.slots)
+        errors: Optional[Dict[int, BaseException]] = None
+        if None in codes:
+            for i, code in enumerate(codes):
+                if code is not None:
+                    continue
+                slot = self.slots[i]
+                if slot.fallback is not None and get(slot.alias or slot.key) in (None, ""):
+                    name, table = slot.fallback
+                    try:
+                        code = table.get(get(name))
+                    except TypeError:
+                        code = None
+                    if code is not None:
+                        codes[i] = code
+                        continue
+                try:
+                    codes[i] = self._decode_slot(slot, row)
+                except (KeyError, TypeError, ValueError) as e:
+                    errors = errors or {}
+                    errors[i] = e
+        # Ошибки приведения типов возможны только в числовых полях: в толщинах они
+        # уже видны как ошибки полей, size_mm проверяется отдельно (с памятью)
+        size = get("size_mm")
+        check = size is not None and size != "" and (isinstance(size, (list, dict)) or size not in self._sizes)
+        if errors and not check:
+            check = any(self.slots[i].categorize is not None for i in errors)
+        row_errors = self._row_errors(row) if check else None
+        a, b = self._thickness
+        thickness = (a is not None and get("min_thickness_um") not in (None, ""),
+                     b is not None and get("mean_thickness_um") not in (None, ""))
+        return DecodedRow(codes, errors, row_errors, thickness)
+
+    def _row_errors(self, row: Dict[str, Any]) -> Optional[List[Tuple[str, Any, BaseException]]]:
+        # Как pipeline.coerce_row: числа из текста, размер из size_mm при пустом size_cat
+        out = []
+        for key, value in row.items():
+            if key not in self._numeric or value is None or value == "":
+                continue
+            try:
+                if isinstance(value, str):
+                    value = _number(value)
+                if key == "size_mm" and row.get("size_cat") in (None, ""):
+                    _cat_size_mm(float(value))
+            except (TypeError, ValueError) as e:
+                out.append((key, row[key], e))
+            else:
+                if key == "size_mm" and len(self._sizes) < _MEMO_LIMIT:
+                    try:
+                        self._sizes[row[key]] = _SIZE_CODES[_cat_size_mm(float(value))]
+                    except (TypeError, ValueError):
+                        pass
+        return out or None
+
+    def _value(self, slot: _Slot, row: Dict[str, Any]) -> Any:
+        # Значение критерия после приведения типов (как pipeline.coerce_row + scale_context)
+        if slot.alias is not None:
+            value = row.get(slot.alias)
+            if value is not None and value != "":
+                return value
+        value = row.get(slot.key)
+        if (value is None or value == "") and slot.key == "size_cat":
+            size = row.get("size_mm")
+            if size is not None and size != "":
+                return _cat_size_mm(float(_number(size) if isinstance(size, str) else size))
+        if value is None or value == "":
+            if slot.default is None:
+                raise KeyError(slot.key)
+            return slot.default
+        return value
+
+    def _decode_slot(self, slot: _Slot, row: Dict[str, Any]) -> int:
+        value = self._value(slot, row)
+        if slot.categorize is not None:
+            if isinstance(value, str):
+                value = _number(value)
+            code = slot.codes[slot.categorize(value)]
+            raw = row.get(slot.key)
+            if slot.alias is None and type(raw) in (str, int, float) and len(slot.table) < _MEMO_LIMIT:
+                slot.table[raw] = code
+            return code
+        if isinstance(value, str):
+            value = value.strip()
+            for opt in slot.options:
+                if str(opt) == value:
+                    return slot.codes[opt]
+        return slot.codes[value]
+
+    # --- шкалы ------------------------------------------------------------------------
+
+    def scale_codes(self, decoded: DecodedRow, scale: str) -> Any:
+        # -> коды критериев шкалы (как canonical_codes) или исключение первого
+        # недопустимого поля в порядке критериев шкалы
+        n = self._scale_index.get(scale)
+        if n is None:
+            return KeyError(scale)
+        if decoded.errors:
+            for i in self._positions[n]:
+                if i in decoded.errors:
+                    return decoded.errors[i]
+        return self._pickers[n](decoded.codes)
+
+    def debridement_inputs(self, decoded: DecodedRow) -> Tuple[bool, str, int, int]:
+        # Как scoring.debridement_inputs по исходной анкете
+        codes = decoded.codes
+        pachy, localization, total_leucoma, edema = [
+            None if i is None or codes[i] is None else options[codes[i]]  # type: ignore[index]
+            for i, options in self._debridement
+        ]
+        # Код 0 толщины — «>=400» / «>=600»
+        (min_known, mean_known), (a, b) = decoded.thickness, self._thickness
+        thickness_ok = (min_known and mean_known and a is not None and b is not None
+                        and codes[a] == 0 and codes[b] == 0 and int(pachy or 0) == 0)
+        return thickness_ok, localization or "peripheral", int(total_leucoma or 0), int(edema or 0)
+
+    # --- проверка ---------------------------------------------------------------------
+
+    def row_errors(self, index: int, row: Dict[str, Any], scales: Sequence[str]) -> List[FieldError]:
+        # Все ошибки строки для заданных шкал (а не только первая)
+        decoded = self.decode(row)
+        out = [FieldError(index, key, value, error_text(e)) for key, value, e in decoded.row_errors or ()]
+        if out or not decoded.errors:
+            return out
+        # Поле с ошибкой -> шкалы, которые из-за него не считаются
+        affected: Dict[int, List[str]] = {}
+        for scale in scales:
+            for i in self._positions[self._scale_index[scale]]:
+                if i in decoded.errors:
+                    affected.setdefault(i, []).append(scale)
+        for i, names in affected.items():
+            slot = self.slots[i]
+            name = slot.alias if slot.alias and row.get(slot.alias) not in (None, "") else slot.key
+            if slot.key == "size_cat" and row.get("size_cat") in (None, "") and row.get("size_mm") not in (None, ""):
+                name = "size_mm"
+            out.append(FieldError(index, name, row.get(name), error_text(decoded.errors[i]), ", ".join(names)))
+        return out
+
+
+def _number(value: str) -> Any:
+    # Толщины и размер из текста: запятая как десятичный разделитель
+    value = value.strip().replace(",", ".")
+    return int(value) if value.lstrip("-").isdigit() else float(value)
+
+
+_SCHEMAS: Dict[Tuple[str, ...], Schema] = {}
+
+
+def get_schema(scales: Sequence[str] = tuple(SCALES)) -> Schema:
+    key = tuple(scales)
+    schema = _SCHEMAS.get(key)
+    if schema is None:
+        schema = _SCHEMAS[key] = Schema(key)
+    return schema
+
+
+def validate(rows: Iterable[Dict[str, Any]], scale: str = "row", max_errors: Optional[int] = None) -> Tuple[int, List[FieldError]]:
+    # Проверка всей выгрузки до расчёта -> (число строк, ошибки)
+    from pipeline import row_scales
+
+    schema = get_schema()
+    errors: List[FieldError] = []
+    n = 0
+    for n, row in enumerate(rows, start=1):
+        try:
+            scales = row_scales(row, scale)
+        except ValueError as e:
+            errors.append(FieldError(n, "scale", row.get("scale"), error_text(e)))
+            scales = ()
+        for name in scales:
+            if name not in schema.scales:
+                errors.append(FieldError(n, "scale", name, error_text(KeyError(name)), name))
+        scales = [name for name in scales if name in schema.scales]
+        errors += schema.row_errors(n, row, scales)
+        if max_errors is not None and len(errors) >= max_errors:
+            break
+    return n, errors
+
+
+# Замеры, включённые во время импорта этого модуля (metrics.enable)
+metrics.enable_module(__name__)
@@ -0,0 +1,485 @@
+from __future__ import annotations
+
+import itertools
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+from array import array
+from dataclasses import dataclass
+from operator import mul
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from scoring import (
+    CRITERIA,
+    SCALES,
+    SEVERITY_LEVELS,
+    ScoreResult,
+    _lookup,
+    choose_debridement,
+    compute_scale,
+    get_scale,
+    recommend_treatment,
+    severity_from_score,
+    spec_fingerprint,
+)
+
+
+# Предрасчитанная таблица исходов FUSS/AUSS.
+# Анкета после категоризации — число в смешанной системе счисления
+# (разряд = критерий шкалы, основание = число вариантов, младший разряд — первый
+# критерий). Полное пространство не перечислимо целиком (~7·10^10 анкет FUSS,
+# ~9·10^12 AUSS), но сумма баллов аддитивна, а критичность — «или» по отдельным
+# ответам. Поэтому разряды делятся на группы (до GROUP_LIMIT сочетаний), и для
+# каждого сочетания группы хранится частичная сумма + 256 за каждый критичный ответ.
+# Итог: несколько выборок по индексу и одна выборка из таблицы исходов
+# (сумма, критичность, вариант кросслинкинга) -> тяжесть и рекомендация.
+# Выигрыш — на когортах (score_cohort, score_codes); одиночная анкета (evaluate)
+# считается не быстрее compute_scale.
+#
+# Все значения — uint16 в одном непрерывном буфере; файл таблицы читается
+# через mmap без разбора. Таблица строится вызовом тех же функций scoring,
+# поэтому заодно служит эталоном для сверки (verify_table).
+
+TABLE_FORMAT = 1
+GROUP_LIMIT = 1 << 16
+
+_MAGIC = b"AFST"
+_HEADER = struct.Struct("<4sHHI")
+_CRITICAL_UNIT = 256
+
+# Поля, от которых зависит выбор вида кросслинкинга (см. debridement_inputs);
+# отсутствующая толщина там считается равной 0 мкм
+DEBRIDEMENT_FIELDS = ("min_thickness_um", "mean_thickness_um", "pachy_uneven", "localization", "total_leucoma", "edema")
+_THICKNESS_FIELDS = ("min_thickness_um", "mean_thickness_um")
+
+
+def radices(scale: str) -> Tuple[int, ...]:
+    return tuple(len(c) for c in get_scale(scale).codes)
+
+
+def answer_index(scale: str, codes: Sequence[int]) -> int:
+    # Номер анкеты во всём пространстве шкалы
+    index = 0
+    for code, base in zip(reversed(codes), reversed(radices(scale))):
+        index = index * base + code
+    return index
+
+
+def decode_answer_index(scale: str, index: int) -> Tuple[int, ...]:
+    codes = []
+    for base in radices(scale):
+        index, code = divmod(index, base)
+        codes.append(code)
+    if index:
+        raise ValueError(f"Номер анкеты вне пространства шкалы {scale}")
+    return tuple(codes)
+
+
+def _representatives(key: str) -> List[Any]:
+    # Значение поля анкеты для каждого кода варианта (для толщин — первое
+    # целое число, попадающее в категорию)
+    crit = CRITERIA[key]
+    if crit.categorize is None:
+        return list(crit.options)
+    found: Dict[Any, int] = {}
+    for value in range(0, 2000):
+        found.setdefault(crit.categorize(value), value)
+    return [found[opt] for opt in crit.options]
+
+
+def _group_positions(bases: Sequence[int], limit: int) -> List[List[int]]:
+    groups: List[List[int]] = []
+    size = limit + 1
+    for pos, base in enumerate(bases):
+        if size * base > limit:
+            groups.append([])
+            size = 1
+        groups[-1].append(pos)
+        size *= base
+    return groups
+
+
+def _strides(bases: Sequence[int]) -> List[int]:
+    out, stride = [], 1
+    for base in bases:
+        out.append(stride)
+        stride *= base
+    return out
+
+
+def _enumerate(bases: Sequence[int]):
+    # Сочетания кодов в порядке возрастания индекса (первый разряд — младший)
+    for digits in itertools.product(*(range(b) for b in reversed(bases))):
+        yield digits[::-1]
+
+
+@dataclass(frozen=True)
+class _ScaleLayout:
+    name: str
+    # (позиции критериев, шаги разрядов, смещение в буфере) для каждой группы
+    groups: Tuple[Tuple[Tuple[int, ...], Tuple[int, ...], int], ...]
+    debridement: Tuple[Tuple[int, ...], Tuple[int, ...], int]
+    # Коды категории «0 мкм» для отсутствующих толщин (позиция в DEBRIDEMENT_FIELDS -> код)
+    missing_thickness: Tuple[Tuple[int, int], ...]
+    variants: int
+    max_score: int
+    outcomes: int
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "groups": [[list(p), list(s), o] for p, s, o in self.groups],
+            "debridement": [list(self.debridement[0]), list(self.debridement[1]), self.debridement[2]],
+            "missing_thickness": [list(x) for x in self.missing_thickness],
+            "variants": self.variants,
+            "max_score": self.max_score,
+            "outcomes": self.outcomes,
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "_ScaleLayout":
+        pos, strides, offset = data["debridement"]
+        return cls(
+            name=data["name"],
+            groups=tuple((tuple(p), tuple(s), o) for p, s, o in data["groups"]),
+            debridement=(tuple(pos), tuple(strides), offset),
+            missing_thickness=tuple(tuple(x) for x in data["missing_thickness"]),
+            variants=data["variants"],
+            max_score=data["max_score"],
+            outcomes=data["outcomes"],
+        )
+
+
+class ScoreTable:
+    def __init__(self, meta: Dict[str, Any], values: Any, owner: Any = None):
+        if meta.get("fingerprint") != spec_fingerprint():
+            raise ValueError("Таблица построена по другой редакции шкал — пересоберите её")
+        self.meta = meta
+        self.layouts: Dict[str, _ScaleLayout] = {
+            name: _ScaleLayout.from_json(data) for name, data in meta["scales"].items()
+        }
+        self.recommendations: Tuple[str, ...] = tuple(meta["recommendations"])
+        self._values = values
+        self._owner = owner
+        self._direct = {name: _direct_tables(layout) for name, layout in self.layouts.items()}
+
+    # --- построение и хранение -------------------------------------------------
+
+    @classmethod
+    def build(cls, scales: Optional[Sequence[str]] = None, group_limit: int = GROUP_LIMIT) -> "ScoreTable":
+        values = array("H")
+        recommendations: List[str] = []
+        rec_index: Dict[str, int] = {}
+        layouts: Dict[str, Any] = {}
+        for scale in (scales or SCALES):
+            layouts[scale] = _build_scale(scale, group_limit, values, recommendations, rec_index).to_json()
+        meta = {
+            "format": TABLE_FORMAT,
+            "fingerprint": spec_fingerprint(),
+            "scales": layouts,
+            "recommendations": recommendations,
+        }
+        return cls(meta, memoryview(values))
+
+    def save(self, path: str) -> int:
+        meta = json.dumps(self.meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        pad = -(_HEADER.size + len(meta)) % 8
+        data = array("H", self._values)
+        if sys.byteorder != "little":
+            data.byteswap()
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, TABLE_FORMAT, 0, len(meta) + pad))
+            f.write(meta + b" " * pad)
+            data.tofile(f)
+        os.replace(tmp, path)
+        return _HEADER.size + len(meta) + pad + len(data) * 2
+
+    @classmethod
+    def load(cls, path: str) -> "ScoreTable":
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, _, meta_len = _HEADER.unpack_from(mm, 0)
+        if magic != _MAGIC or fmt != TABLE_FORMAT:
+            mm.close()
+            raise ValueError(f"{path}: не файл таблицы исходов или неподдерживаемый формат")
+        meta = json.loads(bytes(mm[_HEADER.size:_HEADER.size + meta_len]).decode("utf-8"))
+        start = _HEADER.size + meta_len
+        if sys.byteorder == "little":
+            values: Any = memoryview(mm)[start:].cast("H")
+        else:  # pragma: no cover - big-endian платформы
+            values = array("H", mm[start:])
+            values.byteswap()
+        return cls(meta, values, owner=mm)
+
+    def close(self) -> None:
+        if isinstance(self._values, memoryview):
+            self._values.release()
+        if self._owner is not None:
+            self._owner.close()
+            self._owner = None
+
+    def __enter__(self) -> "ScoreTable":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._values) * 2
+
+    # --- выборки ---------------------------------------------------------------
+
+    def lookup(self, scale: str, codes: Sequence[int], thickness_known: Sequence[bool] = (True, True)) -> Tuple[int, bool, int, int]:
+        # -> (сумма, критичность, индекс тяжести, индекс рекомендации)
+        layout = self.layouts[scale]
+        values = self._values
+        get = codes.__getitem__
+        total = 0
+        for positions, strides, offset in layout.groups:
+            total += values[offset + sum(map(mul, map(get, positions), strides))]
+        positions, strides, offset = layout.debridement
+        d_codes = list(map(get, positions))
+        if not all(thickness_known):
+            for (i, code), known in zip(layout.missing_thickness, thickness_known):
+                if not known:
+                    d_codes[i] = code
+        variant = values[offset + sum(map(mul, d_codes, strides))]
+        score = total & (_CRITICAL_UNIT - 1)
+        critical = total >= _CRITICAL_UNIT
+        outcome = values[layout.outcomes + (score * 2 + critical) * layout.variants + variant]
+        return score, critical, outcome & 3, outcome >> 2
+
+    def compute(self, scale: str, ctx: Dict[str, Any]) -> ScoreResult:
+        return self.evaluate(scale, ctx)[0]
+
+    def evaluate(self, scale: str, ctx: Dict[str, Any]) -> Tuple[ScoreResult, str, str]:
+        # Тот же результат, что ScoringCache.evaluate / compute_scale + recommend_treatment.
+        # Ответ сразу переводится в «код × шаг разряда (+ смещение группы)»,
+        # так что индекс группы — сумма среза. Для одной анкеты это не быстрее
+        # compute_scale: разбор полей и разложение баллов стоят столько же, а выборки
+        # из таблицы заменяют лишь сложение. Таблица ускоряет когорты (score_cohort)
+        compiled, tables, slices, d_positions, d_tables, missing, layout = self._direct[scale]
+        values, index = _lookup(compiled, ctx, tables)
+        buf = self._values
+        total = 0
+        for a, b in slices:
+            total += buf[sum(index[a:b])]
+        d_values = list(map(values.__getitem__, d_positions))
+        for i, key, value in missing:
+            if key not in ctx:
+                d_values[i] = value
+        variant = buf[sum(map(dict.__getitem__, d_tables, d_values))]
+        score = total & (_CRITICAL_UNIT - 1)
+        critical = total >= _CRITICAL_UNIT
+        outcome = buf[layout.outcomes + (score * 2 + critical) * layout.variants + variant]
+        breakdown = dict(zip(compiled.labels, map(dict.__getitem__, compiled.lookups, values)))
+        return (
+            ScoreResult(score=score, breakdown=breakdown, critical=critical),
+            SEVERITY_LEVELS[outcome & 3],
+            self.recommendations[outcome >> 2],
+        )
+
+    def score_codes(self, codes: Dict[str, Any], scale: str, thickness_known: Sequence[bool] = (True, True)):
+        # Пакетный вариант для кодов из batch.encode_cohort -> (BatchResult, индексы рекомендаций)
+        import numpy as np
+
+        from batch import BatchResult
+
+        layout = self.layouts[scale]
+        keys = get_scale(scale).keys
+        values = np.frombuffer(self._values, dtype=np.uint16)
+        n = codes[keys[0]].shape[0]
+        total = np.zeros(n, dtype=np.uint16)
+        for positions, strides, offset in layout.groups:
+            index = np.full(n, offset, dtype=np.int64)
+            for p, s in zip(positions, strides):
+                index += codes[keys[p]].astype(np.int64) * s
+            total += values.take(index)
+        positions, strides, offset = layout.debridement
+        index = np.full(n, offset, dtype=np.int64)
+        missing = dict(layout.missing_thickness)
+        known = dict(zip(range(len(_THICKNESS_FIELDS)), thickness_known))
+        for i, (p, s) in enumerate(zip(positions, strides)):
+            if i in missing and not known.get(i, True):
+                index += missing[i] * s
+            else:
+                index += codes[keys[p]].astype(np.int64) * s
+        variant = values.take(index)
+        score = (total & (_CRITICAL_UNIT - 1)).astype(np.int32)
+        critical = total >= _CRITICAL_UNIT
+        outcome = values.take(layout.outcomes + (score * 2 + critical) * layout.variants + variant)
+        result = BatchResult(score=score, critical=critical, severity=(outcome & 3).astype(np.uint8))
+        return result, outcome >> 2
+
+    def score_cohort(self, cohort: Any, scale: str):
+        from batch import _columns, encode_cohort
+
+        cols = _columns(cohort)
+        codes = encode_cohort(cols, get_scale(scale).keys)
+        return self.score_codes(codes, scale, tuple(key in cols for key in _THICKNESS_FIELDS))
+
+
+def _direct_tables(layout: _ScaleLayout) -> Tuple[Any, ...]:
+    compiled = get_scale(layout.name)
+    tables: List[Dict[Any, int]] = [{} for _ in compiled.keys]
+    slices = []
+    for positions, strides, offset in layout.groups:
+        if list(positions) != list(range(positions[0], positions[-1] + 1)):
+            raise ValueError(f"{layout.name}: группа разрядов должна быть непрерывной")
+        for j, (p, stride) in enumerate(zip(positions, strides)):
+            tables[p] = {opt: code * stride + (offset if j == 0 else 0) for opt, code in compiled.codes[p].items()}
+        slices.append((positions[0], positions[-1] + 1))
+    positions, strides, offset = layout.debridement
+    d_tables = [
+        {opt: code * stride + (offset if j == 0 else 0) for opt, code in compiled.codes[p].items()}
+        for j, (p, stride) in enumerate(zip(positions, strides))
+    ]
+    options = [CRITERIA[key].options for key in DEBRIDEMENT_FIELDS]
+    missing = tuple((i, DEBRIDEMENT_FIELDS[i], options[i][code]) for i, code in layout.missing_thickness)
+    return compiled, tuple(tables), tuple(slices), positions, tuple(d_tables), missing, layout
+
+
+def _build_scale(scale: str, limit: int, values: array, recommendations: List[str], rec_index: Dict[str, int]) -> _ScaleLayout:
+    compiled = get_scale(scale)
+    bases = radices(scale)
+    critical = set(compiled.critical_codes)
+    if len(critical) * _CRITICAL_UNIT + _CRITICAL_UNIT > 1 << 16:
+        raise ValueError(f"{scale}: слишком много критичных ответов для таблицы")
+
+    groups = []
+    for positions in _group_positions(bases, limit):
+        offset = len(values)
+        sub = [bases[p] for p in positions]
+        for digits in _enumerate(sub):
+            value = 0
+            for p, c in zip(positions, digits):
+                value += compiled.points[p][c]
+                if (p, c) in critical:
+                    value += _CRITICAL_UNIT
+            values.append(value)
+        groups.append((tuple(positions), tuple(_strides(sub)), offset))
+    max_score = sum(max(p) for p in compiled.points)
+    if max_score >= _CRITICAL_UNIT:
+        raise ValueError(f"{scale}: сумма баллов не помещается в таблицу")
+
+    # Вариант кросслинкинга для каждого сочетания полей, от которых он зависит
+    positions = tuple(compiled.keys.index(key) for key in DEBRIDEMENT_FIELDS)
+    reps = [_representatives(key) for key in DEBRIDEMENT_FIELDS]
+    sub = [bases[p] for p in positions]
+    variants: Dict[str, int] = {}
+    variant_ctx: List[Dict[str, Any]] = []
+    d_offset = len(values)
+    for digits in _enumerate(sub):
+        ctx = {key: reps[i][c] for i, (key, c) in enumerate(zip(DEBRIDEMENT_FIELDS, digits))}
+        text = choose_debridement(ctx)
+        if text not in variants:
+            variants[text] = len(variants)
+            variant_ctx.append(ctx)
+        values.append(variants[text])
+    missing = tuple(
+        (i, compiled.codes[positions[i]][CRITERIA[key].categorize(0)])
+        for i, key in enumerate(DEBRIDEMENT_FIELDS) if key in _THICKNESS_FIELDS
+    )
+
+    # Исходы: (сумма, критичность, вариант) -> тяжесть | рекомендация << 2
+    o_offset = len(values)
+    for score in range(max_score + 1):
+        for crit in (False, True):
+            sev = severity_from_score(score, scale, critical=crit)
+            for ctx in variant_ctx:
+                rec = recommend_treatment(scale, sev, score, ctx, critical=crit)
+                if rec not in rec_index:
+                    rec_index[rec] = len(recommendations)
+                    recommendations.append(rec)
+                values.append(SEVERITY_LEVELS.index(sev) | (rec_index[rec] << 2))
+    return _ScaleLayout(
+        name=scale,
+        groups=tuple(groups),
+        debridement=(positions, tuple(_strides(sub)), d_offset),
+        missing_thickness=missing,
+        variants=len(variant_ctx),
+        max_score=max_score,
+        outcomes=o_offset,
+    )
+
+
+_DEFAULT: Optional[ScoreTable] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def default_table() -> ScoreTable:
+    # Строится в памяти при первом обращении (доли секунды)
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = ScoreTable.build()
+        return _DEFAULT
+
+
+# --- сверка с compute_fuss/compute_auss ----------------------------------------
+
+def _reference(scale: str, ctx: Dict[str, Any]) -> Tuple[int, bool, str, str]:
+    res = compute_scale(scale, ctx)
+    sev = severity_from_score(res.score, scale, critical=res.critical)
+    return res.score, res.critical, sev, recommend_treatment(scale, sev, res.score, ctx, critical=res.critical)
+
+
+def _check(table: ScoreTable, scale: str, ctx: Dict[str, Any], mismatches: List[str]) -> None:
+    res, sev, rec = table.evaluate(scale, ctx)
+    got = (res.score, res.critical, sev, rec)
+    expected = _reference(scale, ctx)
+    if got != expected and len(mismatches) < 100:
+        mismatches.append(f"{scale} {ctx!r}: {got[:3]} != {expected[:3]}")
+
+
+def verify_table(table: ScoreTable, samples: int = 10_000, seed: int = 0) -> Dict[str, Any]:
+    # Полный перебор каждой группы разрядов (остальные критерии — первый вариант),
+    # всех вариантов кросслинкинга и исходов, плюс случайные полные анкеты
+    rng = random.Random(seed)
+    mismatches: List[str] = []
+    checked = 0
+    for scale, layout in table.layouts.items():
+        keys = get_scale(scale).keys
+        reps = [_representatives(key) for key in keys]
+        base = {key: r[0] for key, r in zip(keys, reps)}
+        bases = radices(scale)
+        for positions, _, _ in layout.groups + (layout.debridement,):
+            for digits in _enumerate([bases[p] for p in positions]):
+                ctx = dict(base)
+                for p, c in zip(positions, digits):
+                    ctx[keys[p]] = reps[p][c]
+                _check(table, scale, ctx, mismatches)
+                checked += 1
+        # Таблица исходов: каждая сумма, критичность и вариант кросслинкинга
+        positions, strides, offset = layout.debridement
+        d_reps = [_representatives(key) for key in DEBRIDEMENT_FIELDS]
+        variant_ctx: Dict[int, Dict[str, Any]] = {}
+        for digits in _enumerate([bases[p] for p in positions]):
+            index = offset + sum(c * s for c, s in zip(digits, strides))
+            variant_ctx.setdefault(table._values[index], {
+                key: d_reps[i][c] for i, (key, c) in enumerate(zip(DEBRIDEMENT_FIELDS, digits))
+            })
+        for score in range(layout.max_score + 1):
+            for crit in (False, True):
+                sev = severity_from_score(score, scale, critical=crit)
+                for variant, ctx in variant_ctx.items():
+                    outcome = table._values[layout.outcomes + (score * 2 + crit) * layout.variants + variant]
+                    got = (SEVERITY_LEVELS[outcome & 3], table.recommendations[outcome >> 2])
+                    expected = (sev, recommend_treatment(scale, sev, score, ctx, critical=crit))
+                    if got != expected and len(mismatches) < 100:
+                        mismatches.append(f"{scale} исход {score}/{crit}/{variant}: {got[0]} != {expected[0]}")
+                    checked += 1
+        for _ in range(samples):
+            ctx = {key: rng.choice(r) for key, r in zip(keys, reps)}
+            for key in _THICKNESS_FIELDS:
+                if rng.random() < 0.1:
+                    del ctx[key]
+            _check(table, scale, ctx, mismatches)
+            checked += 1
+    return {"checked": checked, "mismatches": mismatches}
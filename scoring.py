@@ -1,10 +1,14 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from io import BytesIO
-from typing import Dict, Any, Tuple
+import os as _os
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
+from operator import getitem
+from typing import TYPE_CHECKING, Dict, Any, Tuple, List, Optional, Callable, Sequence
 from datetime import date
-from docx import Document
+
+if TYPE_CHECKING:
+    from docx_template import Block
 
 
 def _cat_size_mm(mm: float) -> str:
@@ -37,140 +41,615 @@ def _cat_mean_thickness(mean_um: int) -> str:
     return "<450"
 
 
-@dataclass(frozen=True)
-class ScoreResult:
-    score: int
-    breakdown: Dict[str, int]
-    critical: bool
+# Значения толщины повторяются (целые мкм), поэтому категоризация кэшируется
+@lru_cache(maxsize=4096)
+def _cat_min_thickness_raw(value: Any) -> str:
+    return _cat_min_thickness(int(value))
 
 
-def compute_fuss(ctx: Dict[str, Any]) -> ScoreResult:
-    bd: Dict[str, int] = {}
+@lru_cache(maxsize=4096)
+def _cat_mean_thickness_raw(value: Any) -> str:
+    return _cat_mean_thickness(int(value))
 
-    # Общие клинические признаки (в начале — одинаково в обеих шкалах)
-    bd["Болевой синдром"] = {0: 0, 2: 2, 4: 4}[ctx.get("pain", 0)]
-    bd["Перикорнеальная инъекция"] = {0: 0, 1: 1, 2: 2, 3: 3}[ctx.get("injection", 0)]
-    bd["Отделяемое"] = {0: 0, 1: 2}[ctx.get("discharge", 0)]
-    bd["Сателлитные инфильтраты/«перистые» края"] = {0: 0, 1: 2}[ctx.get("satellites", 0)]
 
-    # Размер/локализация/глубина
-    bd["Размер дефекта"] = {"<=2": 0, "2-4": 1, "4-6": 2, ">6": 3}[ctx["size_cat"]]
-    bd["Клиническая форма (грибковая)"] = {0: 0, 1: 1, 2: 2}[ctx.get("fungal_form", 0)]
-    bd["Локализация"] = {"peripheral": 0, "paracentral": 1, "central": 2}[ctx["localization"]]
-    bd["Глубина"] = {"superficial": 0, "mid": 2, "deep": 4, "descemetocele": 6}[ctx["depth_cat"]]
+class FrozenBreakdown(dict):
+    # Разложение баллов только для чтения — для результатов, общих для многих
+    # обращений (cache.ScoringCache). Остаётся dict: JSON, pickle и dict(...) работают
+    __slots__ = ()
 
-    # Воспаление/ПК/гипопион/отёк
-    bd["Признаки десцеметита"] = {0: 0, 1: 2}[ctx.get("descemetitis", 0)]
-    bd["Гипопион"] = {"none": 0, "lt1": 1, "1to2": 2, "gt2": 3}[ctx.get("hypopyon", "none")]
-    bd["Тотальное бельмо"] = {0: 0, 1: 2}[ctx.get("total_leucoma", 0)]
+    def _readonly(self, *args: Any, **kwargs: Any) -> Any:
+        raise TypeError("Разложение баллов только для чтения")
 
-    # ЕДИНЫЙ вопрос по передней камере для обеих шкал
-    # Для FUSS учитывается «не просматривается» отдельно (4 балла)
-    ac = ctx.get("ac", "0")
-    bd["Передняя камера"] = {"0": 0, "1-20": 1, ">20": 2, "not_visible": 4}[ac]
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
 
-    bd["Отёк роговицы"] = {0: 0, 1: 1, 2: 2}[ctx.get("edema", 0)]
-    bd["ВГД"] = {"normal": 0, "high": 1, "low": 1}[ctx.get("iog", "normal")]
+    def __reduce__(self) -> Any:
+        return FrozenBreakdown, (dict(self),)
 
-    # ОКТ — только пахиметрия
-    bd["ОКТ: локальные зоны истончения"] = {0: 0, 1: 2}[ctx.get("pachy_uneven", 0)]
-    min_cat = _cat_min_thickness(int(ctx.get("min_thickness_um", 400)))
-    bd["ОКТ: минимальная толщина"] = {">=400": 0, "300-399": 2, "200-299": 4, "<200": 6}[min_cat]
-    mean_cat = _cat_mean_thickness(int(ctx.get("mean_thickness_um", 600)))
-    bd["ОКТ: средняя толщина"] = {">=600": 0, "520-599": 1, "450-519": 2, "<450": 3}[mean_cat]
-    bd["ОКТ: прогрессирование истончения 48–72 ч"] = {0: 0, 1: 2}[ctx.get("thinning_progress_72h", 0)]
 
-    # Лимб (как в AUSS — 0/2)
-    bd["Вовлечение лимба"] = {0: 0, 1: 2}[ctx.get("limbal", 0)]
+@dataclass(frozen=True)
+class ScoreResult:
+    score: int
+    breakdown: Dict[str, int]
+    critical: bool
+
 
-    # Конфокальная микроскопия — только конфокальная
-    bd["Конфокальная: гифы"] = {0: 0, 1: 3, 2: 6, 3: 9}[ctx.get("hyphae", 0)]
-    bd["Конфокальная: глубина гиф/спор"] = {0: 0, 1: 2, 2: 4, 3: 6}[ctx.get("hyphae_depth", 0)]
+# ---------------------------------------------------------------------------
+# Декларативное описание шкал.
+# Критерий: поле анкеты, подпись в разложении и баллы по вариантам ответа
+# (порядок вариантов задаёт их целочисленный код — общий для всех шкал).
+# Шкала: порядок критериев в разложении, отличающиеся баллы и пороги тяжести.
+# Всё компилируется один раз при импорте в плоские таблицы (см. CompiledScale).
+# ---------------------------------------------------------------------------
 
-    # Скорость/прогноз (по клинике) — как было
-    bd["Скорость прогрессирования"] = {0: 0, 1: 2, 2: 4}[ctx.get("progress_speed", 0)]
-    bd["Прогноз интенсивности помутнения"] = {0: 0, 1: 1, 2: 2}[ctx.get("opacity", 0)]
+_REQUIRED = object()
 
-    score = int(sum(bd.values()))
-    critical = (min_cat == "<200") or (ctx.get("depth_cat") == "descemetocele")
-    return ScoreResult(score=score, breakdown=bd, critical=critical)
+SEVERITY_LEVELS: Tuple[str, ...] = ("Лёгкая", "Средняя", "Тяжёлая", "Крайне тяжёлая")
 
 
-def compute_auss(ctx: Dict[str, Any]) -> ScoreResult:
-    bd: Dict[str, int] = {}
+@dataclass(frozen=True)
+class Criterion:
+    key: str
+    label: str
+    points: Dict[Any, int]
+    default: Any = _REQUIRED
+    categorize: Optional[Callable[[Any], Any]] = None
 
-    bd["Болевой синдром"] = {0: 0, 2: 2, 4: 4}[ctx.get("pain", 0)]
-    bd["Перикорнеальная инъекция"] = {0: 0, 1: 1, 2: 2, 3: 3}[ctx.get("injection", 0)]
-    bd["Отделяемое"] = {0: 0, 1: 2}[ctx.get("discharge", 0)]
-    bd["Сателлитные инфильтраты/«перистые» края"] = {0: 0, 1: 2}[ctx.get("satellites", 0)]
+    @property
+    def options(self) -> Tuple[Any, ...]:
+        return tuple(self.points)
 
-    # Специфическая клиника AUSS
-    bd["Клиническая форма (AUSS)"] = {0: 0, 1: 1, 2: 2, 3: 3, 4: 4}[ctx.get("amoeba_form", 0)]
-    bd["Эпителиальный дефект/псевдодендрит"] = {0: 0, 1: 1}[ctx.get("pseudo_dendrite", 0)]
-    bd["Кольцевидный инфильтрат"] = {0: 0, 1: 3, 2: 6}[ctx.get("ring", 0)]
-    bd["Радиальный кератоневрит (клиника)"] = {0: 0, 1: 2}[ctx.get("rk_clin", 0)]
+    @property
+    def required(self) -> bool:
+        return self.default is _REQUIRED
 
-    bd["Размер дефекта"] = {"<=2": 0, "2-4": 1, "4-6": 2, ">6": 3}[ctx["size_cat"]]
-    bd["Локализация"] = {"peripheral": 0, "paracentral": 1, "central": 2}[ctx["localization"]]
-    bd["Признаки десцеметита"] = {0: 0, 1: 2}[ctx.get("descemetitis", 0)]
-    bd["Глубина"] = {"superficial": 0, "mid": 2, "deep": 4, "descemetocele": 6}[ctx["depth_cat"]]
 
-    bd["Гипопион"] = {"none": 0, "lt1": 1, "1to2": 2, "gt2": 3}[ctx.get("hypopyon", "none")]
-    bd["Тотальное бельмо"] = {0: 0, 1: 2}[ctx.get("total_leucoma", 0)]
+@dataclass(frozen=True)
+class ScaleSpec:
+    name: str
+    criteria: Tuple[str, ...]
+    # Верхние границы суммы для «Лёгкая», «Средняя», «Тяжёлая»
+    thresholds: Tuple[int, ...]
+    overrides: Dict[str, Dict[Any, int]] = field(default_factory=dict)
+    # Ответы, при которых тяжесть «Крайне тяжёлая» независимо от суммы
+    critical: Tuple[Tuple[str, Any], ...] = ()
+    # Отдельное поле общей анкеты для критерия этой шкалы (при расчёте нескольких
+    # шкал по одной анкете, см. scale_context/compute_scales)
+    fields: Dict[str, str] = field(default_factory=dict)
+    # Имя версии правил (см. SCALE_VERSIONS)
+    version: str = "1"
+
+
+CRITERIA: Dict[str, Criterion] = {c.key: c for c in (
+    # Общие клинические признаки (в начале — одинаково в обеих шкалах)
+    Criterion("pain", "Болевой синдром", {0: 0, 2: 2, 4: 4}, 0),
+    Criterion("injection", "Перикорнеальная инъекция", {0: 0, 1: 1, 2: 2, 3: 3}, 0),
+    Criterion("discharge", "Отделяемое", {0: 0, 1: 2}, 0),
+    Criterion("satellites", "Сателлитные инфильтраты/«перистые» края", {0: 0, 1: 2}, 0),
+
+    # Размер/локализация/глубина
+    Criterion("size_cat", "Размер дефекта", {"<=2": 0, "2-4": 1, "4-6": 2, ">6": 3}),
+    Criterion("localization", "Локализация", {"peripheral": 0, "paracentral": 1, "central": 2}),
+    Criterion("depth_cat", "Глубина", {"superficial": 0, "mid": 2, "deep": 4, "descemetocele": 6}),
 
-    # ЕДИНЫЙ вопрос по передней камере
+    # Воспаление/ПК/гипопион/отёк
+    Criterion("descemetitis", "Признаки десцеметита", {0: 0, 1: 2}, 0),
+    Criterion("hypopyon", "Гипопион", {"none": 0, "lt1": 1, "1to2": 2, "gt2": 3}, "none"),
+    Criterion("total_leucoma", "Тотальное бельмо", {0: 0, 1: 2}, 0),
+    # ЕДИНЫЙ вопрос по передней камере для обеих шкал.
     # Для AUSS «не просматривается» приравниваем к >20 клеток (2 балла), чтобы не ломать единый интерфейс.
-    ac = ctx.get("ac", "0")
-    ac_a = {"0": 0, "1-20": 1, ">20": 2, "not_visible": 2}[ac]
-    bd["Передняя камера"] = ac_a
+    Criterion("ac", "Передняя камера", {"0": 0, "1-20": 1, ">20": 2, "not_visible": 2}, "0"),
+    Criterion("edema", "Отёк роговицы", {0: 0, 1: 1, 2: 2}, 0),
+    Criterion("iog", "ВГД", {"normal": 0, "high": 1, "low": 1}, "normal"),
 
-    bd["Отёк роговицы"] = {0: 0, 1: 1, 2: 2}[ctx.get("edema", 0)]
-    bd["ОКТ: локальные зоны истончения"] = {0: 0, 1: 2}[ctx.get("pachy_uneven", 0)]
-    bd["ВГД"] = {"normal": 0, "high": 1, "low": 1}[ctx.get("iog", "normal")]
+    # ОКТ — только пахиметрия
+    Criterion("pachy_uneven", "ОКТ: локальные зоны истончения", {0: 0, 1: 2}, 0),
+    Criterion("min_thickness_um", "ОКТ: минимальная толщина",
+              {">=400": 0, "300-399": 2, "200-299": 4, "<200": 6}, 400, _cat_min_thickness_raw),
+    Criterion("mean_thickness_um", "ОКТ: средняя толщина",
+              {">=600": 0, "520-599": 1, "450-519": 2, "<450": 3}, 600, _cat_mean_thickness_raw),
+    Criterion("thinning_progress_72h", "ОКТ: прогрессирование истончения 48–72 ч", {0: 0, 1: 2}, 0),
 
-    min_cat = _cat_min_thickness(int(ctx.get("min_thickness_um", 400)))
-    bd["ОКТ: минимальная толщина"] = {">=400": 0, "300-399": 2, "200-299": 4, "<200": 6}[min_cat]
-    mean_cat = _cat_mean_thickness(int(ctx.get("mean_thickness_um", 600)))
-    bd["ОКТ: средняя толщина"] = {">=600": 0, "520-599": 1, "450-519": 2, "<450": 3}[mean_cat]
+    Criterion("limbal", "Вовлечение лимба", {0: 0, 1: 2}, 0),
 
-    bd["Вовлечение лимба"] = {0: 0, 1: 2}[ctx.get("limbal", 0)]
+    # Скорость/прогноз (по клинике) — как было
+    Criterion("progress_speed", "Скорость прогрессирования", {0: 0, 1: 2, 2: 4}, 0),
+    Criterion("opacity", "Прогноз интенсивности помутнения", {0: 0, 1: 1, 2: 2}, 0),
+
+    # FUSS: клиника и конфокальная микроскопия
+    Criterion("fungal_form", "Клиническая форма (грибковая)", {0: 0, 1: 1, 2: 2}, 0),
+    Criterion("hyphae", "Конфокальная: гифы", {0: 0, 1: 3, 2: 6, 3: 9}, 0),
+    Criterion("hyphae_depth", "Конфокальная: глубина гиф/спор", {0: 0, 1: 2, 2: 4, 3: 6}, 0),
+
+    # AUSS: специфическая клиника и конфокальная микроскопия
+    Criterion("amoeba_form", "Клиническая форма (AUSS)", {0: 0, 1: 1, 2: 2, 3: 3, 4: 4}, 0),
+    Criterion("pseudo_dendrite", "Эпителиальный дефект/псевдодендрит", {0: 0, 1: 1}, 0),
+    Criterion("ring", "Кольцевидный инфильтрат", {0: 0, 1: 3, 2: 6}, 0),
+    Criterion("rk_clin", "Радиальный кератоневрит (клиника)", {0: 0, 1: 2}, 0),
+    Criterion("cysts", "Конфокальная: цисты", {0: 0, 1: 4, 2: 8, 3: 12}, 0),
+    Criterion("troph", "Конфокальная: трофозоиты", {0: 0, 1: 2}, 0),
+    Criterion("amoeba_depth", "Конфокальная: глубина цист/трофозоитов", {0: 0, 1: 2, 2: 4, 3: 6}, 0),
+    Criterion("rk_conf", "Конфокальная: признаки кератоневрита", {0: 0, 1: 4}, 0),
+    Criterion("delay_therapy", "Длительность до специфической терапии", {0: 0, 1: 2, 2: 4}, 0),
+)}
+
+# Минимальная толщина <200 мкм или десцеметоцеле — крайне тяжёлое течение
+CRITICAL_RULE: Tuple[Tuple[str, Any], ...] = (("min_thickness_um", "<200"), ("depth_cat", "descemetocele"))
+
+SCALES: Dict[str, ScaleSpec] = {
+    "FUSS": ScaleSpec(
+        name="FUSS",
+        criteria=(
+            "pain", "injection", "discharge", "satellites",
+            "size_cat", "fungal_form", "localization", "depth_cat",
+            "descemetitis", "hypopyon", "total_leucoma", "ac", "edema", "iog",
+            "pachy_uneven", "min_thickness_um", "mean_thickness_um", "thinning_progress_72h",
+            "limbal", "hyphae", "hyphae_depth", "progress_speed", "opacity",
+        ),
+        thresholds=(16, 26, 36),
+        # Для FUSS «не просматривается» учитывается отдельно (4 балла)
+        overrides={"ac": {"0": 0, "1-20": 1, ">20": 2, "not_visible": 4}},
+        critical=CRITICAL_RULE,
+        fields={"progress_speed": "progress_speed_f"},
+    ),
+    "AUSS": ScaleSpec(
+        name="AUSS",
+        criteria=(
+            "pain", "injection", "discharge", "satellites",
+            "amoeba_form", "pseudo_dendrite", "ring", "rk_clin",
+            "size_cat", "localization", "descemetitis", "depth_cat",
+            "hypopyon", "total_leucoma", "ac", "edema", "pachy_uneven", "iog",
+            "min_thickness_um", "mean_thickness_um", "limbal",
+            "cysts", "troph", "amoeba_depth", "rk_conf",
+            "delay_therapy", "progress_speed", "opacity",
+        ),
+        thresholds=(18, 30, 42),
+        critical=CRITICAL_RULE,
+        fields={"progress_speed": "progress_speed_a"},
+    ),
+}
 
-    bd["Конфокальная: цисты"] = {0: 0, 1: 4, 2: 8, 3: 12}[ctx.get("cysts", 0)]
-    bd["Конфокальная: трофозоиты"] = {0: 0, 1: 2}[ctx.get("troph", 0)]
-    bd["Конфокальная: глубина цист/трофозоитов"] = {0: 0, 1: 2, 2: 4, 3: 6}[ctx.get("amoeba_depth", 0)]
-    bd["Конфокальная: признаки кератоневрита"] = {0: 0, 1: 4}[ctx.get("rk_conf", 0)]
 
-    bd["Длительность до специфической терапии"] = {0: 0, 1: 2, 2: 4}[ctx.get("delay_therapy", 0)]
-    bd["Скорость прогрессирования"] = {0: 0, 1: 2, 2: 4}[ctx.get("progress_speed", 0)]
-    bd["Прогноз интенсивности помутнения"] = {0: 0, 1: 1, 2: 2}[ctx.get("opacity", 0)]
+@dataclass(frozen=True)
+class CompiledScale:
+    name: str
+    keys: Tuple[str, ...]
+    labels: Tuple[str, ...]
+    # (поле, значение по умолчанию) для каждого критерия
+    fields: Tuple[Tuple[str, Any], ...]
+    # (позиция критерия, категоризация) для числовых полей
+    categorized: Tuple[Tuple[int, Callable[[Any], Any]], ...]
+    # вариант -> код и вариант -> баллы для каждого критерия
+    codes: Tuple[Dict[Any, int], ...]
+    lookups: Tuple[Dict[Any, int], ...]
+    # Баллы по коду варианта для каждого критерия
+    points: Tuple[Tuple[int, ...], ...]
+    thresholds: Tuple[int, ...]
+    # (позиция критерия, вариант ответа), дающие критичность
+    critical: Tuple[Tuple[int, Any], ...]
+    # (позиция критерия, поле общей анкеты для этой шкалы)
+    aliases: Tuple[Tuple[int, str], ...] = ()
+    version: str = "1"
+
+    @cached_property
+    def field_keys(self) -> Tuple[str, ...]:
+        return tuple(key for key, _ in self.fields)
+
+    @cached_property
+    def field_defaults(self) -> Tuple[Any, ...]:
+        return tuple(default for _, default in self.fields)
+
+    @cached_property
+    def critical_codes(self) -> Tuple[Tuple[int, int], ...]:
+        return tuple((i, self.codes[i][opt]) for i, opt in self.critical)
+
+
+def compile_scale(spec: ScaleSpec) -> CompiledScale:
+    codes = []
+    points = []
+    for key in spec.criteria:
+        crit = CRITERIA[key]
+        pts = spec.overrides.get(key, crit.points)
+        if tuple(pts) != crit.options:
+            raise ValueError(f"{spec.name}: варианты критерия {key!r} не совпадают с общим описанием")
+        codes.append({opt: i for i, opt in enumerate(crit.options)})
+        points.append(tuple(int(p) for p in pts.values()))
+    criteria = [CRITERIA[key] for key in spec.criteria]
+    return CompiledScale(
+        name=spec.name,
+        keys=tuple(spec.criteria),
+        labels=tuple(c.label for c in criteria),
+        fields=tuple((c.key, c.default) for c in criteria),
+        categorized=tuple((i, c.categorize) for i, c in enumerate(criteria) if c.categorize is not None),
+        codes=tuple(codes),
+        lookups=tuple(dict(zip(c.options, p)) for c, p in zip(criteria, points)),
+        points=tuple(points),
+        thresholds=tuple(spec.thresholds),
+        critical=tuple((spec.criteria.index(key), opt) for key, opt in spec.critical),
+        aliases=tuple((spec.criteria.index(key), name) for key, name in spec.fields.items()),
+        version=spec.version,
+    )
 
-    score = int(sum(bd.values()))
-    critical = (min_cat == "<200") or (ctx.get("depth_cat") == "descemetocele")
-    return ScoreResult(score=score, breakdown=bd, critical=critical)
 
+_COMPILED: Dict[str, CompiledScale] = {name: compile_scale(spec) for name, spec in SCALES.items()}
+
+# ---------------------------------------------------------------------------
+# Версии правил. Действующая версия каждой шкалы — описание в SCALES; прежние
+# (для точного воспроизведения старых расчётов) и предлагаемые версии
+# добавляются register_version или load_versions (JSON). Коды вариантов общие
+# для всех версий (порядок вариантов задаёт CRITERIA), поэтому анкета,
+# разобранная один раз, считается по любой версии.
+# ---------------------------------------------------------------------------
+
+SCALE_VERSIONS: Dict[str, Dict[str, ScaleSpec]] = {name: {spec.version: spec} for name, spec in SCALES.items()}
+_VERSIONS: Dict[Tuple[str, str], CompiledScale] = {(name, c.version): c for name, c in _COMPILED.items()}
+
+
+def get_scale(scale: str, version: Optional[str] = None) -> CompiledScale:
+    if version is None:
+        return _COMPILED[scale]
+    try:
+        return _VERSIONS[(scale, version)]
+    except KeyError:
+        known = ", ".join(SCALE_VERSIONS.get(scale, ())) or "нет"
+        raise ValueError(f"Нет версии {version!r} шкалы {scale} (описаны: {known})") from None
+
+
+def scale_versions(scale: str) -> Tuple[str, ...]:
+    return tuple(SCALE_VERSIONS[scale])
+
+
+def register_version(spec: ScaleSpec) -> CompiledScale:
+    if spec.name not in SCALES:
+        raise ValueError(f"Неизвестная шкала: {spec.name}")
+    compiled = compile_scale(spec)
+    known = _VERSIONS.get((spec.name, spec.version))
+    if known is not None:
+        if known != compiled:
+            raise ValueError(f"{spec.name}: версия {spec.version!r} уже описана с другими правилами")
+        return known
+    SCALE_VERSIONS[spec.name][spec.version] = spec
+    _VERSIONS[(spec.name, spec.version)] = compiled
+    return compiled
+
+
+def parse_option(key: str, raw: Any) -> Any:
+    # Варианты в JSON — строки ("1", ">=400"); сопоставляются с вариантами критерия
+    for opt in CRITERIA[key].options:
+        if opt == raw or str(opt) == str(raw):
+            return opt
+    raise ValueError(f"Неизвестный вариант {raw!r} критерия {key!r}")
+
+
+def version_from_json(obj: Dict[str, Any]) -> ScaleSpec:
+    # {"scale": "FUSS", "version": "2", "base": "1",
+    #  "points": {"ac": {"not_visible": 2}}, "thresholds": [16, 26, 36],
+    #  "criteria": [...], "critical": [["depth_cat", "descemetocele"]]}
+    # Баллы задаются частично — поверх версии base (по умолчанию действующей)
+    from dataclasses import replace
+
+    scale = str(obj.get("scale") or "")
+    if scale not in SCALES:
+        raise ValueError(f"Неизвестная шкала: {scale or '?'}")
+    if not obj.get("version"):
+        raise ValueError(f"{scale}: не указано имя версии")
+    base = SCALE_VERSIONS[scale].get(str(obj.get("base") or SCALES[scale].version))
+    if base is None:
+        raise ValueError(f"{scale}: нет базовой версии {obj.get('base')!r}")
+    overrides = dict(base.overrides)
+    for key, opts in (obj.get("points") or {}).items():
+        if key not in CRITERIA:
+            raise ValueError(f"Неизвестный критерий: {key!r}")
+        points = dict(overrides.get(key, CRITERIA[key].points))
+        points.update({parse_option(key, opt): int(p) for opt, p in opts.items()})
+        overrides[key] = points
+    changes: Dict[str, Any] = {"version": str(obj["version"]), "overrides": overrides}
+    if "thresholds" in obj:
+        changes["thresholds"] = tuple(int(t) for t in obj["thresholds"])
+    if "criteria" in obj:
+        changes["criteria"] = tuple(obj["criteria"])
+    if "critical" in obj:
+        changes["critical"] = tuple((key, parse_option(key, opt)) for key, opt in obj["critical"])
+    spec = replace(base, **changes)
+    unknown = [key for key in spec.criteria if key not in CRITERIA]
+    if unknown:
+        raise ValueError(f"Неизвестный критерий: {unknown[0]!r}")
+    missing = [key for key, _ in spec.critical if key not in spec.criteria]
+    if missing:
+        raise ValueError(f"{scale}: критерий критичности {missing[0]!r} не входит в шкалу")
+    spec = replace(spec, fields={key: name for key, name in spec.fields.items() if key in spec.criteria})
+    if len(spec.thresholds) != len(SEVERITY_LEVELS) - 1 or list(spec.thresholds) != sorted(spec.thresholds):
+        raise ValueError(f"{scale}: нужны {len(SEVERITY_LEVELS) - 1} возрастающие границы тяжести")
+    return spec
+
+
+def load_versions(path: str) -> List[CompiledScale]:
+    # JSON: описание версии или список описаний (см. version_from_json)
+    import json
+
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return [register_version(version_from_json(obj)) for obj in (data if isinstance(data, list) else [data])]
+
+
+def encode_context(scale: CompiledScale, ctx: Dict[str, Any]) -> List[int]:
+    # Покритериальное кодирование: ошибки возникают в том же порядке и с теми же
+    # ключами, что и в исходной реализации со словарями-литералами
+    out = []
+    cats = dict(scale.categorized)
+    for i, (key, default) in enumerate(scale.fields):
+        value = ctx[key] if default is _REQUIRED else ctx.get(key, default)
+        if i in cats:
+            value = cats[i](value)
+        out.append(scale.codes[i][value])
+    return out
+
+
+def _lookup(compiled: CompiledScale, ctx: Dict[str, Any], tables: Tuple[Dict[Any, int], ...]) -> Tuple[List[Any], List[int]]:
+    values = list(map(ctx.get, compiled.field_keys, compiled.field_defaults))
+    try:
+        for i, categorize in compiled.categorized:
+            values[i] = categorize(values[i])
+        return values, list(map(dict.__getitem__, tables, values))
+    except (KeyError, TypeError, ValueError):
+        encode_context(compiled, ctx)
+        raise
+
+
+def canonical_codes(scale: str, ctx: Dict[str, Any], version: Optional[str] = None) -> Tuple[int, ...]:
+    # Канонический вид анкеты: коды категорий в порядке критериев шкалы
+    compiled = _COMPILED[scale] if version is None else get_scale(scale, version)
+    return tuple(_lookup(compiled, ctx, compiled.codes)[1])
+
+
+def total_encoded(compiled: CompiledScale, codes: Sequence[int]) -> Tuple[int, bool]:
+    # Сумма и критичность без разложения (records, timeline)
+    score = sum(map(getitem, compiled.points, codes))
+    return score, any(codes[i] == c for i, c in compiled.critical_codes)
+
+
+def score_encoded(compiled: CompiledScale, codes: Sequence[int], frozen: bool = False) -> ScoreResult:
+    # frozen — разложение только для чтения (результат будет общим, см. cache)
+    pts = list(map(getitem, compiled.points, codes))
+    critical = any(codes[i] == c for i, c in compiled.critical_codes)
+    breakdown = (FrozenBreakdown if frozen else dict)(zip(compiled.labels, pts))
+    return ScoreResult(score=sum(pts), breakdown=breakdown, critical=critical)
+
+
+def compute_scale(scale: str, ctx: Dict[str, Any], version: Optional[str] = None, frozen: bool = False) -> ScoreResult:
+    compiled = _COMPILED[scale] if version is None else get_scale(scale, version)
+    values, pts = _lookup(compiled, ctx, compiled.lookups)
+    critical = False
+    for i, opt in compiled.critical:
+        if values[i] == opt:
+            critical = True
+            break
+    breakdown = (FrozenBreakdown if frozen else dict)(zip(compiled.labels, pts))
+    return ScoreResult(score=sum(pts), breakdown=breakdown, critical=critical)
+
+
+def scale_context(ctx: Dict[str, Any], scale: str) -> Dict[str, Any]:
+    # Анкета одной шкалы из общей: поля вида progress_speed_f заменяют общие
+    compiled = _COMPILED.get(scale)
+    if compiled is None:
+        return ctx
+    out = ctx
+    for i, name in compiled.aliases:
+        if name in ctx:
+            if out is ctx:
+                out = dict(ctx)
+            out[compiled.keys[i]] = ctx[name]
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Несколько шкал по одной анкете (режим «этиология неизвестна»).
+# Поля анкеты всех шкал объединяются в общий список; общие критерии читаются и
+# категоризуются один раз, затем каждая шкала берёт свои позиции и баллы.
+# Критерий с отдельным полем для шкалы (ScaleSpec.fields) занимает свою позицию.
+# ---------------------------------------------------------------------------
 
-def severity_from_score(score: int, scale: str, critical: bool = False) -> str:
-    if critical:
-        return "Крайне тяжёлая"
-    if scale == "FUSS":
-        if score <= 16:
-            return "Лёгкая"
-        if score <= 26:
-            return "Средняя"
-        if score <= 36:
-            return "Тяжёлая"
-        return "Крайне тяжёлая"
-    # AUSS
-    if score <= 18:
-        return "Лёгкая"
-    if score <= 30:
-        return "Средняя"
-    if score <= 42:
-        return "Тяжёлая"
-    return "Крайне тяжёлая"
+@dataclass(frozen=True)
+class CompiledGroup:
+    scales: Tuple[CompiledScale, ...]
+    # Общие поля идут первыми: (поле, по умолчанию); за ними — отдельные поля шкал
+    # (поле общей анкеты, поле критерия, по умолчанию)
+    shared: Tuple[Tuple[str, Any], ...]
+    own: Tuple[Tuple[str, str, Any], ...]
+    categorized: Tuple[Tuple[int, Callable[[Any], Any]], ...]
+    # Значения критериев всех шкал подряд (по позициям в списке полей) и таблицы
+    # для них — одна выборка на все шкалы; bounds — срез каждой шкалы
+    positions: Tuple[int, ...]
+    picker: Callable[[Sequence[Any]], Tuple[Any, ...]]
+    codes: Tuple[Dict[Any, int], ...]
+    lookups: Tuple[Dict[Any, int], ...]
+    bounds: Tuple[Tuple[int, int], ...]
+
+
+def compile_group(names: Sequence[str]) -> CompiledGroup:
+    return _compile_group(tuple(_COMPILED[name] for name in names))
+
+
+def _compile_group(scales: Tuple[CompiledScale, ...]) -> CompiledGroup:
+    from operator import itemgetter
+
+    shared: Dict[str, Any] = {}
+    own: Dict[Tuple[str, str], Any] = {}
+    cats: Dict[Tuple[Optional[str], str], Callable[[Any], Any]] = {}
+    for compiled in scales:
+        aliases = dict(compiled.aliases)
+        for i, (key, default) in enumerate(compiled.fields):
+            if i in aliases:
+                own[(aliases[i], key)] = default
+            else:
+                shared[key] = default
+        for i, categorize in compiled.categorized:
+            cats[(aliases.get(i), compiled.keys[i])] = categorize
+    slots = {(None, key): n for n, key in enumerate(shared)}
+    slots.update({slot: len(shared) + n for n, slot in enumerate(own)})
+    positions: List[int] = []
+    bounds = []
+    for compiled in scales:
+        aliases = dict(compiled.aliases)
+        bounds.append((len(positions), len(positions) + len(compiled.keys)))
+        positions += [slots[(aliases.get(i), key)] for i, key in enumerate(compiled.keys)]
+    return CompiledGroup(
+        scales=scales,
+        shared=tuple(shared.items()),
+        own=tuple((alias, key, default) for (alias, key), default in own.items()),
+        categorized=tuple((slots[slot], fn) for slot, fn in cats.items()),
+        positions=tuple(positions),
+        picker=itemgetter(*positions),
+        codes=tuple(t for compiled in scales for t in compiled.codes),
+        lookups=tuple(t for compiled in scales for t in compiled.lookups),
+        bounds=tuple(bounds),
+    )
 
 
-def choose_debridement(ctx: Dict[str, Any]) -> str:
+@lru_cache(maxsize=64)
+def get_group(names: Tuple[str, ...]) -> CompiledGroup:
+    return compile_group(names)
+
+
+@lru_cache(maxsize=64)
+def get_version_group(scale: str, versions: Tuple[str, ...]) -> CompiledGroup:
+    # Несколько версий одной шкалы — как несколько шкал: поля читаются один раз.
+    # Описание версии с данным именем не меняется (register_version), поэтому кэш не устаревает
+    return _compile_group(tuple(get_scale(scale, version) for version in versions))
+
+
+class _Invalid:
+    # Значение поля, которое не удалось категоризовать (ошибка — у шкал, где оно нужно)
+    __slots__ = ()
+
+
+_INVALID = _Invalid()
+
+
+def _lookup_group(group: CompiledGroup, ctx: Dict[str, Any], attr: str) -> Tuple[Tuple[Any, ...], List[Any], List[Any]]:
+    # -> (значения критериев всех шкал, выборки из таблиц attr, ошибки по шкалам или None);
+    # текст ошибки — как при расчёте шкалы отдельно (scale_context + _lookup)
+    get = ctx.get
+    values = [get(key, default) for key, default in group.shared]
+    for alias, key, default in group.own:
+        values.append(ctx[alias] if alias in ctx else get(key, default))
+    for i, categorize in group.categorized:
+        try:
+            values[i] = categorize(values[i])
+        except (TypeError, ValueError):
+            values[i] = _INVALID
+    picked = group.picker(values)
+    tables = getattr(group, attr)
+    errors: List[Any] = [None] * len(group.scales)
+    try:
+        return picked, list(map(dict.__getitem__, tables, picked)), errors
+    except (KeyError, TypeError):
+        pass
+    # Ошибка в анкете: какие шкалы затронуты
+    out: List[Any] = []
+    for n, (compiled, (a, b)) in enumerate(zip(group.scales, group.bounds)):
+        try:
+            out += list(map(dict.__getitem__, tables[a:b], picked[a:b]))
+        except (KeyError, TypeError):
+            try:
+                _lookup(compiled, scale_context(ctx, compiled.name), getattr(compiled, attr))
+            except (KeyError, TypeError, ValueError) as e:
+                errors[n] = e
+            else:
+                raise
+            out += [0] * (b - a)
+    return picked, out, errors
+
+
+def canonical_codes_many(scales: Sequence[str], ctx: Dict[str, Any]) -> List[Any]:
+    # canonical_codes(шкала, scale_context(ctx, шкала)) для каждой шкалы — или исключение
+    group = get_group(tuple(scales))
+    _, codes, errors = _lookup_group(group, ctx, "codes")
+    return [e if e is not None else tuple(codes[a:b]) for e, (a, b) in zip(errors, group.bounds)]
+
+
+def compute_scales(ctx: Dict[str, Any], scales: Sequence[str] = ("FUSS", "AUSS")) -> Dict[str, ScoreResult]:
+    # Все шкалы по одной анкете; ошибка первой шкалы, которую не удалось рассчитать
+    group = get_group(tuple(scales))
+    return {compiled.name: res for compiled, res in zip(group.scales, _group_results(group, ctx))}
+
+
+def compute_scales_many(scales: Sequence[str], ctx: Dict[str, Any], frozen: bool = False) -> List[Any]:
+    # compute_scale(шкала, scale_context(ctx, шкала)) для каждой шкалы — или исключение
+    return _group_results(get_group(tuple(scales)), ctx, frozen, strict=False)
+
+
+def compute_versions(scale: str, ctx: Dict[str, Any], versions: Optional[Sequence[str]] = None) -> Dict[str, ScoreResult]:
+    # Версия -> результат по одной анкете (по умолчанию — все описанные версии);
+    # анкета разбирается один раз на все версии
+    group = get_version_group(scale, tuple(versions or SCALE_VERSIONS[scale]))
+    return {compiled.version: res for compiled, res in zip(group.scales, _group_results(group, ctx))}
+
+
+def _group_results(group: CompiledGroup, ctx: Dict[str, Any], frozen: bool = False, strict: bool = True) -> List[Any]:
+    # strict — ошибка шкалы выбрасывается, иначе стоит на месте её результата
+    values, pts, errors = _lookup_group(group, ctx, "lookups")
+    out: List[Any] = []
+    for compiled, (a, b), error in zip(group.scales, group.bounds, errors):
+        if error is not None:
+            if strict:
+                raise error
+            out.append(error)
+            continue
+        own = pts[a:b]
+        critical = False
+        for i, opt in compiled.critical:
+            if values[a + i] == opt:
+                critical = True
+                break
+        breakdown = (FrozenBreakdown if frozen else dict)(zip(compiled.labels, own))
+        out.append(ScoreResult(score=sum(own), breakdown=breakdown, critical=critical))
+    return out
+
+
+def spec_fingerprint() -> str:
+    # Отпечаток действующих правил: меняется при любой правке баллов, порогов или подписей
+    import hashlib
+
+    payload = repr([
+        (c.name, c.labels, [tuple(t) for t in c.codes], c.points, c.thresholds, c.critical)
+        for c in _COMPILED.values()
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def scale_fingerprint(scale: str, version: Optional[str] = None) -> str:
+    # Отпечаток правил одной шкалы (версия шкалы в журнале аудита)
+    import hashlib
+
+    c = get_scale(scale, version)
+    payload = repr((c.name, c.labels, [tuple(t) for t in c.codes], c.points, c.thresholds, c.critical))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def compute_fuss(ctx: Dict[str, Any], version: Optional[str] = None) -> ScoreResult:
+    return compute_scale("FUSS", ctx, version)
+
+
+def compute_auss(ctx: Dict[str, Any], version: Optional[str] = None) -> ScoreResult:
+    return compute_scale("AUSS", ctx, version)
+
+
+def severity_from_score(score: int, scale: str, critical: bool = False, version: Optional[str] = None) -> str:
+    if critical:
+        return SEVERITY_LEVELS[-1]
+    # Любая шкала без собственного описания оценивается по порогам AUSS
+    if version is not None:
+        compiled = get_scale(scale, version)
+    else:
+        compiled = _COMPILED.get(scale) or _COMPILED["AUSS"]
+    for level, upper in zip(SEVERITY_LEVELS, compiled.thresholds):
+        if score <= upper:
+            return level
+    return SEVERITY_LEVELS[-1]
+
+
+def debridement_inputs(ctx: Dict[str, Any]) -> Tuple[bool, str, int, int]:
     min_um = int(ctx.get("min_thickness_um", 0))
     mean_um = int(ctx.get("mean_thickness_um", 0))
     pachy_uneven = int(ctx.get("pachy_uneven", 0))
@@ -179,6 +658,11 @@ def choose_debridement(ctx: Dict[str, Any]) -> str:
     edema = int(ctx.get("edema", 0))
 
     thickness_ok = (min_um >= 400) and (mean_um >= 600) and (pachy_uneven == 0)
+    return thickness_ok, localization, total_leucoma, edema
+
+
+def choose_debridement(ctx: Dict[str, Any]) -> str:
+    thickness_ok, localization, total_leucoma, edema = debridement_inputs(ctx)
     femto_prefer = thickness_ok and (localization in ["paracentral", "central"] or total_leucoma == 1 or edema == 2)
     if femto_prefer:
         return "УФ-кросслинкинг с формированием и удалением роговичного лоскута с использованием фемтосекундного лазера"
@@ -219,43 +703,65 @@ def recommend_treatment(scale: str, severity: str, score: int, ctx: Dict[str, An
     )
 
 
-def format_report_docx_web(scale: str, score: int, severity: str, recommendation: str, breakdown: Dict[str, int] | None = None):
-    doc = Document()
-    doc.add_heading("Протокол расчёта AUSS/FUSS", level=1)
-    doc.add_paragraph(f"Шкала: {scale}")
-    doc.add_paragraph(f"Сумма баллов: {score}")
-    doc.add_paragraph(f"Степень тяжести: {severity}")
-    doc.add_heading("Рекомендации", level=2)
-    doc.add_paragraph(recommendation)
+def report_blocks_web(scale: str, score: int, severity: str, recommendation: str, breakdown: Dict[str, int] | None = None) -> List[Block]:
+    blocks: List[Block] = [
+        (1, "Протокол расчёта AUSS/FUSS"),
+        (None, f"Шкала: {scale}"),
+        (None, f"Сумма баллов: {score}"),
+        (None, f"Степень тяжести: {severity}"),
+        (2, "Рекомендации"),
+        (None, recommendation),
+    ]
     if breakdown:
-        doc.add_heading("Разложение баллов", level=2)
-        for k, v in breakdown.items():
-            doc.add_paragraph(f"{k}: {v}")
-    bio = BytesIO()
-    doc.save(bio)
-    bio.seek(0)
-    filename = f"{scale}_{date.today().isoformat()}.docx"
-    return bio.getvalue(), filename
+        blocks.append((2, "Разложение баллов"))
+        blocks.extend((None, f"{k}: {v}") for k, v in breakdown.items())
+    return blocks
 
 
-def format_report_docx_local(patient_name: str, patient_id: str, scale: str, score: int, severity: str, recommendation: str, breakdown: Dict[str, int] | None = None):
-    doc = Document()
-    doc.add_heading("Протокол расчёта AUSS/FUSS", level=1)
-    doc.add_paragraph(f"Данные пациента: {patient_name}".strip())
+def report_blocks_local(patient_name: str, patient_id: str, scale: str, score: int, severity: str, recommendation: str, breakdown: Dict[str, int] | None = None) -> List[Block]:
+    blocks = report_blocks_web(scale, score, severity, recommendation, breakdown)
+    patient: List[Block] = [(None, f"Данные пациента: {patient_name}".strip())]
     if patient_id:
-        doc.add_paragraph(f"ID/№карты: {patient_id}".strip())
-    doc.add_paragraph(f"Шкала: {scale}")
-    doc.add_paragraph(f"Сумма баллов: {score}")
-    doc.add_paragraph(f"Степень тяжести: {severity}")
-    doc.add_heading("Рекомендации", level=2)
-    doc.add_paragraph(recommendation)
-    if breakdown:
-        doc.add_heading("Разложение баллов", level=2)
-        for k, v in breakdown.items():
-            doc.add_paragraph(f"{k}: {v}")
-    bio = BytesIO()
-    doc.save(bio)
-    bio.seek(0)
-    safe = (patient_id or patient_name or "patient").replace(" ", "_")
-    filename = f"{scale}_{safe}_{date.today().isoformat()}.docx"
-    return bio.getvalue(), filename
+        patient.append((None, f"ID/№карты: {patient_id}".strip()))
+    return blocks[:1] + patient + blocks[1:]
+
+
+def report_filename_web(scale: str) -> str:
+    return f"{scale}_{date.today().isoformat()}.docx"
+
+
+def safe_filename_part(text: str) -> str:
+    # Часть имени файла из данных пациента: только буквы, цифры, «_», «-», «.»
+    # (без разделителей каталогов и ведущих точек — имя годится для zip и каталога)
+    import re
+
+    return re.sub(r"[^\w.-]", "_", text).lstrip(".") or "patient"
+
+
+def report_filename_local(patient_name: str, patient_id: str, scale: str) -> str:
+    safe = safe_filename_part(patient_id or patient_name or "patient")
+    return f"{scale}_{safe}_{date.today().isoformat()}.docx"
+
+
+# Сборка DOCX подключается только при формировании протокола:
+# для расчёта баллов модуль импортируется без неё
+def format_report_docx_web(scale: str, score: int, severity: str, recommendation: str, breakdown: Dict[str, int] | None = None):
+    from docx_template import render_blocks
+
+    data = render_blocks(report_blocks_web(scale, score, severity, recommendation, breakdown))
+    return data, report_filename_web(scale)
+
+
+def format_report_docx_local(patient_name: str, patient_id: str, scale: str, score: int, severity: str, recommendation: str, breakdown: Dict[str, int] | None = None):
+    from docx_template import render_blocks
+
+    data = render_blocks(report_blocks_local(patient_name, patient_id, scale, score, severity, recommendation, breakdown))
+    return data, report_filename_local(patient_name, patient_id, scale)
+
+
+# Замеры этапов (metrics.py) включаются переменными окружения AUSSFUSS_METRICS/AUSSFUSS_PROFILE;
+# без них модуль замеров не загружается
+if _os.environ.get("AUSSFUSS_METRICS") or _os.environ.get("AUSSFUSS_PROFILE"):
+    import metrics as _metrics
+
+    _metrics.enable_from_env()
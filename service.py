@@ -0,0 +1,417 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import metrics
+from cache import ScoringCache
+from scoring import (
+    SCALES,
+    SEVERITY_LEVELS,
+    format_report_docx_local,
+    format_report_docx_web,
+    recommend_treatment,
+    severity_from_score,
+)
+
+
+# Локальный JSON-сервис расчёта для интеграции с МИС (только стандартная библиотека).
+#
+#   GET  /health
+#   GET  /metrics            показатели в формате Prometheus (этапы — при AUSSFUSS_METRICS=1)
+#   POST /v1/score           {"scale": "FUSS", "ctx": {...}} или {"scale": ..., "items": [{...}, ...]};
+#                            "breakdown": true — добавить разложение баллов
+#   POST /v1/fuss, /v1/auss  то же с фиксированной шкалой
+#   POST /v1/severity        {"scale", "score", "critical"}
+#   POST /v1/recommendation  {"scale", "severity", "score", "ctx", "critical"}
+#   POST /v1/report          DOCX: {"scale", "ctx"} или готовые {"scale", "score", "severity",
+#                            "recommendation"}; + "breakdown", "patient_name", "patient_id"
+#
+# Одиночные запросы на расчёт, пришедшие одновременно, собираются в пачку
+# (всё, что готово за один проход цикла событий, плюс до max_delay секунд
+# ожидания; не больше max_batch анкет) и считаются одним вызовом;
+# пачки от VECTOR_MIN анкет с одинаковым набором полей идут через
+# векторизованный путь (score_table + batch). Соединения keep-alive,
+# HTTP/1.1 без chunked-тела.
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+VECTOR_MIN = 64
+_MAX_BODY = 16 * 1024 * 1024
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class ServiceStats:
+    requests: int = 0
+    errors: int = 0
+    scored: int = 0
+    batches: int = 0
+    vectorized: int = 0
+    started: float = field(default_factory=time.time)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "scored": self.scored,
+            "batches": self.batches,
+            "vectorized": self.vectorized,
+            "uptime_s": round(time.time() - self.started, 1),
+        }
+
+
+def _error_json(e: Exception) -> Dict[str, Any]:
+    if isinstance(e, KeyError):
+        return {"error": f"Недопустимое или отсутствующее значение: {e.args[0]!r}"}
+    return {"error": str(e)}
+
+
+class Scorer:
+    # Расчёт пачки анкет одной шкалы -> JSON-ответ по каждой анкете
+    # (ошибка в одной анкете не влияет на остальные)
+    def __init__(self, cache: Optional[ScoringCache] = None):
+        self.cache = cache if cache is not None else ScoringCache()
+        self._table: Any = None
+
+    def _vectorized(self, scale: str, items: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        keys = set(items[0])
+        if any(set(ctx) != keys for ctx in items):
+            return None
+        try:
+            import numpy as np
+
+            from score_table import default_table
+        except ImportError:  # pragma: no cover - numpy необязателен
+            return None
+        if self._table is None:
+            self._table = default_table()
+        try:
+            # size_mm покомпонентный расчёт не принимает (только size_cat) — и здесь не используется
+            cols = {key: np.asarray([ctx[key] for ctx in items]) for key in keys if key != "size_mm"}
+            result, recs = self._table.score_cohort(cols, scale)
+        except (KeyError, TypeError, ValueError, OverflowError):
+            return None  # ошибки по отдельным анкетам разберёт покомпонентный путь
+        texts = self._table.recommendations
+        return [
+            {"score": score, "critical": critical, "severity": SEVERITY_LEVELS[sev], "recommendation": texts[rec]}
+            for score, critical, sev, rec in zip(
+                result.score.tolist(), result.critical.tolist(), result.severity.tolist(), recs.tolist())
+        ]
+
+    def evaluate_many(self, scale: str, items: List[Dict[str, Any]], breakdown: bool = False) -> Tuple[List[Dict[str, Any]], bool]:
+        # -> (ответы, был ли векторизованный путь)
+        if scale not in SCALES:
+            return [{"error": f"Неизвестная шкала: {scale!r}"}] * len(items), False
+        if len(items) >= VECTOR_MIN and not breakdown:
+            fast = self._vectorized(scale, items)
+            if fast is not None:
+                return fast, True
+        out: List[Dict[str, Any]] = []
+        for ctx in items:
+            try:
+                res, sev, rec = self.cache.evaluate(scale, ctx)
+            except (KeyError, TypeError, ValueError, AttributeError, OverflowError) as e:
+                out.append(_error_json(e))
+                continue
+            item = {"score": res.score, "critical": res.critical, "severity": sev, "recommendation": rec}
+            if breakdown:
+                item["breakdown"] = res.breakdown
+            out.append(item)
+        return out, False
+
+
+class MicroBatcher:
+    # Очередь одиночных расчётов: первый запрос открывает окно max_delay,
+    # всё, что успело прийти (до max_batch), считается одним вызовом
+    def __init__(self, scorer: Scorer, stats: ServiceStats, max_batch: int = 256, max_delay: float = 0.0):
+        self.scorer = scorer
+        self.stats = stats
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self._queue: "asyncio.Queue[Tuple[str, Dict[str, Any], bool, asyncio.Future]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, scale: str, ctx: Dict[str, Any], breakdown: bool = False) -> Dict[str, Any]:
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((scale, ctx, breakdown, fut))
+        return await fut
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            # Один проход цикла событий: соединения с уже прочитанными запросами
+            # успевают встать в очередь
+            await asyncio.sleep(0)
+            deadline = loop.time() + self.max_delay
+            while len(pending) < self.max_batch:
+                if not self._queue.empty():
+                    pending.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self._dispatch(pending)
+
+    def _dispatch(self, pending: List[Tuple[str, Dict[str, Any], bool, asyncio.Future]]) -> None:
+        groups: Dict[Tuple[str, bool], List[int]] = {}
+        for i, (scale, _, breakdown, _) in enumerate(pending):
+            groups.setdefault((scale, breakdown), []).append(i)
+        self.stats.batches += 1
+        for (scale, breakdown), idx in groups.items():
+            try:
+                results, vectorized = self.scorer.evaluate_many(scale, [pending[i][1] for i in idx], breakdown)
+            except Exception as e:  # непредвиденная ошибка не должна останавливать очередь
+                results, vectorized = [{"error": f"{type(e).__name__}: {e}"}] * len(idx), False
+            self.stats.vectorized += len(idx) if vectorized else 0
+            for i, res in zip(idx, results):
+                fut = pending[i][3]
+                if not fut.done():
+                    fut.set_result(res)
+
+
+class ScoringService:
+    def __init__(self, cache: Optional[ScoringCache] = None, max_batch: int = 256, max_delay: float = 0.0):
+        self.stats = ServiceStats()
+        self.scorer = Scorer(cache)
+        self.batcher: Optional[MicroBatcher] = None
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    # --- обработчики ------------------------------------------------------------
+
+    async def handle(self, method: str, path: str, body: bytes) -> Tuple[int, str, bytes, Dict[str, str]]:
+        # -> (статус, Content-Type, тело, доп. заголовки)
+        if path == "/health":
+            if method != "GET":
+                raise HttpError(405, "Только GET")
+            return self._json(200, {"status": "ok", **self.stats.as_dict()})
+        if path == "/metrics":
+            if method != "GET":
+                raise HttpError(405, "Только GET")
+            text = metrics.prometheus_text({f"service_{k}": v for k, v in self.stats.as_dict().items()})
+            return 200, "text/plain; version=0.0.4; charset=utf-8", text.encode("utf-8"), {}
+        if method != "POST":
+            raise HttpError(405 if path.startswith("/v1/") else 404, "Ожидается POST")
+        payload = _parse_json(body)
+        if path in ("/v1/score", "/v1/fuss", "/v1/auss"):
+            scale = {"/v1/fuss": "FUSS", "/v1/auss": "AUSS"}.get(path) or payload.get("scale")
+            return self._json(200, await self._score(scale, payload))
+        if path == "/v1/severity":
+            return self._json(200, {"severity": severity_from_score(
+                _int(payload, "score"), str(payload.get("scale", "")), bool(payload.get("critical", False)))})
+        if path == "/v1/recommendation":
+            ctx = _ctx(payload)
+            try:
+                rec = recommend_treatment(str(payload.get("scale", "")), str(payload.get("severity", "")),
+                                          _int(payload, "score"), ctx, bool(payload.get("critical", False)))
+            except (KeyError, TypeError, ValueError) as e:
+                raise HttpError(400, _error_json(e)["error"]) from None
+            return self._json(200, {"recommendation": rec})
+        if path == "/v1/report":
+            return await self._report(payload)
+        raise HttpError(404, f"Нет такого адреса: {path}")
+
+    async def _score(self, scale: Any, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if not isinstance(scale, str):
+            raise HttpError(400, "Не указана шкала (scale)")
+        breakdown = bool(payload.get("breakdown", False))
+        if "items" in payload:
+            items = payload["items"]
+            if not isinstance(items, list) or not all(isinstance(ctx, dict) for ctx in items):
+                raise HttpError(400, "items должен быть списком анкет")
+            results, vectorized = self.scorer.evaluate_many(scale, items, breakdown)
+            self.stats.scored += len(items)
+            self.stats.vectorized += len(items) if vectorized else 0
+            return {"scale": scale, "results": results}
+        ctx = _ctx(payload)
+        result = await self.batcher.submit(scale, ctx, breakdown)
+        self.stats.scored += 1
+        if "error" in result:
+            raise HttpError(400, result["error"])
+        return dict(result, scale=scale)
+
+    async def _report(self, payload: Dict[str, Any]) -> Tuple[int, str, bytes, Dict[str, str]]:
+        scale = payload.get("scale")
+        if scale not in SCALES:
+            raise HttpError(400, f"Неизвестная шкала: {scale!r}")
+        breakdown = payload.get("breakdown")
+        if "ctx" in payload:
+            try:
+                res, sev, rec = self.scorer.cache.evaluate(scale, _ctx(payload))
+            except (KeyError, TypeError, ValueError) as e:
+                raise HttpError(400, _error_json(e)["error"]) from None
+            score = res.score
+            breakdown = res.breakdown if breakdown else None
+        else:
+            score = _int(payload, "score")
+            sev = str(payload.get("severity", ""))
+            rec = str(payload.get("recommendation", ""))
+            if breakdown is not None and not isinstance(breakdown, dict):
+                raise HttpError(400, "breakdown должен быть объектом")
+        name, pid = payload.get("patient_name"), payload.get("patient_id")
+        try:
+            if name or pid:
+                data, filename = format_report_docx_local(str(name or ""), str(pid or ""), scale, score, sev, rec, breakdown)
+            else:
+                data, filename = format_report_docx_web(scale, score, sev, rec, breakdown)
+        except ValueError as e:
+            raise HttpError(400, str(e)) from None
+        disposition = f"attachment; filename=\"report.docx\"; filename*=UTF-8''{quote(filename)}"
+        return 200, DOCX_MIME, data, {"Content-Disposition": disposition}
+
+    @staticmethod
+    def _json(status: int, obj: Any) -> Tuple[int, str, bytes, Dict[str, str]]:
+        return status, "application/json; charset=utf-8", json.dumps(obj, ensure_ascii=False).encode("utf-8"), {}
+
+    # --- HTTP -------------------------------------------------------------------
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, *self._json(413, {"error": "Слишком длинные заголовки"}), keep_alive=False)
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    length = _content_length(headers.get("content-length"))
+                except HttpError as e:
+                    # Границы тела неизвестны — соединение дальше не читается
+                    await self._respond(writer, *self._json(e.status, {"error": str(e)}), keep_alive=False)
+                    return
+                body = await reader.readexactly(length) if length else b""
+                self.stats.requests += 1
+                try:
+                    response = await self.handle(method, target.split("?", 1)[0], body)
+                except HttpError as e:
+                    self.stats.errors += 1
+                    response = self._json(e.status, {"error": str(e)})
+                except Exception as e:  # pragma: no cover - защита от падения соединения
+                    self.stats.errors += 1
+                    response = self._json(500, {"error": f"{type(e).__name__}: {e}"})
+                await self._respond(writer, *response, keep_alive=keep_alive)
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, ctype: str, body: bytes,
+                       extra: Dict[str, str], keep_alive: bool = True) -> None:
+        head = [
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}",
+            f"Content-Type: {ctype}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        head.extend(f"{k}: {v}" for k, v in extra.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+        self.batcher = MicroBatcher(self.scorer, self.stats, self._max_batch, self._max_delay)
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._connection, host, port, limit=64 * 1024)
+        return self._server
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self.batcher is not None:
+            await self.batcher.stop()
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8765) -> None:
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def _content_length(value: Optional[str]) -> int:
+    if not value:
+        return 0
+    if not (value.isascii() and value.isdigit()):
+        raise HttpError(400, f"Некорректный Content-Length: {value!r}")
+    length = int(value)
+    if length > _MAX_BODY:
+        raise HttpError(413, "Слишком большой запрос")
+    return length
+
+
+def _parse_json(body: bytes) -> Dict[str, Any]:
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError as e:
+        raise HttpError(400, f"Некорректный JSON: {e}") from None
+    if not isinstance(payload, dict):
+        raise HttpError(400, "Ожидается JSON-объект")
+    return payload
+
+
+def _ctx(payload: Dict[str, Any]) -> Dict[str, Any]:
+    ctx = payload.get("ctx")
+    if not isinstance(ctx, dict):
+        raise HttpError(400, "Не указана анкета (ctx)")
+    return ctx
+
+
+def _int(payload: Dict[str, Any], key: str) -> int:
+    try:
+        return int(payload[key])
+    except (KeyError, TypeError, ValueError):
+        raise HttpError(400, f"Поле {key} должно быть целым числом") from None
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, max_batch: int = 256, max_delay: float = 0.0,
+          cache: Optional[ScoringCache] = None) -> None:
+    service = ScoringService(cache, max_batch=max_batch, max_delay=max_delay)
+    try:
+        asyncio.run(service.serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
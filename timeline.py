@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from analytics import N_LEVELS, Aggregates
+from records import CompactResult
+from scoring import SCALES, SEVERITY_LEVELS, ScoreResult, canonical_codes, get_scale, severity_from_score, total_encoded
+
+
+# Динамика пациента: визиты хранятся в SQLite в закодированном виде
+# (коды категорий + сумма, критичность, тяжесть).
+# Правка одного поля пересчитывает только затронутые критерии:
+# к сохранённой сумме прибавляется разность баллов старого и нового варианта.
+# Признак «прогрессирование истончения 48–72 ч» (FUSS), если он не указан
+# явно, выводится из минимальной толщины на предыдущем визите пациента
+# не ранее чем за 72 часа.
+# У визита хранится версия правил шкалы, по которой он посчитан: правки
+# пересчитываются по ней же, а не по действующей версии.
+#
+# Таблица aggregates — сводка реестра для analytics (тяжесть, суммы баллов,
+# выборы вариантов, совпадение FUSS/AUSS по визитам с одним временем);
+# обновляется в той же транзакции, что и визиты, только приращениями.
+
+THINNING_WINDOW_H = 72
+THINNING_FIELD = "thinning_progress_72h"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS visits (
+    id INTEGER PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    visited_at REAL NOT NULL,
+    scale TEXT NOT NULL,
+    codes BLOB NOT NULL,
+    score INTEGER NOT NULL,
+    critical INTEGER NOT NULL,
+    severity INTEGER NOT NULL,
+    min_thickness_um REAL,
+    thinning_derived INTEGER NOT NULL DEFAULT 0,
+    version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS visits_patient_time ON visits (patient_id, visited_at);
+CREATE INDEX IF NOT EXISTS visits_time ON visits (visited_at);
+CREATE TABLE IF NOT EXISTS aggregates (
+    scale TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (scale, kind, key)
+) WITHOUT ROWID;
+"""
+
+_BUMP = (
+    "INSERT INTO aggregates (scale, kind, key, n) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (scale, kind, key) DO UPDATE SET n = n + excluded.n"
+)
+
+_COLUMNS = (
+    "id, patient_id, visited_at, scale, codes, score, critical, severity, min_thickness_um, thinning_derived, version"
+)
+
+Timestamp = Union[datetime, float, int, str, None]
+
+
+@dataclass(frozen=True)
+class Visit:
+    id: int
+    patient_id: str
+    visited_at: float  # секунды UNIX (UTC)
+    scale: str
+    codes: bytes
+    score: int
+    critical: bool
+    severity: str
+    min_thickness_um: Optional[float]
+    thinning_derived: bool
+    version: str  # версия правил шкалы
+
+    @property
+    def visited(self) -> datetime:
+        return datetime.fromtimestamp(self.visited_at, tz=timezone.utc)
+
+    def result(self) -> ScoreResult:
+        return CompactResult(self.scale, self.codes, self.score, self.critical, self.version).to_score_result()
+
+
+def _timestamp(value: Timestamp) -> float:
+    if value is None:
+        return datetime.now(timezone.utc).timestamp()
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return float(value)
+
+
+def _visit(row: Tuple[Any, ...]) -> Visit:
+    vid, patient_id, visited_at, scale, codes, score, critical, severity, min_um, derived, version = row
+    return Visit(vid, patient_id, visited_at, scale, bytes(codes), score, bool(critical),
+                 SEVERITY_LEVELS[severity], min_um, bool(derived), version)
+
+
+def _pair_of(levels: Dict[str, int]) -> Optional[Tuple[int, int]]:
+    if "FUSS" in levels and "AUSS" in levels:
+        return levels["FUSS"], levels["AUSS"]
+    return None
+
+
+def _severity_index(scale: str, score: int, critical: bool, version: Optional[str] = None) -> int:
+    return SEVERITY_LEVELS.index(severity_from_score(score, scale, critical=critical, version=version))
+
+
+def _add_version_column(db: sqlite3.Connection) -> None:
+    # База, созданная до столбца version: её визиты посчитаны по действующим правилам
+    if "version" in {row[1] for row in db.execute("PRAGMA table_info(visits)")}:
+        return
+    with db:
+        db.execute("ALTER TABLE visits ADD COLUMN version TEXT")
+        db.executemany("UPDATE visits SET version = ? WHERE scale = ?",
+                       ((get_scale(name).version, name) for name in SCALES))
+
+
+class Timeline:
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        _add_version_column(self._db)
+        self._delta = Aggregates()
+        if not self._db.execute("SELECT 1 FROM aggregates LIMIT 1").fetchone() and len(self):
+            # База без сводки (создана до её появления) — один полный проход
+            self.rebuild_aggregates()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "Timeline":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM visits").fetchone()[0]
+
+    # --- запись ---------------------------------------------------------------
+
+    def add_visit(self, patient_id: str, scale: str, ctx: Dict[str, Any], visited_at: Timestamp = None,
+                  version: Optional[str] = None) -> Visit:
+        with self._write():
+            visit_id = self._add(str(patient_id), scale, ctx, _timestamp(visited_at), version)
+        return self.get_visit(visit_id)
+
+    def add_visits(self, visits: Iterable[Tuple[str, str, Dict[str, Any], Timestamp]]) -> int:
+        # Одна транзакция на всю пачку: (пациент, шкала, анкета, время визита)
+        count = 0
+        with self._write():
+            for patient_id, scale, ctx, visited_at in visits:
+                self._add(str(patient_id), scale, ctx, _timestamp(visited_at))
+                count += 1
+        return count
+
+    def _add(self, patient_id: str, scale: str, ctx: Dict[str, Any], ts: float, version: Optional[str] = None) -> int:
+        compiled = get_scale(scale, version)
+        min_um = ctx.get("min_thickness_um")
+        min_um = float(min_um) if min_um is not None else None
+        derived = THINNING_FIELD in compiled.keys and THINNING_FIELD not in ctx
+        if derived:
+            ctx = dict(ctx, **{THINNING_FIELD: self._thinning(patient_id, ts, min_um)})
+        codes = canonical_codes(scale, ctx, version)
+        score, critical = total_encoded(compiled, codes)
+        level = _severity_index(scale, score, critical, version)
+        levels: Dict[str, int] = {}
+        if compiled.name in ("FUSS", "AUSS"):
+            levels = self._levels(patient_id, ts)
+        cur = self._db.execute(
+            "INSERT INTO visits (patient_id, visited_at, scale, codes, score, critical, severity, min_thickness_um, "
+            "thinning_derived, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (patient_id, ts, compiled.name, bytes(codes), score, int(critical), level, min_um, int(derived),
+             compiled.version),
+        )
+        self._delta.add(compiled.name, codes, score, critical)
+        if compiled.name in ("FUSS", "AUSS"):
+            # Новый визит — последний по id: пара «после» известна без второго запроса
+            before = _pair_of(levels)
+            levels[compiled.name] = level
+            self._pair_delta(before, _pair_of(levels))
+        self._rederive_next(patient_id, ts, cur.lastrowid)
+        return cur.lastrowid
+
+    def update_visit(self, visit_id: int, changes: Dict[str, Any]) -> Visit:
+        # Пересчёт по разности баллов только изменённых критериев
+        with self._write():
+            visit = self.get_visit(visit_id)
+            compiled = get_scale(visit.scale, visit.version)
+            index = {key: i for i, key in enumerate(compiled.keys)}
+            cats = dict(compiled.categorized)
+            codes = bytearray(visit.codes)
+            min_um = visit.min_thickness_um
+            derived = visit.thinning_derived
+            if THINNING_FIELD in changes:
+                derived = False
+            if "min_thickness_um" in changes:
+                min_um = float(changes["min_thickness_um"])
+            for key, value in changes.items():
+                if key not in index:
+                    raise KeyError(key)
+                i = index[key]
+                codes[i] = compiled.codes[i][cats[i](value) if i in cats else value]
+            if derived and "min_thickness_um" in changes:
+                i = index[THINNING_FIELD]
+                codes[i] = compiled.codes[i][self._thinning(visit.patient_id, visit.visited_at, min_um, visit.id)]
+            score = visit.score + sum(
+                compiled.points[i][new] - compiled.points[i][old]
+                for i, (old, new) in enumerate(zip(visit.codes, codes)) if old != new
+            )
+            critical = any(codes[i] == c for i, c in compiled.critical_codes)
+            pair = self._pair(visit.patient_id, visit.visited_at)
+            self._db.execute(
+                "UPDATE visits SET codes = ?, score = ?, critical = ?, severity = ?, min_thickness_um = ?, "
+                "thinning_derived = ? WHERE id = ?",
+                (bytes(codes), score, int(critical), _severity_index(visit.scale, score, critical, visit.version),
+                 min_um, int(derived), visit_id),
+            )
+            self._delta.add(visit.scale, visit.codes, visit.score, visit.critical, -1)
+            self._delta.add(visit.scale, codes, score, critical)
+            self._pair_delta(pair, self._pair(visit.patient_id, visit.visited_at))
+            if "min_thickness_um" in changes:
+                self._rederive_next(visit.patient_id, visit.visited_at, visit_id)
+        return self.get_visit(visit_id)
+
+    def delete_visit(self, visit_id: int) -> None:
+        with self._write():
+            visit = self.get_visit(visit_id)
+            pair = self._pair(visit.patient_id, visit.visited_at)
+            self._db.execute("DELETE FROM visits WHERE id = ?", (visit_id,))
+            self._delta.add(visit.scale, visit.codes, visit.score, visit.critical, -1)
+            self._pair_delta(pair, self._pair(visit.patient_id, visit.visited_at))
+            self._rederive_next(visit.patient_id, visit.visited_at, visit_id)
+
+    # --- истончение -------------------------------------------------------------
+
+    def _previous_thickness(self, patient_id: str, ts: float, exclude: int = 0) -> Optional[float]:
+        row = self._db.execute(
+            "SELECT min_thickness_um FROM visits WHERE patient_id = ? AND visited_at < ? AND visited_at >= ? "
+            "AND min_thickness_um IS NOT NULL AND id != ? ORDER BY visited_at DESC, id DESC LIMIT 1",
+            (patient_id, ts, ts - THINNING_WINDOW_H * 3600, exclude),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _thinning(self, patient_id: str, ts: float, min_um: Optional[float], exclude: int = 0) -> int:
+        if min_um is None:
+            return 0
+        prev = self._previous_thickness(patient_id, ts, exclude)
+        return int(prev is not None and min_um < prev)
+
+    def _rederive_next(self, patient_id: str, ts: float, visit_id: int) -> None:
+        # Толщина визита влияет на выведенный признак визитов в следующие 72 часа
+        rows = self._db.execute(
+            f"SELECT {_COLUMNS} FROM visits WHERE patient_id = ? AND visited_at > ? AND visited_at <= ? "
+            "AND thinning_derived = 1 AND id != ? ORDER BY visited_at",
+            (patient_id, ts, ts + THINNING_WINDOW_H * 3600, visit_id),
+        ).fetchall()
+        for row in rows:
+            visit = _visit(row)
+            compiled = get_scale(visit.scale, visit.version)
+            i = compiled.keys.index(THINNING_FIELD)
+            new = compiled.codes[i][self._thinning(patient_id, visit.visited_at, visit.min_thickness_um, visit.id)]
+            old = visit.codes[i]
+            if new == old:
+                continue
+            codes = bytearray(visit.codes)
+            codes[i] = new
+            score = visit.score + compiled.points[i][new] - compiled.points[i][old]
+            pair = self._pair(patient_id, visit.visited_at)
+            self._db.execute(
+                "UPDATE visits SET codes = ?, score = ?, severity = ? WHERE id = ?",
+                (bytes(codes), score, _severity_index(visit.scale, score, visit.critical, visit.version), visit.id),
+            )
+            self._delta.add(visit.scale, visit.codes, visit.score, visit.critical, -1)
+            self._delta.add(visit.scale, codes, score, visit.critical)
+            self._pair_delta(pair, self._pair(patient_id, visit.visited_at))
+
+    # --- сводка -----------------------------------------------------------------
+
+    @contextmanager
+    def _write(self) -> Iterator[None]:
+        # Транзакция записи: приращения сводки копятся в памяти (_delta)
+        # и пишутся одним executemany перед фиксацией
+        self._delta = Aggregates()
+        try:
+            with self._db:
+                yield
+                self._db.executemany(_BUMP, self._delta.rows())
+        finally:
+            self._delta = Aggregates()
+
+    def _levels(self, patient_id: str, ts: float) -> Dict[str, int]:
+        # Тяжесть FUSS/AUSS визитов пациента с этим временем (при повторах — последние по id)
+        return dict(self._db.execute(
+            "SELECT scale, severity FROM visits WHERE patient_id = ? AND visited_at = ? "
+            "AND scale IN ('FUSS', 'AUSS') ORDER BY id",
+            (patient_id, ts),
+        ).fetchall())
+
+    def _pair(self, patient_id: str, ts: float) -> Optional[Tuple[int, int]]:
+        return _pair_of(self._levels(patient_id, ts))
+
+    def _pair_delta(self, before: Optional[Tuple[int, int]], after: Optional[Tuple[int, int]]) -> None:
+        if before != after:
+            if before is not None:
+                self._delta.add_pair(*before, sign=-1)
+            if after is not None:
+                self._delta.add_pair(*after)
+
+    def aggregates(self) -> Aggregates:
+        # Сводка без чтения визитов: несколько сотен строк при любом размере реестра
+        return Aggregates.from_rows(self._db.execute("SELECT scale, kind, key, n FROM aggregates WHERE n != 0"))
+
+    def rebuild_aggregates(self) -> Aggregates:
+        # Полный пересчёт сводки по визитам (миграция старой базы, сверка)
+        agg = Aggregates()
+        for scale, codes, score, critical in self._db.execute("SELECT scale, codes, score, critical FROM visits"):
+            agg.add(scale, codes, score, bool(critical))
+        for (key,) in self._db.execute(
+            "SELECT f.severity * ? + a.severity FROM visits f JOIN visits a "
+            "ON a.patient_id = f.patient_id AND a.visited_at = f.visited_at AND a.scale = 'AUSS' "
+            "WHERE f.scale = 'FUSS' "
+            "AND f.id = (SELECT MAX(id) FROM visits WHERE patient_id = f.patient_id AND visited_at = f.visited_at "
+            "AND scale = 'FUSS') "
+            "AND a.id = (SELECT MAX(id) FROM visits WHERE patient_id = a.patient_id AND visited_at = a.visited_at "
+            "AND scale = 'AUSS')",
+            (N_LEVELS,),
+        ):
+            agg.agreement[key // N_LEVELS][key % N_LEVELS] += 1
+        with self._db:
+            self._db.execute("DELETE FROM aggregates")
+            self._db.executemany("INSERT INTO aggregates (scale, kind, key, n) VALUES (?, ?, ?, ?)", agg.rows())
+        return agg
+
+    # --- чтение -----------------------------------------------------------------
+
+    def get_visit(self, visit_id: int) -> Visit:
+        row = self._db.execute(f"SELECT {_COLUMNS} FROM visits WHERE id = ?", (visit_id,)).fetchone()
+        if row is None:
+            raise KeyError(visit_id)
+        return _visit(row)
+
+    def trajectory(self, patient_id: str, scale: Optional[str] = None,
+                   since: Timestamp = None, until: Timestamp = None) -> List[Visit]:
+        sql = f"SELECT {_COLUMNS} FROM visits WHERE patient_id = ?"
+        params: List[Any] = [str(patient_id)]
+        if since is not None:
+            sql += " AND visited_at >= ?"
+            params.append(_timestamp(since))
+        if until is not None:
+            sql += " AND visited_at <= ?"
+            params.append(_timestamp(until))
+        if scale is not None:
+            sql += " AND scale = ?"
+            params.append(scale)
+        sql += " ORDER BY visited_at, id"
+        return [_visit(row) for row in self._db.execute(sql, params)]
+
+    def latest(self, patient_id: str, scale: Optional[str] = None) -> Optional[Visit]:
+        sql = f"SELECT {_COLUMNS} FROM visits WHERE patient_id = ?"
+        params: List[Any] = [str(patient_id)]
+        if scale is not None:
+            sql += " AND scale = ?"
+            params.append(scale)
+        row = self._db.execute(sql + " ORDER BY visited_at DESC, id DESC LIMIT 1", params).fetchone()
+        return _visit(row) if row else None
+
+    def patients(self) -> List[str]:
+        return [row[0] for row in self._db.execute("SELECT DISTINCT patient_id FROM visits ORDER BY patient_id")]
@@ -0,0 +1,456 @@
+from __future__ import annotations
+
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from batch import _columns, encode_cohort
+from score_table import DEBRIDEMENT_FIELDS, _THICKNESS_FIELDS, _representatives
+from scoring import (
+    CRITERIA,
+    SEVERITY_LEVELS,
+    canonical_codes,
+    choose_debridement,
+    get_scale,
+    parse_option,
+    recommend_treatment,
+)
+
+
+# «Что если»: пересчёт когорты при других баллах критериев и порогах тяжести.
+# Когорта кодируется один раз (коды вариантов n × k, uint8, + вариант кросслинкинга);
+# сценарий меняет баллы только части критериев, поэтому новая сумма — это
+# базовая сумма плюс разности баллов изменённых критериев (по выборке на критерий).
+# Сценарии только с порогами считаются по гистограмме (сумма, критичность, вариант)
+# без прохода по визитам. Критичность (толщина <200 мкм, десцеметоцеле) сценарием
+# не меняется.
+#
+# Итог по сценарию и шкале — матрицы переклассификации тяжести и тактики
+# (строка — действующие правила, столбец — сценарий) и число сменившихся рекомендаций.
+
+N_LEVELS = len(SEVERITY_LEVELS)
+PATHWAYS: Tuple[str, ...] = (
+    "Медикаментозная терапия",
+    "Кросслинкинг со скарификацией",
+    "Кросслинкинг с фемтосекундным лоскутом",
+    "Экстренная кератопластика",
+)
+
+
+# --- сценарии -----------------------------------------------------------------------
+
+_option = parse_option
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    # шкала -> критерий -> вариант -> баллы (частичная замена)
+    points: Dict[str, Dict[str, Dict[Any, int]]] = field(default_factory=dict)
+    # шкала -> критерий -> множитель к действующим баллам (с округлением)
+    weights: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    # шкала -> верхние границы «Лёгкая», «Средняя», «Тяжёлая»
+    thresholds: Dict[str, Tuple[int, ...]] = field(default_factory=dict)
+
+    @classmethod
+    def from_json(cls, obj: Dict[str, Any]) -> "Scenario":
+        points = {
+            scale: {key: {_option(key, opt): int(p) for opt, p in opts.items()} for key, opts in crit.items()}
+            for scale, crit in (obj.get("points") or {}).items()
+        }
+        weights = {
+            scale: {key: float(w) for key, w in crit.items()}
+            for scale, crit in (obj.get("weights") or {}).items()
+        }
+        thresholds = {scale: tuple(int(t) for t in ts) for scale, ts in (obj.get("thresholds") or {}).items()}
+        scenario = cls(str(obj.get("name") or "?"), points, weights, thresholds)
+        scenario.validate()
+        return scenario
+
+    @classmethod
+    def from_version(cls, scale: str, version: str) -> "Scenario":
+        # Переход на другую версию правил (scoring.SCALE_VERSIONS) как сценарий:
+        # возможен, если у версии те же критерии и то же правило критичности
+        current, target = get_scale(scale), get_scale(scale, version)
+        if (target.keys, target.critical) != (current.keys, current.critical):
+            raise ValueError(f"{scale} v{version}: другой состав критериев или правило критичности — "
+                             "сравните версии через batch.score_versions")
+        points = {
+            key: dict(zip(CRITERIA[key].options, new))
+            for key, old, new in zip(current.keys, current.points, target.points) if old != new
+        }
+        scenario = cls(f"{scale} v{version}", {scale: points} if points else {}, thresholds={scale: target.thresholds})
+        scenario.validate()
+        return scenario
+
+    def validate(self) -> None:
+        for scale in set(self.points) | set(self.weights) | set(self.thresholds):
+            compiled = get_scale(scale)
+            for key in set(self.points.get(scale, {})) | set(self.weights.get(scale, {})):
+                if key not in compiled.keys:
+                    raise ValueError(f"{self.name}: критерия {key!r} нет в шкале {scale}")
+            ts = self.thresholds.get(scale)
+            if ts is not None and (len(ts) != N_LEVELS - 1 or list(ts) != sorted(ts)):
+                raise ValueError(f"{self.name}: пороги {scale} должны быть {N_LEVELS - 1} неубывающих числа")
+
+    def scale_points(self, scale: str) -> Tuple[Tuple[int, ...], ...]:
+        # Баллы по коду варианта для каждого критерия шкалы при этом сценарии
+        compiled = get_scale(scale)
+        out = []
+        for key, base in zip(compiled.keys, compiled.points):
+            pts = list(base)
+            w = self.weights.get(scale, {}).get(key)
+            if w is not None:
+                pts = [int(p * w + 0.5) for p in pts]
+            for opt, p in self.points.get(scale, {}).get(key, {}).items():
+                pts[compiled.codes[compiled.keys.index(key)][opt]] = p
+            out.append(tuple(pts))
+        return tuple(out)
+
+    def scale_thresholds(self, scale: str) -> Tuple[int, ...]:
+        return self.thresholds.get(scale) or get_scale(scale).thresholds
+
+    def touches(self, scale: str) -> bool:
+        return scale in self.points or scale in self.weights or scale in self.thresholds
+
+
+def load_scenarios(path: str) -> List[Scenario]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("scenarios", [data])
+    return [Scenario.from_json(obj) for obj in data]
+
+
+def threshold_grid(scale: str, spread: int = 2, step: int = 1) -> List[Scenario]:
+    # Все сдвиги каждого порога на -spread..+spread (с шагом step) — (2·spread/step + 1)^3 сценариев
+    base = get_scale(scale).thresholds
+    shifts = range(-spread, spread + 1, step)
+    out = []
+    for delta in itertools.product(shifts, repeat=len(base)):
+        ts = tuple(t + d for t, d in zip(base, delta))
+        if list(ts) == sorted(ts):
+            out.append(Scenario(f"{scale} {'/'.join(map(str, ts))}", thresholds={scale: ts}))
+    return out
+
+
+# --- когорта ------------------------------------------------------------------------
+
+def _variant_table() -> Tuple[List[str], np.ndarray, np.ndarray]:
+    # Вариант кросслинкинга (choose_debridement) для каждого сочетания кодов полей выбора.
+    # -> (тексты вариантов, таблица по смешанному индексу кодов, шаги разрядов)
+    reps = [_representatives(key) for key in DEBRIDEMENT_FIELDS]
+    sizes = [len(r) for r in reps]
+    texts: List[str] = []
+    table = np.zeros(int(np.prod(sizes)), dtype=np.uint8)
+    strides = np.cumprod([1] + sizes[:-1])
+    for digits in itertools.product(*(range(n) for n in sizes)):
+        text = choose_debridement({key: r[d] for key, r, d in zip(DEBRIDEMENT_FIELDS, reps, digits)})
+        if text not in texts:
+            texts.append(text)
+        table[int(np.dot(digits, strides))] = texts.index(text)
+    return texts, table, strides
+
+
+_VARIANTS: Optional[Tuple[List[str], np.ndarray, np.ndarray]] = None
+
+
+def _variants() -> Tuple[List[str], np.ndarray, np.ndarray]:
+    global _VARIANTS
+    if _VARIANTS is None:
+        _VARIANTS = _variant_table()
+    return _VARIANTS
+
+
+def _variant_context(variant: int) -> Dict[str, Any]:
+    # Анкета-представитель варианта кросслинкинга (для recommend_treatment)
+    texts, table, strides = _variants()
+    reps = [_representatives(key) for key in DEBRIDEMENT_FIELDS]
+    index = int(np.flatnonzero(table == variant)[0])
+    digits = [(index // int(s)) % len(r) for s, r in zip(strides, reps)]
+    return {key: r[d] for key, r, d in zip(DEBRIDEMENT_FIELDS, reps, digits)}
+
+
+class WhatIfCohort:
+    # Закодированная когорта одной шкалы
+    def __init__(self, scale: str, codes: np.ndarray, variant: np.ndarray):
+        compiled = get_scale(scale)
+        codes = np.asarray(codes, dtype=np.uint8)
+        if codes.ndim != 2 or codes.shape[1] != len(compiled.keys):
+            raise ValueError(f"Ожидаются коды n × {len(compiled.keys)} для шкалы {compiled.name}")
+        self.scale = compiled.name
+        self.columns = [np.ascontiguousarray(codes[:, i]) for i in range(codes.shape[1])]
+        self.variant = np.asarray(variant, dtype=np.uint8)
+        self.critical = np.zeros(len(self.variant), dtype=bool)
+        for i, code in compiled.critical_codes:
+            self.critical |= self.columns[i] == code
+        self.base_points = tuple(np.asarray(p, dtype=np.int32) for p in compiled.points)
+        self.base_score = np.zeros(len(self.variant), dtype=np.int32)
+        for col, pts in zip(self.columns, self.base_points):
+            self.base_score += pts.take(col)
+        self._histogram: Optional[Tuple[np.ndarray, ...]] = None
+
+    def __len__(self) -> int:
+        return len(self.variant)
+
+    @classmethod
+    def from_columns(cls, cohort: Any, scale: str) -> "WhatIfCohort":
+        # Столбцы, как в batch.score_cohort; отсутствующая толщина для выбора
+        # кросслинкинга считается нулевой (как debridement_inputs)
+        cols = _columns(cohort)
+        keys = get_scale(scale).keys
+        codes = encode_cohort(cols, keys)
+        _, table, strides = _variants()
+        d_codes = encode_cohort(cols, DEBRIDEMENT_FIELDS)
+        index = np.zeros(len(codes[keys[0]]), dtype=np.int64)
+        for key, stride in zip(DEBRIDEMENT_FIELDS, strides):
+            col = d_codes[key].astype(np.int64)
+            if key in _THICKNESS_FIELDS and key not in cols:
+                col = np.full_like(col, len(CRITERIA[key].options) - 1)
+            index += col * int(stride)
+        return cls(scale, np.stack([codes[key] for key in keys], axis=1), table.take(index))
+
+    @classmethod
+    def from_contexts(cls, contexts: Iterable[Dict[str, Any]], scale: str) -> "WhatIfCohort":
+        texts = _variants()[0]
+        codes = bytearray()
+        variant = bytearray()
+        for ctx in contexts:
+            codes += bytes(canonical_codes(scale, ctx))
+            variant.append(texts.index(choose_debridement(ctx)))
+        return cls._from_buffers(scale, codes, variant)
+
+    @classmethod
+    def _from_buffers(cls, scale: str, codes: bytearray, variant: bytearray) -> "WhatIfCohort":
+        width = len(get_scale(scale).keys)
+        return cls(scale, np.frombuffer(bytes(codes), dtype=np.uint8).reshape(-1, width),
+                   np.frombuffer(bytes(variant), dtype=np.uint8))
+
+    def histogram(self) -> Tuple[np.ndarray, ...]:
+        # (сумма, критичность, вариант, число визитов) по различным сочетаниям
+        if self._histogram is None:
+            nv = len(_variants()[0])
+            key = (self.base_score.astype(np.int64) * 2 + self.critical) * nv + self.variant
+            uniq, counts = np.unique(key, return_counts=True)
+            self._histogram = (
+                (uniq // nv // 2).astype(np.int32), ((uniq // nv) % 2).astype(bool),
+                (uniq % nv).astype(np.uint8), counts,
+            )
+        return self._histogram
+
+
+def read_cohorts(path: str, scale: str = "row", fmt: Optional[str] = None,
+                 delimiter: Optional[str] = None) -> Tuple[List[WhatIfCohort], int]:
+    # Выгрузка в формате пакетного расчёта (pipeline) -> когорты по шкалам и
+    # число пропущенных строк с ошибками
+    from pipeline import coerce_row, read_rows, row_scales, scale_context
+
+    texts = _variants()[0]
+    buffers: Dict[str, Tuple[bytearray, bytearray]] = {}
+    skipped = 0
+    for raw in read_rows(path, fmt, delimiter):
+        try:
+            ctx = coerce_row(raw)
+            encoded = []
+            for name in row_scales(ctx, scale):
+                sctx = scale_context(ctx, name)
+                encoded.append((name, bytes(canonical_codes(name, sctx)), texts.index(choose_debridement(sctx))))
+        except (KeyError, TypeError, ValueError):
+            skipped += 1
+            continue
+        for name, codes, variant in encoded:
+            codes_buf, variant_buf = buffers.setdefault(name, (bytearray(), bytearray()))
+            codes_buf += codes
+            variant_buf.append(variant)
+    cohorts = [WhatIfCohort._from_buffers(name, *bufs) for name, bufs in buffers.items()]
+    return cohorts, skipped
+
+
+# --- расчёт ---------------------------------------------------------------------------
+
+@dataclass
+class ScenarioResult:
+    scenario: str
+    scale: str
+    visits: int
+    severity: List[List[int]]   # [действующая тяжесть][тяжесть по сценарию]
+    pathways: List[List[int]]   # [действующая тактика][тактика по сценарию]
+    recommendation_changed: int
+    mean_score_delta: float
+
+    @property
+    def reclassified(self) -> int:
+        return self.visits - sum(self.severity[i][i] for i in range(N_LEVELS))
+
+    @property
+    def upgraded(self) -> int:
+        return sum(n for i, row in enumerate(self.severity) for j, n in enumerate(row) if j > i)
+
+    @property
+    def downgraded(self) -> int:
+        return sum(n for i, row in enumerate(self.severity) for j, n in enumerate(row) if j < i)
+
+    @property
+    def pathway_changed(self) -> int:
+        return self.visits - sum(self.pathways[i][i] for i in range(len(PATHWAYS)))
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "scenario": self.scenario,
+            "scale": self.scale,
+            "visits": self.visits,
+            "reclassified": self.reclassified,
+            "upgraded": self.upgraded,
+            "downgraded": self.downgraded,
+            "pathway_changed": self.pathway_changed,
+            "recommendation_changed": self.recommendation_changed,
+            "mean_score_delta": self.mean_score_delta,
+            "severity": self.severity,
+            "pathways": self.pathways,
+        }
+
+
+def _severity(score: np.ndarray, critical: np.ndarray, thresholds: Sequence[int]) -> np.ndarray:
+    sev = np.zeros(score.shape[0], dtype=np.uint8)
+    for edge in thresholds:
+        sev += score > edge
+    sev[critical] = N_LEVELS - 1
+    return sev
+
+
+def _outcome_tables(scale: str) -> Tuple[np.ndarray, np.ndarray]:
+    # (тяжесть, вариант) -> индекс тактики и индекс текста рекомендации
+    texts = _variants()[0]
+    nv = len(texts)
+    # Текст варианта с фемтосекундным лоскутом: толщина в норме, центральная зона
+    femto = choose_debridement({"min_thickness_um": 400, "mean_thickness_um": 600, "localization": "central"})
+    pathway = np.zeros(N_LEVELS * nv, dtype=np.uint8)
+    rec = np.zeros(N_LEVELS * nv, dtype=np.int32)
+    seen: Dict[str, int] = {}
+    for level in range(N_LEVELS):
+        for v in range(nv):
+            ctx = _variant_context(v)
+            text = recommend_treatment(scale, SEVERITY_LEVELS[level], 0, ctx)
+            rec[level * nv + v] = seen.setdefault(text, len(seen))
+            if level == 0:
+                pathway[level * nv + v] = 0
+            elif level == N_LEVELS - 1:
+                pathway[level * nv + v] = len(PATHWAYS) - 1
+            else:
+                pathway[level * nv + v] = 2 if texts[v] == femto else 1
+    return pathway, rec
+
+
+def _matrix(a: np.ndarray, b: np.ndarray, size: int, weights: Optional[np.ndarray] = None) -> List[List[int]]:
+    counts = np.bincount(a.astype(np.int64) * size + b, weights=weights, minlength=size * size)
+    return counts.astype(np.int64).reshape(size, size).tolist()
+
+
+class WhatIfEngine:
+    def __init__(self, cohorts: Sequence[WhatIfCohort]):
+        self.cohorts = {c.scale: c for c in cohorts}
+        self._tables = {scale: _outcome_tables(scale) for scale in self.cohorts}
+        self._nv = len(_variants()[0])
+        # Действующая тяжесть: по визитам и по строкам гистограммы
+        self._base: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for scale, cohort in self.cohorts.items():
+            thresholds = get_scale(scale).thresholds
+            score, critical = cohort.histogram()[:2]
+            self._base[scale] = (
+                _severity(cohort.base_score, cohort.critical, thresholds),
+                _severity(score, critical, thresholds),
+            )
+
+    def evaluate_arrays(self, scenario: Scenario, scale: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # -> (сумма, индекс тяжести, индекс рекомендации) по визитам
+        cohort = self.cohorts[scale]
+        score = cohort.base_score
+        for col, base, new in zip(cohort.columns, cohort.base_points, scenario.scale_points(scale)):
+            delta = np.asarray(new, dtype=np.int32) - base
+            if delta.any():
+                score = score + delta.take(col)
+        sev = _severity(score, cohort.critical, scenario.scale_thresholds(scale))
+        _, rec = self._tables[scale]
+        return score, sev, rec.take(sev.astype(np.int64) * self._nv + cohort.variant)
+
+    def evaluate(self, scenario: Scenario, scale: str) -> ScenarioResult:
+        cohort = self.cohorts[scale]
+        pathway, rec = self._tables[scale]
+        nv = self._nv
+        base_sev, base_hist_sev = self._base[scale]
+        if scale not in scenario.points and scale not in scenario.weights:
+            # Только пороги: достаточно гистограммы (сумма, критичность, вариант)
+            score, critical, variant, counts = cohort.histogram()
+            new_sev = _severity(score, critical, scenario.scale_thresholds(scale))
+            old_out = base_hist_sev.astype(np.int64) * nv + variant
+            new_out = new_sev.astype(np.int64) * nv + variant
+            return ScenarioResult(
+                scenario.name, scale, len(cohort),
+                _matrix(base_hist_sev, new_sev, N_LEVELS, counts),
+                _matrix(pathway.take(old_out), pathway.take(new_out), len(PATHWAYS), counts),
+                int(counts[rec.take(old_out) != rec.take(new_out)].sum()),
+                0.0,
+            )
+        score, new_sev, new_rec = self.evaluate_arrays(scenario, scale)
+        old_out = base_sev.astype(np.int64) * nv + cohort.variant
+        new_out = new_sev.astype(np.int64) * nv + cohort.variant
+        return ScenarioResult(
+            scenario.name, scale, len(cohort),
+            _matrix(base_sev, new_sev, N_LEVELS),
+            _matrix(pathway.take(old_out), pathway.take(new_out), len(PATHWAYS)),
+            int(np.count_nonzero(rec.take(old_out) != new_rec)),
+            float((score - cohort.base_score).mean()) if len(cohort) else 0.0,
+        )
+
+    def run(self, scenarios: Iterable[Scenario]) -> List[ScenarioResult]:
+        return [
+            self.evaluate(scenario, scale)
+            for scenario in scenarios for scale in self.cohorts if scenario.touches(scale)
+        ]
+
+
+_ENGINE: Optional[WhatIfEngine] = None
+
+
+def _init_worker(cohorts: Sequence[WhatIfCohort]) -> None:
+    global _ENGINE
+    _ENGINE = WhatIfEngine(cohorts)
+
+
+def _run_chunk(scenarios: List[Scenario]) -> List[ScenarioResult]:
+    return _ENGINE.run(scenarios)
+
+
+def run_scenarios(
+    cohorts: Sequence[WhatIfCohort],
+    scenarios: Sequence[Scenario],
+    workers: Optional[int] = None,
+    chunksize: int = 8,
+) -> List[ScenarioResult]:
+    # Сценарии делятся между процессами; когорта передаётся каждому процессу один раз
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(scenarios) <= chunksize:
+        return WhatIfEngine(cohorts).run(scenarios)
+    chunks = [list(scenarios[i:i + chunksize]) for i in range(0, len(scenarios), chunksize)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(list(cohorts),)) as pool:
+        return [res for part in pool.map(_run_chunk, chunks) for res in part]
+
+
+def format_results(results: Sequence[ScenarioResult], top: int = 20) -> str:
+    lines = []
+    ordered = sorted(results, key=lambda r: -r.reclassified)
+    for r in ordered[:top]:
+        share = r.reclassified / r.visits if r.visits else 0.0
+        lines.append(
+            f"{r.scenario} [{r.scale}]: тяжесть изменится у {r.reclassified} ({share:.1%}; "
+            f"выше {r.upgraded}, ниже {r.downgraded}), тактика — у {r.pathway_changed}, "
+            f"рекомендация — у {r.recommendation_changed}"
+        )
+    if len(ordered) > top:
+        lines.append(f"… ещё сценариев: {len(ordered) - top}")
+    return "\n".join(lines)